@@ -0,0 +1,206 @@
+# Authorship: NCAR Earth Observing Laboratory Data Management & Services Group
+# Contact: eol-archive@ucar.edu
+#
+# Licensing: The code associated with this document is provided freely and openly.
+# Users are hereby granted a license to access and use this code, unless otherwise
+# stated, subject to the terms and conditions of the GNU Affero General Public
+# License 3.0 (AGPL-3.0; https://www.gnu.org/licenses/agpl-3.0.en.html). This
+# documentation and associated code are provided "as is" and are not supported.
+# By using or downloading this code, the user agrees to the terms and conditions
+# set forth in this code and in the "Using Python to View OPeNDAP Files" document.
+#
+# Acknowledgment: This work was sponsored by the National Science Foundation.
+# This material is based upon work supported by the National Center for Atmospheric
+# Research, a major facility sponsored by the National Science Foundation and managed
+# by the University Corporation for Atmospheric Research. Any opinions, findings
+# and conclusions or recommendations expressed in this material do not necessarily
+# reflect the views of the National Science Foundation.
+#
+# To run this script, use the following command:
+# 		python3 python_batch.py {job file} [{job file} ...]
+# where {job file} is a JSON (*.json) or YAML (*.yaml, *.yml) file listing the plots to make.
+#
+# NOTE: This script requires the same packages as python_xy.py and python_xyz.py, plus
+#		pyyaml (only to read YAML job files)
+#
+# The python_batch.py script creates the plots of python_xy.py and python_xyz.py without
+# prompting for anything, so it can be run from cron or a pipeline scheduler. Every job
+# in the job file gives the answers to the questions the scripts would otherwise ask.
+# The jobs are run one after another in the same process, sharing the HTTP connection
+# and the on-disk cache of downloaded variables. A job that fails is reported and the
+# remaining jobs are still run; the script exits with status 1 if any job failed.
+#
+# A job file holds a list of jobs, or an object with a "jobs" list and any of the
+# options below that apply to every job (e.g. "cache_dir"). Each job is an object with:
+#	script: "xy" for python_xy.py or "xyz" for python_xyz.py
+#	url: the OPeNDAP link to the desired dataset, or a list of links
+#	merge: (optional) true to plot the data of all the links together, as the --merge option
+#	start, end: (optional) time window, YYYY/mm/dd-HH:MM or YYYY/mm/dd (UTC)
+#	directory: (optional) directory to save the plots in, the current one by default
+#	cache_dir, cache_size: (optional) as the --cache-dir and --cache-size options
+#	jobs: (optional) number of processes creating the plots of the job, as the --jobs option
+#	stream: (optional) true to read the data in chunks, as the --stream option
+#	chunk_size: (optional) size of the chunks in MB, as the --chunk-size option
+#	retries, timeout, range_rows: (optional) as the --retries, --timeout and --range-rows
+#		options
+#	decimate: (optional) true to thin out long records before plotting them, as the
+#		--decimate option (python_xy.py only)
+#	layout: (optional) station, grid or overlay, to plot pages of several stations, as the
+#		--layout option (python_xy.py only)
+#	per_page: (optional) number of stations on each page, as the --per-page option
+#	rollup: (optional) hourly or daily, to plot the statistics of each station for the
+#		period instead of every value, as the --rollup option (python_xy.py only)
+#	stats: (optional) list of statistics to plot with rollup, as the --stats option
+#	incremental: (optional) true to only download the rows added since the last run and
+#		plot the stations that have them again, as the --incremental option
+#		(python_xy.py only, with cache_dir)
+#	new_figures: (optional) true to create a new figure for every plot, as the
+#		--new-figures option
+#	format: (optional) file format of the plots, png, svg or pdf, as the --format option
+#	output_dir, tarball: (optional) as the --output-dir and --tarball options (relative
+#		to the directory of the job)
+#	grid_output: (optional) file to save the variable gridded at every datetime in
+#		instead of 3D plots, a .gif, .mp4 or .nc file, as the --grid-output option
+#		(python_xyz.py only, in the directory of the job)
+#	grid_size, fps: (optional) as the --grid-size and --fps options (python_xyz.py only)
+#	export: (optional) Parquet, Feather or NetCDF file to save the rows of the plots in, as
+#		the --export option (in the directory of the job)
+#	profile: (optional) true to print the time taken by each stage, as the --profile option
+#	profile_output: (optional) JSON file to save the profile in, as the --profile-output
+#		option (in the directory of the job)
+# and for script "xy":
+#	vars: list of variables to plot against time
+#	stations: list of stations (network_name-platform_name), or "all"
+#	y_label: label on the y-axis
+# and for script "xyz":
+#	var: variable to plot
+#	time: "nominal" or "actual"
+#	datetimes: list of datetimes (YYYY/mm/dd-HH:MM, UTC), or "all"
+#	z_label: label on the z-axis
+#
+# e.g. a YAML job file:
+#	cache_dir: /scratch/qcf_cache
+#	jobs:
+#	  - script: xy
+#	    url: https://data.eol.ucar.edu/opendap/...
+#	    vars: [temp_air, dew_point]
+#	    stations: [ASOS-KICT, ASOS-KOKC]
+#	    start: 2022/07/01
+#	    end: 2022/07/07
+#	    y_label: Degrees (celsius)
+#	  - script: xyz
+#	    url: https://data.eol.ucar.edu/opendap/...
+#	    var: temp_air
+#	    time: nominal
+#	    datetimes: all
+#	    start: 2022/07/01
+#	    end: 2022/07/01-23:00
+#	    z_label: Degrees (celsius)
+#
+
+# Import necessary packages:
+import argparse
+import json
+import os
+import sys
+import traceback
+import python_xy
+import python_xyz
+
+
+# Required options of each script and the command line option they are passed as
+# (None for the OPeNDAP link, which comes first)
+required = {
+	"xy": [("url", None), ("vars", "--vars"), ("stations", "--station"), ("y_label", "--ylabel")],
+	"xyz": [("url", None), ("var", "--var"), ("time", "--time"), ("datetimes", "--datetime"), ("z_label", "--zlabel")],
+}
+
+# Optional options shared by both scripts
+optional = [("start", "--start"), ("end", "--end"), ("cache_dir", "--cache-dir"), ("cache_size", "--cache-size"), ("jobs", "--jobs"), ("chunk_size", "--chunk-size"), ("retries", "--retries"), ("timeout", "--timeout"), ("range_rows", "--range-rows"), ("profile_output", "--profile-output"), ("export", "--export"), ("format", "--format"), ("output_dir", "--output-dir"), ("tarball", "--tarball"), ("layout", "--layout"), ("per_page", "--per-page"), ("rollup", "--rollup"), ("stats", "--stats"), ("grid_output", "--grid-output"), ("grid_size", "--grid-size"), ("fps", "--fps")]
+
+# Options shared by both scripts that are turned on by a true value
+flags = [("stream", "--stream"), ("merge", "--merge"), ("profile", "--profile"), ("new_figures", "--new-figures"), ("decimate", "--decimate"), ("incremental", "--incremental")]
+
+# Functions:
+
+# readJobs(path) function reads a JSON or YAML job file and returns its list of jobs, with
+# the options given for every job filled in.
+def readJobs(path):
+	with open(path) as f:
+		if path.endswith(".yaml") or path.endswith(".yml"):
+			import yaml
+			spec = yaml.safe_load(f)
+		else:
+			spec = json.load(f)
+	if isinstance(spec, list):
+		return spec
+	defaults = dict((key, value) for (key, value) in spec.items() if key != "jobs")
+	return [dict(defaults, **job) for job in spec.get("jobs", [])]
+
+
+# toArgs(job) function turns a job into the command line arguments of its script, raising a
+# ValueError if it is missing an option the script would otherwise prompt for.
+def toArgs(job):
+	script = job.get("script")
+	if script not in required:
+		raise ValueError("Invalid script entered: " + str(script) + " (use xy or xyz)")
+	args = []
+	for (key, option) in required[script] + optional:
+		if key not in job:
+			if option is None or (key, option) in required[script]:
+				raise ValueError("Missing " + key + " for " + script + " job")
+			continue
+		value = job[key]
+		if option is None:
+			args += [str(i) for i in value] if isinstance(value, list) else [str(value)]
+			continue
+		if isinstance(value, list):
+			value = ",".join(str(i) for i in value)
+		args += [option, str(value)]
+	for (key, option) in flags:
+		if job.get(key):
+			args.append(option)
+	return script, args
+
+
+# runJob(job) function creates the plots of one job in its directory.
+def runJob(job):
+# Resolve a relative cache directory before changing to the job's directory
+	if job.get("cache_dir"):
+		job = dict(job, cache_dir=os.path.abspath(os.path.expanduser(job["cache_dir"])))
+	(script, args) = toArgs(job)
+	cwd = os.getcwd()
+	if job.get("directory"):
+		os.makedirs(job["directory"], exist_ok=True)
+		os.chdir(job["directory"])
+	try:
+		if script == "xy":
+			python_xy.main(args)
+		else:
+			python_xyz.main(args)
+	finally:
+		os.chdir(cwd)
+
+
+# main(argv) function runs every job of every job file given on the command line.
+def main(argv=None):
+	parser = argparse.ArgumentParser(description="Create the plots of python_xy.py and python_xyz.py listed in job files, without prompts.")
+	parser.add_argument("jobfiles", nargs="+", help="JSON or YAML file(s) listing the plots to make")
+	args = parser.parse_args(argv)
+
+	failed = 0
+	for path in args.jobfiles:
+		for (n, job) in enumerate(readJobs(path)):
+			print("\nRunning job " + str(n + 1) + " of " + path + "\n")
+			try:
+				runJob(job)
+			except (Exception, SystemExit):
+				print("Job " + str(n + 1) + " of " + path + " failed:\n" + traceback.format_exc())
+				failed += 1
+	if failed:
+		print(str(failed) + " job(s) failed.")
+	return 1 if failed else 0
+
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -17,15 +17,133 @@
 # reflect the views of the National Science Foundation.
 #
 # To run this script, use the following command:
-# 		python3 python_xy.py {OPeNDAP link}
+# 		python3 python_xy.py {OPeNDAP link} [{OPeNDAP link} ...]
 # where {OPeNDAP link} is the OPeNDAP link to the desired dataset.
 #
+# Several links may be given to make the same plots for several datasets (e.g. one per
+# network of a project). The datasets are downloaded at the same time, and the name of
+# each plot starts with the name of its dataset, unless they are plotted together:
+#		--merge			Plot the data of all the datasets together, one plot
+#					per station
+#
+# The following options may be added after the link to select the data on the server,
+# so that only the matching rows are downloaded:
+#		--station NET-PLAT	Plot the station(s) given in the network_name-platform_name
+#					convention instead of prompting for them. Repeat the option
+#					or separate the names with commas for several stations, or
+#					use --station all to plot every station.
+#		--start YYYY/mm/dd-HH:MM	Only plot data from this date/time (UTC) on
+#		--end YYYY/mm/dd-HH:MM	Only plot data up to this date/time (UTC)
+# e.g. python3 python_xy.py {OPeNDAP link} --station ASOS-KICT --start 2022/07/01 --end 2022/07/07
+#
+# The other questions can also be answered on the command line. When all of them are,
+# the script runs without any prompts (see also python_batch.py for running many plots):
+#		--vars VAR1,VAR2	Variable(s) to plot against time
+#		--ylabel LABEL		Label on the y-axis
+#
+# The variables and stations of a dataset can also be listed without creating any plots
+# (e.g. to choose the options of a batch run), one per line:
+#		--list-vars		Print the variables that can be plotted against time,
+#					with their type, units and missing value, read from
+#					the DDS and DAS of the dataset only (see qcf_meta.py)
+#		--list-stations		Print the stations of the dataset (within the time
+#					window of --start/--end if given)
+#
+# Downloaded variables can be kept on disk so that later runs on the same dataset
+# don't download them again (see qcf_cache.py):
+#		--cache-dir DIR		Keep the cache in this directory. The QCF_CACHE_DIR
+#					environment variable may be set instead.
+#		--cache-size GB		Size limit of the cache, 2 GB by default
+#		--no-cache		Don't use the cache even if QCF_CACHE_DIR is set
+#
+# Datasets that keep growing during a field campaign can be plotted again every few
+# minutes without downloading them again. The cache is then brought up to date with only
+# the rows from the last nominal date/time it holds on, and only the stations with new
+# rows are plotted again (the datasets must only grow at the end, in nominal time order;
+# when the rows before the last cached time changed, every row is downloaded again):
+#		--incremental		Update the cache and plots with the new rows only (needs
+#					--cache-dir or QCF_CACHE_DIR)
+# e.g. python3 python_xy.py {OPeNDAP link} --station all --vars temp_air --ylabel T --cache-dir ~/qcf_cache --incremental
+#
+# Datasets too large to hold in memory can be read in chunks, keeping only the rows of
+# the chosen stations and time window (the cache is not used then):
+#		--stream		Read the data in chunks and plot each station as soon
+#					as all of its rows have arrived
+#		--chunk-size MB		Size of the chunks, 64 MB by default
+#
+# Requests that fail because the connection dropped or timed out, the response was cut
+# off or the server is busy are tried again, waiting twice as long before each retry (see
+# qcf_fetch.py). Large datasets can also be downloaded in row ranges, so a failure only
+# costs one range; with the cache turned on, a download that was stopped part way is
+# resumed from the last complete range on the next run:
+#		--retries N		Number of times a failed request is tried again, 5 by
+#					default
+#		--timeout SECONDS	Seconds to wait on the server for each part of a
+#					response, 600 by default
+#		--range-rows N		Download every row of a dataset in requests of N rows
+#					(e.g. 500000)
+#
+# Plots of many stations can be created on several processor cores at once (see
+# qcf_render.py):
+#		--jobs N		Number of processes creating plots, 0 for one per core
+#
+# The figure, axes, labels and legend of the plots are created once for the chosen
+# variables, and only the data and title are changed for each station:
+#		--new-figures		Create a new figure for every plot instead
+#
+# Long records (e.g. a season of 1-minute data) can be thinned out before plotting, which
+# makes the time taken to draw a plot independent of the length of the record:
+#		--decimate		Plot only the first, last, lowest and highest value of
+#					each variable in each pixel column of the graph
+#
+# Many stations can be compared on a few pages instead of one plot per station. The
+# dates and times of the rows of every station are converted once, and each page is
+# drawn as one figure:
+#		--layout grid		Plot each station in a small graph of a grid, with the
+#					same time and value axes for every graph
+#		--layout overlay	Plot one graph per variable with a line for each station
+#		--per-page N		Number of stations on each page, 16 by default
+#
+# Records can also be summed up into hourly or daily statistics of each station before
+# plotting (see qcf_rollup.py). The first and last periods of --start and --end are
+# kept whole. With the cache turned on, the statistics of the whole dataset are saved in
+# it, and later plots read them instead of the rows:
+#		--rollup hourly|daily	Plot the hourly or daily statistics of the variables
+#					instead of every value
+#		--stats STAT1,STAT2	Statistics to plot, of mean, min, max and count,
+#					mean,min,max by default
+# e.g. python3 python_xy.py {OPeNDAP link} --station all --vars temp_air --ylabel T --rollup daily --cache-dir ~/qcf_cache
+#
+# The plots are saved as PNG files in the current directory unless chosen otherwise (see
+# qcf_output.py):
+#		--format FORMAT		Save the plots as png, svg or pdf files
+#		--output-dir DIR	Save the plots in this directory
+#		--tarball FILE		Add the plots to this tar file instead of separate files
+#
+# The rows of the plots can also be saved to a file, one station at a time, for other
+# tools to read without downloading them again (see qcf_export.py):
+#		--export FILE		Save the rows to a Parquet (.parquet), Feather (.feather,
+#					.arrow) or NetCDF (.nc) file, with the date and time of
+#					each row as one time and the missing values masked
+#
+# The time taken by each stage of a run (downloading, decoding, grouping, plotting,
+# saving...), with the rows, bytes and memory involved, can be measured (see
+# qcf_profile.py):
+#		--profile		Print a table of the stages at the end of the run
+#		--profile-output FILE	Also save every stage to a JSON file, which can be
+#					opened as a Chrome trace (chrome://tracing)
+#
 # NOTE: This script requires the following packages to be installed:
 # 		python3
-#		pydap
+#		requests
 #		matplotlib
 #		numpy
 #
+# The script also needs the qcf_fetch.py, qcf_cache.py, qcf_index.py, qcf_render.py,
+# qcf_output.py, qcf_meta.py, qcf_rollup.py, qcf_export.py and qcf_profile.py modules from
+# this directory. Exporting to Parquet or Feather files also needs pyarrow, and to NetCDF
+# files netCDF4 or scipy.
+#
 # Refer to the "Using Python to Plot OPeNDAP Files" document for more information on the script.
 # For questions about Python scripts and other features, refer to the Python help page at
 # https://www.python.org/about/help/
@@ -42,18 +160,22 @@
 # directory the script was called from and are *.png files.
 
 # The script uses the following hard-coded entities that may need to be changed:
-# 	missing_value: This is a string containing the value used for missing data points
-# 		e.g. missing_value = "-999.99"
-#	var_index: This is the number of variables preceding the variables available to plot
-#		against time. This includes any variables containing station information, time,
-#		and location.
-#	formatData: This is a string containing format information to convert strings to the 
-#		python object datetime.
+# 	missing_value: This is the value used for missing data points. It is set in 
+# 		qcf_fetch.py, e.g. missing_value = -999.99
+#	location_fields: These are the numeric variables holding the location of the stations,
+#		which are not offered for plotting. It is set in qcf_meta.py
+#	template_limit: This is the number of figures kept for reuse, one for each set of
+#		variables and y label
+#	rollup_stats: The statistics plotted with --rollup unless --stats is given
+#	page_size: The number of stations on each page of --layout grid or overlay, unless
+#		--per-page is given
 #	variable names: This script assumes that the variable names from the OPeNDAP file
 #		are "date", "time", "network-name", "station-name"
 #	Graph elements:
-#		graph size: This is hard-coded into the figure declaration and declares the size of
-#			the output graph.
+#		figure_size: This declares the size of the output graph in inches. With --decimate,
+#			the records are thinned out to the width of the graph in pixels.
+#		page_figure_size: This declares the size of the pages of --layout grid or overlay
+#			in inches.
 #		yticks: The graphs are formatted so that the y-ticks are in steps of 3 from the
 #			minimum value to the maximum value.
 #		x-label: The graphs will be produced with the label "Date and Time" on the x-axis
@@ -66,21 +188,120 @@
 #            Modified the plotting to have a datetimes structure for each variable
 #            Changed the title of the plot to have one line for each variable being plotted
 #
+# October 2026: Replaced toArr with the qcf_fetch module, which returns typed numpy
+#               arrays with missing values set to NaN instead of lists of strings
+#               The dates, times and variables for the chosen stations are now
+#               downloaded together in a single filtered request (qcf_fetch.fetchColumns)
+#               Added the --station, --start and --end options, which are sent to the
+#               server so only the matching rows are downloaded
+#               Added the on-disk cache of downloaded variables (--cache-dir)
+#               Moved the main program into functions so python_batch.py can import the
+#               script, and added the --vars and --ylabel options to run without prompts
+#               Added the --jobs option to create the plots of the stations in parallel
+#               The stations and their rows are found with a group-by index of the rows
+#               (qcf_index.py) instead of scanning lists, and the index is cached
+#               The dates and times are converted to numpy datetime64 in bulk
+#               (qcf_fetch.toDateTime64) instead of with strptime for every point
+#               Added the --stream option to read the data in chunks with bounded memory
+#               Several dataset links can be given, and are downloaded concurrently
+#               (qcf_fetch.fetchEach), with --merge to plot them together
+#               Added the --profile option to measure the time of each stage of a run
+#               The figure of the plots is reused for every station, only swapping in the
+#               data of the lines, the title and the limits (--new-figures to turn off)
+#               Added the --decimate option to plot long records with only the first,
+#               last, lowest and highest value of each pixel column of the graph
+#               The plots are saved through qcf_output.py, in PNG, SVG or PDF format, to
+#               a directory, a tar file or memory (--format, --output-dir, --tarball)
+#               pydap and matplotlib are only imported when they are first needed, and
+#               matplotlib with the non-interactive Agg backend, as the plots are only
+#               saved; added the --list-vars and --list-stations options
+#               The variables, their types, units and missing values are read from the
+#               DDS and DAS of the dataset (qcf_meta.py) instead of with pydap, and the
+#               variables that can be plotted are the numeric ones instead of all the
+#               ones after the hard-coded var_index
+#               Added the --incremental option to add only the new rows of a growing
+#               dataset to the cache and plot only the stations that have them again
+#               Added the --rollup and --stats options to plot hourly or daily statistics
+#               of each station (qcf_rollup.py), which are kept in the cache
+#               Added the --layout and --per-page options to plot pages of many stations
+#               as a grid of small graphs or as overlaid lines, and the dates and times
+#               of the rows are converted once for all the stations
+#               Added the --export option to save the rows of the plots to a Parquet,
+#               Feather or NetCDF file, one station at a time (qcf_export.py)
+#               Requests that fail are tried again with a growing wait (--retries,
+#               --timeout), and --range-rows downloads whole datasets in row ranges,
+#               resuming from the last complete range saved in the cache
+#
 
 # Import necessary packages: 
-from pydap.client import open_url
-import sys
-from datetime import datetime
-import matplotlib.pyplot as plt
+# matplotlib is imported when it is first needed (see loadPyplot), which
+# keeps runs that only list variables or stations or stop at a bad option fast
+import argparse
+from itertools import chain
 import numpy as np
+import qcf_cache
+import qcf_export
+import qcf_fetch
+import qcf_output
+import qcf_profile
+from qcf_fetch import datasetName, fetchColumns, fetchEach, inTimeWindow, joinColumns, parseDateTime, selectStations, selectTimeWindow, subsetColumns, toDateTime64, toStr
+from qcf_index import countStations, groupRows, rowsOf, stationKeys, streamGroups
+from qcf_meta import describeDataset, fieldNames, formatField, plottableVars
+from qcf_output import savePlot
+from qcf_profile import count, stage
+from qcf_render import renderGroups, renderPlots
+from qcf_rollup import fetchRollup, periodWindow, rollup_periods, rollupColumns, statName, statistics
+
+
+#HARD-CODED
+template_limit = 4
+figure_size = (20,10)
+page_figure_size = (20,15)
+page_size = 16
+rollup_stats = ["mean", "min", "max"]
+
+# The hard-coded values of the settings of the options, which every run starts from
+defaults = {"page_size": page_size, "rollup_stats": rollup_stats}
+
+# Figures kept for the plots of each set of variables and y label when figures are
+# reused (see stationTemplate), and whether they are reused
+templates = {}
+reuse_figures = True
+
+# Whether long records are thinned out before plotting (see decimateSeries)
+decimate_series = False
+
+# How the stations are laid out: "station" for one plot per station, or "grid" or
+# "overlay" for pages of several stations (see plotPage), and the stations per page
+layout = "station"
+
+# The period (e.g. "daily") the rows are summed up by before plotting, None to plot every
+# row, and the statistics plotted (see qcf_rollup.py)
+rollup_period = None
+
+# matplotlib.pyplot, once imported by loadPyplot
+plt = None
 
 
 # Functions:
 
-# getVars() function prompts the user for the desired variable(s) to plot, and collects the
-# information for later use.
+# loadPyplot() function imports matplotlib.pyplot the first time it is needed, with the
+# non-interactive Agg backend since the plots are only saved, never shown.
+def loadPyplot():
+	global plt
+	if plt is None:
+		import matplotlib
+		matplotlib.use("Agg")
+		import matplotlib.pyplot as plt
+	return plt
 
-def getVars():
+
+# getVars(url) function prompts the user for the desired variable(s) to plot from the dataset at
+# the OPeNDAP link, and collects the information for later use.
+
+def getVars(url):
+# The variables of the dataset are read from its DDS and DAS (see qcf_meta.py)
+	names = fieldNames(url)
 	error = False
 # Prompt the user for desired variables and collect entries 
 	while True:
@@ -91,7 +312,7 @@ def getVars():
 			print("\nThis file has the following variables available to plot against time: " + '\n\n')
 
 # Print the variables excluding the date, time, and location variables
-			print(list(dataset.keys())[var_index:]) 
+			print(plottableVars(url))
 			vars = input("\n\nEnter variable(s) to plot separated by commas:\n").split(',')
 
 # Check the validity of the user-entered variables by cross-referencing the list of possible variables 
@@ -99,7 +320,7 @@ def getVars():
 # Get rid of any excess white space
 			i = i.strip()
 
-			if i not in dataset.keys():
+			if i not in names:
 # Once invalid variable is found, print the invalid variable 
 				print("Invalid variable entered: " + i + "\n")
 				error = True
@@ -110,43 +331,30 @@ def getVars():
 		else:
 	   		break
 
-# Return list of desired variables
-	return vars
+# Return list of desired variables without any excess white space
+	return [i.strip() for i in vars]
 
 
-# getStations() function prompts the user for the location(s) (aka stations) at which
-# to produce plots and stores that information for later use.
+# getStations(urls, start, end) function prompts the user for the location(s) (aka stations) at which
+# to produce plots and returns the list of chosen station names.
 
-def getStations():
+def getStations(urls, start=None, end=None):
 	error = False
-# Compile a list of unique stations available to create plots at by combining the 
+# Compile a sorted list of unique stations available to create plots at by combining the 
 # network name and station name.
-	networkId = toArr("network_name") # HARD-CODED
-	stationId = toArr("platform_name") # HARD-CODED
-	
-# Create a list to store the occurence of all the stations in the data file
-	stations = []
-
-# Create a list of each unique stations to present to the user
-	uniqStations = []
+# The stations are found by grouping the rows of the dataset in one pass, from only the
+# network and platform names of the --start/--end time window if one was given. With the
+# cache turned on, the grouping of the whole dataset is saved and reused by later runs.
+# The stations of several datasets are found at the same time and put in one list.
+	uniqStations = allStations(urls, start, end)
+	knownStations = set(uniqStations)
 
-# Make a dictionary that will store the station name as the key, and a list of
-# indices at which that station occurs.
-	stationList = {} 
+# Make a list that will store the desired station names
+	stationList = []
 
 # Create a list to store user input
 	usrInput = []
 
-# Loop through lists of networks and stations to create a string combining each
-# network station pair.
-	for i in range(len(networkId)):
-		stationStr = networkId[i] + '-' + stationId[i]
-		stations.append(stationStr)
-		
-# Add the pair of network and station to the unique list if it is not already added.
-		if not stationStr in uniqStations:
-			uniqStations.append(stationStr)
-
 # Prompt the user for the desired station(s) and collect their response.
 	while True:
 		usrInput = input("\nWhich stations would you like to create plots for? Enter station name(s) separated by commas. The stations are named with the following convention: \n\nnetwork_name-platform_name\n\nTo see a list of possible stations, enter 'list'. Please note that not entering the station name as it appears within the file will result in errors.\n\n").split(',')
@@ -154,7 +362,6 @@ def getStations():
 # Allow the user to view a list of all the possible stations over which to plot
 		if usrInput[0] == "list":
 			print("\nThe following stations are available to create plots for: " + '\n\n')
-			uniqStations.sort()	
 			print(list(uniqStations))
 			usrInput = input("\n\nEnter stations(s) to plot separated by commas:\n").split(',')
 
@@ -165,144 +372,574 @@ def getStations():
 
 # If an entry is not in the list of unique stations, print the invalid entry and start this
 # section over. 
-			if i not in uniqStations:
+			if i not in knownStations:
 				print("Invalid station entered: " + i + "\n")
 				error = True
 
-# If the station is valid, create a key in the dictionary with the station name pointing to
-# an empty list
-			else:
-				stationList[i] = []
+# If the station is valid, add it to the list of desired stations
+			elif i not in stationList:
+				stationList.append(i)
 		if error:
 			print("Please try again:\n")
 			error = False
+			stationList = []
 			continue
 		else:
 			break
-			
-
-# Loop through each occurence of the desired station(s) and note the indices in order
-# to retrieve the relevant data points later on.
-	for i in range(len(stations)):
-		if stations[i] in stationList:
-			stationList[stations[i]].append(i)
 
-# Return dictionary of desired stations with list of relevant indices. 
+# Return list of desired stations
 	return stationList 
 
 
-# toArr(var) function takes the name of a variable as seen in the OPeNDAP file and uses
-# the pydap client to retrieve an array of the values of that variable.
-def toArr(var):
-	commandStr = "enumerate(dataset."+var+".iterdata())"
-	arr = []
-	for i in eval(commandStr): arr.append(str(i[1]))
-	return arr
-
-# Main:
-
-#HARD-CODED
-missing = "-999.99"
-var_index = 9
-formatData = "%Y/%m/%d%H:%M:%S"
-
-# Pull OPeNDAP file link from command line argument 
-url = sys.argv[1]
+# allStations(urls, start, end) function returns the sorted list of every station in the
+# dataset(s) (within the time window if one is given), for plotting all of them without
+# a prompt.
+def allStations(urls, start=None, end=None):
+	with stage("list"):
+		return sorted(set().union(*fetchEach(urls, lambda url: countStations(url, start, end)[0])))
 
-# Import dataset using the pydap client and specify QCF for NCAR/EOL datasets 
-dataset = open_url(url).QCF
 
-# Collect desired variables and stations
-vars = getVars()
-relevantStations = getStations()
+# plotStation(station, vars, columns, rows, y_label, prefix, reuse, decimate) function creates the plot of the
+# desired variable(s) at one station from the given rows of the downloaded columns, saves it
+# to the current directory (with the prefix at the start of the file name) and returns the
+# name of the file, or None if there is no data to plot. When reuse is True, the figure is
+# kept and used again for the next station (see stationTemplate). When decimate is True,
+# the values of each variable are thinned out first (see decimateSeries).
+def plotStation(station, vars, columns, rows, y_label, prefix="", reuse=False, decimate=False):
+	loadPyplot()
+	(datetimes, values) = stationSeries(vars, columns, rows, graphWidth() if decimate else None)
 
-# Collect lists of times and dates from the dataset 
-times = toArr("time") # HARD-CODED
-dates = toArr("date") # HARD-CODED
+# Skip the station if there is no data to plot for it
+	if not values:
+		return None
 
-# Create a dictionary with the desired variable name(s) as the key(s)
-# and an empty list that will eventually hold the relevant variable values
-varValues = dict.fromkeys(vars, [])
-
-# Grab data values for every desired variable 
-for i in range(len(vars)):
-	varValues[vars[i]] = toArr(vars[i])
+	with stage("plot"):
+# Begin plotting
+# Either reuse the figure made for earlier stations with the same variables, swapping in
+# the data of this station, or create a new figure to hold the graph
+		if reuse:
+			ax = stationTemplate(vars, y_label, values, datetimes)
+			fig = ax.figure
+		else:
+			fig = plt.figure(figsize=figure_size)
+			ax = fig.gca()
 
-# Collect user input for the label on the y axis
-# e.g. "Degrees (celsius)
-y_label = input("\n\nWhat would you like the label to be on the y-axis?\n")
+# Plot line of each variable
+			for var in values.keys():
+				plt.plot(datetimes[var], values[var], marker = 'o', label= var)
 
-print("\nCreating plots...\n\n")
+# Set x label and y label
+			plt.xlabel("Date and Time")
+			plt.ylabel(y_label)
 
-# Loop through each desired station to create plots
-for station in relevantStations.keys():
-# Create an empty dictionary to hold the python object datetime
-	datetimes = {}
-# Create an empty dictionary to eventually hold the relevant data points
-	values = {}
-
-# Loop through the list of indices at the desired station and use those indices
-# to pull the data points from that station
-	for i in relevantStations[station]:
-
-# Loop through desired variables to collect values
-		for var in varValues.keys():
-# On first pass, add variable name as key to values and datetimes arrays
-			if not var in values.keys():
-				values[var]= []
-				datetimes[var] = []
-			
-# Check that variable value isn't missing before adding it to the list of values
-			if not varValues[var][i] == missing:
-				values[var].append(float(varValues[var][i]))
-# Add datetime objects to datetimes list at relevant indices
-				datetimes[var].append(datetime.strptime(dates[i]+times[i], formatData))
+# Add legend to plot
+			plt.legend()
+			plt.xticks(rotation=45)
 
-# Begin plotting
-# Create figure to hold graph
-	fig = plt.figure(figsize=(20,10)) # HARD-CODED
-	
 # Create place holders to store the graph's minimum and maximum values
-	max_value = 0
-	min_value = 100
-
-# Collect minimum and maximum values for each variable, then plot line
-# of each variable
-	for var in values.keys():
-		if max(values[var]) > max_value: max_value = max(values[var])
-		if min(values[var]) < min_value: min_value = min(values[var])	
-		plt.plot(datetimes[var], values[var], marker = 'o', label= var)
+		max_value = 0
+		min_value = 100
 
-# Set x label, y label, and plot title
-	plt.xlabel("Date and Time")
-	plt.ylabel(y_label)
+# Collect minimum and maximum values for each variable
+		for var in values.keys():
+			if values[var].max() > max_value: max_value = values[var].max()
+			if values[var].min() < min_value: min_value = values[var].min()
 
 # Convert variable names to include spaces instead of underscores
 # Print a title line for each variable with the date/time range
 # Each variable can have a different date/time range because of missing values
-	title_str = ""
-	for var in values.keys(): 
-		vars_str = var.strip().replace("_", " ").title() 
-		title_str += vars_str + ' from ' + datetimes[var][0].strftime("%Y/%m/%d %H:%M")  + ' to ' + datetimes[var][len(datetimes[var])-1].strftime("%Y/%m/%d %H:%M") + ' UTC for ' + station + "\n"
-	title_str = title_str[0:len(title_str)-1] 
-	plt.title(title_str)
+		title_str = ""
+		for var in values.keys(): 
+			vars_str = var.strip().replace("_", " ").title() 
+			title_str += vars_str + ' from ' + datetimes[var][0].item().strftime("%Y/%m/%d %H:%M")  + ' to ' + datetimes[var][len(datetimes[var])-1].item().strftime("%Y/%m/%d %H:%M") + ' UTC for ' + station + "\n"
+		title_str = title_str[0:len(title_str)-1] 
+		ax.set_title(title_str)
 
-# Add legend to plot
-	plt.legend()
-
-# Add y ticks and x ticks to plot in addition to formatting
-	plt.yticks(np.arange(min_value, max_value, step=3))  # Set label locations. #HARDCODED
-	plt.xticks(rotation=45)
+# Add y ticks to plot
+		ax.set_yticks(np.arange(min_value, max_value, step=3))  # Set label locations. #HARDCODED
 
 # Save plot to current directory with name of station, variables, and start date
-	fileStr = station + '_'
-	for var in values.keys():
-		fileStr += var.strip() + '_'
-	fileStr += datetimes[var][0].strftime("%Y%m%d%H%M") + '.png'
-	fig.savefig(fileStr)
+		fileStr = prefix + station + '_'
+		for var in values.keys():
+			fileStr += var.strip() + '_'
+		fileStr += datetimes[var][0].item().strftime("%Y%m%d%H%M")
+	with stage("save"):
+		fileStr = savePlot(fig, fileStr)
+
+# Close figure, unless it is kept for the next station
+	if not reuse:
+		plt.close(fig)
+	return fileStr
+
+
+# stationSeries(vars, columns, rows, buckets) function returns the datetimes and the values
+# of each desired variable at one station from the given rows of the downloaded columns,
+# as two dictionaries keyed by variable, leaving out the missing values and the variables
+# without any value. When buckets is given, long records are thinned out to that many
+# pixel columns (see decimateSeries).
+def stationSeries(vars, columns, rows, buckets=None):
+# Create an empty dictionary to hold the python object datetime
+	datetimes = {}
+# Create an empty dictionary to eventually hold the relevant data points
+	values = {}
 
-# Close figure
+# Use the indices of the rows at the desired station to pull the data points from that
+# station for every desired variable
+# The dates and times of all the rows are converted to numpy datetime64 in one go, or
+# have already been for every downloaded row (see renderStations)
+	if "datetime" in columns:
+		rowDateTimes = columns["datetime"][rows]
+	else:
+		rowDateTimes = toDateTime64(columns["date"][rows], columns["time"][rows]) # HARD-CODED
+	for var in vars:
+		column = columns[var][rows]
+
+# Keep only the values that aren't missing, along with their datetimes
+		valid = ~np.isnan(column)
+		if valid.any():
+			values[var] = column[valid]
+			datetimes[var] = rowDateTimes[valid]
+
+# Thin out long records to the first, last, lowest and highest value in each pixel
+# column of the graph, which look the same once drawn
+			if buckets:
+				(datetimes[var], values[var]) = decimateSeries(datetimes[var], values[var], buckets)
+	return datetimes, values
+
+
+# plotPage(page, pages, stations, vars, columns, rows, y_label, layout, prefix, decimate)
+# function creates one page of the plots of several stations from the given rows of each
+# (a list of arrays, one per station) and saves it: with the grid layout, one small graph
+# per station with the same axes, and with the overlay layout, one graph per variable with
+# a line per station. It returns the station and the name of the saved file (or None if
+# the station has no data) for each station.
+def plotPage(page, pages, stations, vars, columns, rows, y_label, layout="grid", prefix="", decimate=False):
+	loadPyplot()
+	colors = plt.rcParams["axes.prop_cycle"].by_key()["color"]
+	if layout == "grid":
+		columnCount = int(np.ceil(np.sqrt(len(stations))))
+		rowCount = int(np.ceil(len(stations) / columnCount))
+	else:
+		(columnCount, rowCount) = (1, len(vars))
+	buckets = graphWidth() // columnCount if decimate else None
+	series = [stationSeries(vars, columns, stationRows, buckets) for stationRows in rows]
+	found = [station for (station, (datetimes, values)) in zip(stations, series) if values]
+	if not found:
+		return [(station, None) for station in stations]
+
+	with stage("plot"):
+# One figure for the page, with the time axis (and the value axis of the grid) shared by
+# all of its graphs
+		fig = plt.figure(figsize=page_figure_size)
+		axes = fig.subplots(rowCount, columnCount, sharex=True, sharey=(layout == "grid"), squeeze=False).ravel()
+		first = min(datetimes[var][0] for (datetimes, values) in series for var in values)
+		last = max(datetimes[var][-1] for (datetimes, values) in series for var in values)
+		if layout == "grid":
+# Each variable has the same color in every graph
+			for (ax, station, (datetimes, values)) in zip(axes, stations, series):
+				for (i, var) in enumerate(vars):
+					if var in values:
+						ax.plot(datetimes[var], values[var], color=colors[i % len(colors)], linewidth=0.8, label=var)
+				ax.set_title(station, fontsize="small")
+			for ax in axes[len(stations):]:
+				ax.set_visible(False)
+			fig.legend(handles=[plt.Line2D([], [], color=colors[i % len(colors)]) for i in range(len(vars))], labels=vars, loc="upper right")
+			fig.supylabel(y_label)
+		else:
+# Each station has the same color in every graph
+			for (ax, var) in zip(axes, vars):
+				for (i, (station, (datetimes, values))) in enumerate(zip(stations, series)):
+					if var in values:
+						ax.plot(datetimes[var], values[var], color=colors[i % len(colors)], linewidth=0.8, label=station)
+				ax.set_title(var.replace("_", " ").title(), fontsize="small")
+				ax.set_ylabel(y_label)
+			axes[0].legend(fontsize="x-small", ncol=max(1, len(stations) // 10), loc="upper right")
+		fig.supxlabel("Date and Time")
+		fig.autofmt_xdate(rotation=45)
+
+		title_str = ", ".join(var.strip().replace("_", " ").title() for var in vars) + ' from ' + first.item().strftime("%Y/%m/%d %H:%M") + ' to ' + last.item().strftime("%Y/%m/%d %H:%M") + ' UTC'
+		if pages > 1:
+			title_str += ' (page ' + str(page) + ' of ' + str(pages) + ')'
+		fig.suptitle(title_str)
+
+# Save the page with the layout, variables, start date and page number in its name
+		fileStr = prefix + layout + '_' + '_'.join(var.strip() for var in vars) + '_' + first.item().strftime("%Y%m%d%H%M")
+		if pages > 1:
+			fileStr += '_p' + str(page)
+	with stage("save"):
+		fileStr = savePlot(fig, fileStr)
 	plt.close(fig)
+	return [(station, fileStr if station in found else None) for station in stations]
+
+
+# graphWidth() function returns the width in pixels of the area the lines are drawn in.
+def graphWidth():
+	loadPyplot()
+	return int(figure_size[0] * plt.rcParams["figure.dpi"] * (plt.rcParams["figure.subplot.right"] - plt.rcParams["figure.subplot.left"]))
+
+
+# decimateSeries(datetimes, values, buckets) function thins out the values of a variable and
+# their datetimes for plotting by splitting the time range into the given number of equal
+# buckets (one per pixel column of the graph) and keeping only the first, last, lowest and
+# highest value in each. The line drawn through them covers the same pixels as the line
+# through every value, so peaks don't disappear, and a record of any length is drawn
+# with at most four times as many points as there are buckets.
+def decimateSeries(datetimes, values, buckets):
+	if len(values) <= 4 * buckets:
+		return datetimes, values
+	with stage("decimate"):
+		count(rows=len(values))
+		seconds = datetimes.astype("datetime64[s]").astype(np.int64)
+		first = seconds.min()
+		bucket = (seconds - first) * buckets // (seconds.max() - first + 1)
+
+# Sort the rows by bucket, then by value (for the lowest and highest) or by time (for the
+# first and last), so the ones to keep are at the start and end of the run of each bucket
+		keep = []
+		for key in (values, seconds):
+			order = np.lexsort((key, bucket))
+			starts = np.flatnonzero(np.concatenate(([True], bucket[order][1:] != bucket[order][:-1])))
+			ends = np.concatenate((starts[1:], [len(order)])) - 1
+			keep += [order[starts], order[ends]]
+		keep = np.unique(np.concatenate(keep))
+		return datetimes[keep], values[keep]
+
+
+# stationTemplate(vars, y_label, values, datetimes) function returns the axes of the figure
+# kept for plots of the desired variable(s), creating the figure, lines, labels and legend
+# the first time, and sets the data of its lines to the values and datetimes of a station.
+# Lines of variables without data at the station are hidden, and the others take the
+# colors they would have in a new figure.
+def stationTemplate(vars, y_label, values, datetimes):
+	key = (tuple(vars), y_label)
+	template = templates.get(key)
+	if template is None:
+# Make room by closing the figure kept the longest
+		if len(templates) >= template_limit:
+			plt.close(templates.pop(next(iter(templates)))["ax"].figure)
+		fig = plt.figure(figsize=figure_size)
+		ax = fig.gca()
+		empty = np.array([], dtype="datetime64[s]")
+		template = {"ax": ax, "lines": dict((var, ax.plot(empty, [], marker = 'o', label= var)[0]) for var in vars), "shown": None}
+		ax.set_xlabel("Date and Time")
+		ax.set_ylabel(y_label)
+		ax.tick_params(axis="x", labelrotation=45)
+		templates[key] = template
+	ax = template["ax"]
+
+# Swap in the data of the station
+	colors = plt.rcParams["axes.prop_cycle"].by_key()["color"]
+	shown = tuple(var for var in vars if var in values)
+	for (i, var) in enumerate(shown):
+		line = template["lines"][var]
+		line.set_data(datetimes[var], values[var])
+		line.set_color(colors[i % len(colors)])
+		line.set_visible(True)
+	for var in vars:
+		if var not in values:
+			template["lines"][var].set_visible(False)
+
+# Only rebuild the legend when other variables are shown than in the last plot
+	if shown != template["shown"]:
+		ax.legend(handles=[template["lines"][var] for var in shown])
+		template["shown"] = shown
+	ax.relim(visible_only=True)
+	ax.autoscale_view()
+	return ax
+
+
+# plotStations(urls, vars, stations, y_label, start, end, jobs, merge, every) function
+# downloads the desired variable(s) for the desired station(s) and time window from each
+# dataset and creates one plot per station and dataset, or one plot per station for all
+# the datasets together when merge is True, on the given number of processes. When every
+# is True, stations holds every station of the datasets, and the rows are downloaded
+# without naming each station in the request. In incremental mode, the
+# cached variables are brought up to date with only the rows added since the last run
+# (see qcf_fetch.refreshColumns), and only the stations with new rows are plotted again.
+# It returns the list of the names of the saved files.
+def plotStations(urls, vars, stations, y_label, start=None, end=None, jobs=1, merge=False, every=False):
+# With --rollup, the first and last periods of the time window are kept whole
+	if rollup_period is not None:
+		(start, end) = periodWindow(start, end, rollup_period)
+	fields = ["network_name", "platform_name", "date", "time"] + vars # HARD-CODED
+	selections = ([] if every else selectStations(stations)) + selectTimeWindow("date", start, end) # HARD-CODED
+	shown = plotVars(vars)
+	unchanged = set()
+	if qcf_fetch.streaming:
+# Read the datasets one after another in chunks
+		results = chain.from_iterable(streamStations(url, fields, selections, vars, stations, y_label, start, end, jobs, filePrefix(urls, url)) for url in urls)
+	else:
+# Download the station names, dates, times and desired variable(s) for only the rows
+# of the desired station(s) and time window in a single request per dataset, for all
+# of the datasets at once. Each column is a numpy array and the variable values are NaN
+# where missing.
+# With --rollup, the statistics of each station and period are plotted instead of the
+# rows, read from the cache if it is turned on
+		def load(url):
+			if rollup_period is not None:
+				return fetchRollup(url, vars, rollup_period, stations, start, end, every)
+			columns = fetchColumns(url, fields, selections)
+
+# Trim the rows of the first and last day that are outside of the time window
+			return subsetColumns(columns, inTimeWindow(columns["date"], columns["time"], start, end)) # HARD-CODED
+		datasets = fetchEach(urls, load)
+
+# Only plot the stations with new rows again in incremental mode, unless every row is new
+		added = [qcf_fetch.added_rows.get(url) for url in urls]
+		if qcf_fetch.incremental and all(i is not None and "network_name" in i and "platform_name" in i for i in added): # HARD-CODED
+			changed = set(chain.from_iterable(toStr(np.unique(stationKeys(i))) for i in added))
+			unchanged = set(stations) - changed
+			stations = [i for i in stations if i in changed]
+		if merge and len(datasets) > 1:
+			datasets = [joinColumns(datasets)]
+			urls = urls[:1]
+		results = chain.from_iterable(renderStations(columns, shown, stations, y_label, jobs, filePrefix(urls, url)) for (url, columns) in zip(urls, datasets))
+
+	files = []
+	plotted = set(unchanged)
+	for station in sorted(unchanged):
+		print('No new data for ' + station + ', plot not updated.')
+	for (station, fileStr) in results:
+
+# Print the name of the plot and where it is saved, once for the stations of a page
+		if fileStr is not None:
+			if fileStr not in files:
+				print('Plot saved in ' + qcf_output.location() + ' with the name ' + fileStr)
+				files.append(fileStr)
+			plotted.add(station)
+	for station in stations:
+		if station not in plotted:
+			print('No data found for ' + station + ', no plot created.')
+	return files
+
+
+# renderStations(columns, vars, stations, y_label, jobs, prefix, decimate) function creates
+# the plot of each desired station from the downloaded columns of a dataset, thinning out
+# long records if decimate is True (decimate_series if it is None). It yields the station
+# and the name of the saved file of each plot.
+def renderStations(columns, vars, stations, y_label, jobs=1, prefix="", decimate=None):
+	if decimate is None:
+		decimate = decimate_series
+# Group the downloaded rows by station, to find the rows of each desired station, and
+# convert the dates and times of every row to numpy datetime64 once for all stations
+	index = groupRows(stationKeys(columns))
+	qcf_export.exportGroups(columns, index, stations)
+	columns = dict(columns, datetime=toDateTime64(columns["date"], columns["time"])) # HARD-CODED
+
+# Loop through each desired station, or each page of stations, to create plots
+# The plots are created by the number of processes given with --jobs
+	if layout != "station":
+		pages = [stations[i:i + page_size] for i in range(0, len(stations), page_size)]
+		tasks = [{"page": n + 1, "pages": len(pages), "stations": page, "vars": vars, "rows": [rowsOf(index, station) for station in page], "y_label": y_label, "layout": layout, "prefix": prefix, "decimate": decimate} for (n, page) in enumerate(pages)]
+		return chain.from_iterable(renderPlots(plotPage, tasks, columns, jobs))
+	tasks = [{"station": station, "vars": vars, "rows": rowsOf(index, station), "y_label": y_label, "prefix": prefix, "reuse": reuse_figures, "decimate": decimate} for station in stations]
+	return zip(stations, renderPlots(plotStation, tasks, columns, jobs))
+
+
+# streamStations(url, fields, selections, vars, stations, y_label, start, end, jobs, prefix)
+# function downloads the fields in streaming mode, keeping only the rows of the desired
+# station(s) within the time window, and creates the plot of each station once all of its
+# rows have arrived (summed up first with --rollup). With the grid and overlay layouts,
+# the pages are created at the end of the download, when the rows of every station have
+# arrived. It yields the station and the name of the saved file of each plot.
+def streamStations(url, fields, selections, vars, stations, y_label, start=None, end=None, jobs=1, prefix=""):
+	wanted = np.array(stations, dtype="S")
+	def keep(columns):
+		return inTimeWindow(columns["date"], columns["time"], start, end) & np.isin(stationKeys(columns), wanted) # HARD-CODED
+	def groups():
+		for (key, columns) in streamGroups(url, fields, selections, stationKeys, keep):
+			if rollup_period is not None:
+				columns = rollupColumns(columns, vars, rollup_period)
+			qcf_export.exportColumns(columns)
+			yield {"station": key.decode("ascii"), "vars": plotVars(vars), "rows": np.arange(len(columns["date"])), "y_label": y_label, "prefix": prefix, "reuse": reuse_figures, "decimate": decimate_series}, columns
+	if layout != "station":
+		found = list(groups())
+		pages = [found[i:i + page_size] for i in range(0, len(found), page_size)]
+		def pageGroups():
+			for (n, page) in enumerate(pages):
+				sizes = [len(columns["date"]) for (options, columns) in page]
+				offsets = np.concatenate(([0], np.cumsum(sizes)))
+				yield {"page": n + 1, "pages": len(pages), "stations": [options["station"] for (options, columns) in page], "vars": plotVars(vars), "rows": [np.arange(offsets[i], offsets[i + 1]) for i in range(len(page))], "y_label": y_label, "layout": layout, "prefix": prefix, "decimate": decimate_series}, joinColumns([columns for (options, columns) in page])
+		for (options, results) in renderGroups(plotPage, pageGroups(), jobs):
+			for (station, fileStr) in results:
+				yield station, fileStr
+		return
+	for (options, fileStr) in renderGroups(plotStation, groups(), jobs):
+		yield options["station"], fileStr
+
+
+# plotVars(vars) function returns the names of the columns plotted for the desired
+# variable(s): the variables themselves, or their statistics with --rollup.
+def plotVars(vars):
+	if rollup_period is None:
+		return vars
+	return [statName(var, statistic) for var in vars for statistic in rollup_stats]
+
+
+# filePrefix(urls, url) function returns the start of the file names of the plots of the
+# dataset at the OPeNDAP link: nothing when only one dataset is plotted, and the name of
+# the dataset otherwise, so the plots of the same station don't overwrite each other.
+# With --rollup, the period is added so the plots of the statistics don't overwrite each
+# other either.
+def filePrefix(urls, url):
+	prefix = "" if len(urls) == 1 else datasetName(url) + "_"
+	if rollup_period is not None:
+		prefix += rollup_period + "_"
+	return prefix
+
+
+# splitList(values) function splits the values of an option that may be repeated and/or
+# separated by commas into one list, without excess white space or repeats.
+def splitList(values):
+	return list(dict.fromkeys(i.strip() for i in ",".join(values).split(",") if i.strip()))
+
+
+# invalidStations(stations) function returns the station names that are not of the form
+# network_name-platform_name.
+def invalidStations(stations):
+	return [i for i in stations if not all(i.partition("-"))]
+
+
+# main(argv) function runs the script: it reads the command line options, prompts the
+# user for anything they don't give and creates the plots.
+def main(argv=None):
+# Pull OPeNDAP file link and selection options from command line arguments
+	parser = argparse.ArgumentParser(description="Plot variables of an NCAR/EOL QCF dataset against time for the chosen stations.")
+	parser.add_argument("url", nargs="+", help="OPeNDAP link(s) to the desired dataset(s)")
+	parser.add_argument("--vars", action="append", help="variable(s) to plot, separated by commas")
+	parser.add_argument("--station", action="append", help="station to plot, named network_name-platform_name (repeat or separate with commas for several), or 'all'")
+	parser.add_argument("--start", help="first date/time to plot, YYYY/mm/dd-HH:MM or YYYY/mm/dd (UTC)")
+	parser.add_argument("--end", help="last date/time to plot, YYYY/mm/dd-HH:MM or YYYY/mm/dd (UTC)")
+	parser.add_argument("--ylabel", help="label on the y-axis")
+	parser.add_argument("--list-vars", action="store_true", help="print the variables of the (first) dataset that can be plotted and exit")
+	parser.add_argument("--list-stations", action="store_true", help="print the stations of the dataset(s) and exit")
+	parser.add_argument("--cache-dir", help="directory of the on-disk cache of downloaded variables")
+	parser.add_argument("--cache-size", type=float, help="size limit of the cache in GB")
+	parser.add_argument("--no-cache", action="store_true", help="don't use the cache even if QCF_CACHE_DIR is set")
+	parser.add_argument("--stream", action="store_true", help="read the data in chunks, keeping only the rows of the plots in memory (the cache is not used)")
+	parser.add_argument("--chunk-size", type=float, help="size of the chunks read in streaming mode in MB, 64 MB by default")
+	parser.add_argument("--retries", type=int, help="number of times a failed request is tried again, 5 by default")
+	parser.add_argument("--timeout", type=float, help="seconds to wait on the server for each part of a response, 600 by default")
+	parser.add_argument("--range-rows", type=int, help="download every row of a dataset in requests of this many rows, resuming from the last complete one (with the cache)")
+	parser.add_argument("--jobs", type=int, default=1, help="number of processes creating plots at once, 0 for one per processor core")
+	parser.add_argument("--merge", action="store_true", help="plot the data of all the datasets together instead of one plot per dataset")
+	parser.add_argument("--incremental", action="store_true", help="only download the rows added since the last run and plot the stations that have them again (needs the cache)")
+	parser.add_argument("--decimate", action="store_true", help="plot only the first, last, lowest and highest value of each variable in each pixel column of long records")
+	parser.add_argument("--rollup", choices=list(rollup_periods), help="plot the hourly or daily statistics of each station instead of every value (kept in the cache)")
+	parser.add_argument("--stats", action="append", help="statistics to plot with --rollup, of " + ", ".join(statistics) + " (separated by commas), mean,min,max by default")
+	parser.add_argument("--layout", choices=["station", "grid", "overlay"], default="station", help="one plot per station, or pages of stations in a grid of small graphs or overlaid on one graph per variable")
+	parser.add_argument("--per-page", type=int, help="number of stations on each page of --layout grid or overlay, 16 by default")
+	parser.add_argument("--new-figures", action="store_true", help="create a new figure for every plot instead of reusing one for the plots of the same variables")
+	parser.add_argument("--format", choices=qcf_output.output_formats, default="png", help="file format of the plots, png by default")
+	parser.add_argument("--output-dir", help="directory to save the plots in, the current one by default")
+	parser.add_argument("--tarball", help="add the plots to this tar file instead of saving them as separate files")
+	parser.add_argument("--export", help="also save the rows of the plots to this Parquet (.parquet), Feather (.feather, .arrow) or NetCDF (.nc) file")
+	parser.add_argument("--profile", action="store_true", help="print the time, rows, bytes and memory of each stage of the run")
+	parser.add_argument("--profile-output", help="also save the profile to this JSON file, which can be opened as a Chrome trace")
+	args = parser.parse_args(argv)
+	urls = args.url
+	qcf_profile.setProfile(args.profile or bool(args.profile_output))
+	global reuse_figures, decimate_series, rollup_period, rollup_stats, layout, page_size
+	reuse_figures = not args.new_figures
+	layout = args.layout
+	page_size = defaults["page_size"]
+	if args.per_page is not None:
+		if args.per_page < 1:
+			parser.error("--per-page must be at least 1")
+		page_size = args.per_page
+	decimate_series = args.decimate
+	rollup_period = args.rollup
+	rollup_stats = defaults["rollup_stats"]
+	if args.stats:
+		if not args.rollup:
+			parser.error("--stats needs --rollup")
+		rollup_stats = splitList(args.stats)
+		for i in rollup_stats:
+			if i not in statistics:
+				parser.error("Invalid statistic entered: " + i + " (use " + ", ".join(statistics) + ")")
+	if args.merge and args.stream:
+		parser.error("--merge can't be used with --stream")
+	if args.export:
+		try:
+			qcf_export.checkExport(args.export)
+		except ValueError as e:
+			parser.error(str(e))
+
+# Set how failed requests are tried again and whether downloads are split into row ranges
+	if (args.retries is not None and args.retries < 0) or (args.timeout is not None and args.timeout <= 0) or (args.range_rows is not None and args.range_rows < 0):
+		parser.error("--retries and --range-rows can't be negative, and --timeout must be positive")
+	qcf_fetch.setRetries(args.retries, args.timeout, args.range_rows)
+
+# Turn on the cache of downloaded variables if a directory was given
+# In streaming mode the data is read in chunks instead and the cache is not used
+# Every setting is given again, so the jobs of python_batch.py don't inherit them
+	qcf_fetch.setStreaming(args.stream, args.chunk_size * 1024**2 if args.chunk_size else None)
+	qcf_cache.setCache(None if args.stream or args.no_cache else qcf_cache.cacheDir(args.cache_dir), args.cache_size * 1024**3 if args.cache_size else None)
+	if args.incremental and qcf_cache.cache_dir is None:
+		parser.error("--incremental needs the cache (--cache-dir or QCF_CACHE_DIR), and can't be used with --stream or --no-cache")
+	qcf_fetch.setIncremental(args.incremental)
+	start = parseDateTime(args.start) if args.start else None
+	end = parseDateTime(args.end, end=True) if args.end else None
+
+# Print the variables and/or stations and stop, if asked to
+	if args.list_vars or args.list_stations:
+		if args.list_vars:
+			print("\n".join(formatField(field) for field in describeDataset(urls[0]) if field["plottable"]))
+		if args.list_stations:
+			print("\n".join(allStations(urls, start, end)))
+		return
+
+# Collect desired variables, prompting for them if they weren't given with --vars
+	if args.vars:
+		vars = splitList(args.vars)
+		names = fieldNames(urls[0])
+		for i in vars:
+			if i not in names:
+				parser.error("Invalid variable entered: " + i + " (the variables that can be plotted are " + ", ".join(plottableVars(urls[0])) + ")")
+	else:
+# The variables of the first dataset are offered when several are given
+		vars = getVars(urls[0])
+
+# Collect desired stations. Stations given with --station are used as is, without
+# downloading the station names of the whole dataset.
+	every = bool(args.station) and splitList(args.station) == ["all"]
+	if every:
+		relevantStations = allStations(urls, start, end)
+	elif args.station:
+		relevantStations = splitList(args.station)
+		for i in invalidStations(relevantStations):
+			parser.error("Invalid station entered: " + i + " (name stations network_name-platform_name)")
+	else:
+		relevantStations = getStations(urls, start, end)
 
-# Print the name of the plot and where it is saved.
-	print('Plot saved in the current directory with the name ' + fileStr)
+# Collect user input for the label on the y axis
+# e.g. "Degrees (celsius)
+	if args.ylabel is not None:
+		y_label = args.ylabel
+	else:
+		y_label = input("\n\nWhat would you like the label to be on the y-axis?\n")
+
+	print("\nCreating plots...\n\n")
+# Choose the format of the plots and where to save them
+# and the file to export the rows to, if any
+	qcf_output.setOutput(args.format, args.output_dir, args.tarball)
+	if args.export:
+		qcf_export.setExport(args.export)
+	try:
+		plotStations(urls, vars, relevantStations, y_label, start, end, args.jobs, args.merge, every)
+	finally:
+		qcf_output.closeOutput()
+		exported = qcf_export.closeExport()
+	if args.export:
+		print(str(exported) + ' row(s) exported to ' + args.export)
+
+# Print and save the time taken by each stage of the run
+	if qcf_profile.enabled:
+		qcf_profile.report()
+		if args.profile_output:
+			qcf_profile.writeTrace(args.profile_output)
+			print("Profile saved in " + args.profile_output)
+
+
+if __name__ == "__main__":
+	main()
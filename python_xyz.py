@@ -17,15 +17,120 @@
 # reflect the views of the National Science Foundation.
 #
 # To run this script, use the following command:
-#	   python3 python_xyz.py {OPeNDAP link}
+#	   python3 python_xyz.py {OPeNDAP link} [{OPeNDAP link} ...]
 # where {OPeNDAP link} is the OPeNDAP link to the desired dataset.
 #
+# Several links may be given to make the same plots for several datasets (e.g. one per
+# network of a project). The datasets are downloaded at the same time, and the name of
+# each plot starts with the name of its dataset, unless they are plotted together:
+#	   --merge                       Plot the stations of all the datasets together, one
+#	                                 plot per datetime
+#
+# The following options may be added after the link to select the data on the server,
+# so that only the matching rows are downloaded:
+#	   --datetime YYYY/mm/dd-HH:MM   Plot the datetime(s) (UTC) given instead of prompting
+#	                                 for them. Repeat the option or separate the datetimes
+#	                                 with commas for several plots, or use --datetime all
+#	                                 to plot every datetime (in the time window) that has
+#	                                 at least 3 data points.
+#	   --start YYYY/mm/dd-HH:MM      Only offer datetimes (UTC) from this one on
+#	   --end YYYY/mm/dd-HH:MM        Only offer datetimes (UTC) up to this one
+# e.g. python3 python_xyz.py {OPeNDAP link} --start 2022/07/01 --end 2022/07/07
+#
+# The other questions can also be answered on the command line. When all of them are,
+# the script runs without any prompts (see also python_batch.py for running many plots):
+#	   --var VAR                     Variable to plot
+#	   --time nominal|actual         Use the nominal or the actual time of the data
+#	   --zlabel LABEL                Label on the z-axis
+#
+# The variables and datetimes of a dataset can also be listed without creating any plots
+# (e.g. to choose the options of a batch run), one per line:
+#	   --list-vars                   Print the variables that can be plotted, with their
+#	                                 type, units and missing value, read from the DDS
+#	                                 and DAS of the dataset only (see qcf_meta.py)
+#	   --list-datetimes              Print the datetimes (of --time, nominal by default,
+#	                                 and within --start/--end if given) that have at
+#	                                 least 3 data points
+#
+# Downloaded variables can be kept on disk so that later runs on the same dataset
+# don't download them again (see qcf_cache.py):
+#	   --cache-dir DIR               Keep the cache in this directory. The QCF_CACHE_DIR
+#	                                 environment variable may be set instead.
+#	   --cache-size GB               Size limit of the cache, 2 GB by default
+#	   --no-cache                    Don't use the cache even if QCF_CACHE_DIR is set
+#
+# Datasets too large to hold in memory can be read in chunks, keeping only the rows at
+# the chosen datetimes (the cache is not used then):
+#	   --stream                      Read the data in chunks and plot each datetime as
+#	                                 soon as all of its rows have arrived
+#	   --chunk-size MB               Size of the chunks, 64 MB by default
+#
+# Requests that fail because the connection dropped or timed out, the response was cut
+# off or the server is busy are tried again, waiting twice as long before each retry (see
+# qcf_fetch.py). Large datasets can also be downloaded in row ranges, so a failure only
+# costs one range; with the cache turned on, a download that was stopped part way is
+# resumed from the last complete range on the next run:
+#	   --retries N                   Number of times a failed request is tried again,
+#	                                 5 by default
+#	   --timeout SECONDS             Seconds to wait on the server for each part of a
+#	                                 response, 600 by default
+#	   --range-rows N                Download every row of a dataset in requests of N
+#	                                 rows (e.g. 500000)
+#
+# Plots of many datetimes can be created on several processor cores at once (see
+# qcf_render.py):
+#	   --jobs N                      Number of processes creating plots, 0 for one per core
+#
+# The figure, axes, labels and colorbar of the plots are created once for the chosen
+# variable, and only the data, limits and title are changed for each datetime:
+#	   --new-figures                 Create a new figure for every plot instead
+#
+# The plots are saved as PNG files in the current directory unless chosen otherwise (see
+# qcf_output.py):
+#	   --format FORMAT               Save the plots as png, svg or pdf files
+#	   --output-dir DIR              Save the plots in this directory
+#	   --tarball FILE                Add the plots to this tar file instead of separate files
+#
+# The rows of the plots can also be saved to a file, one datetime at a time, for other
+# tools to read without downloading them again (see qcf_export.py). The station names
+# are downloaded along with them:
+#	   --export FILE                 Save the rows to a Parquet (.parquet), Feather
+#	                                 (.feather, .arrow) or NetCDF (.nc) file, with the
+#	                                 date and time of each row as one time and the
+#	                                 missing values masked
+#
+# Instead of one 3D plot per datetime, the variable can be interpolated onto a fixed
+# latitude/longitude grid at every chosen datetime and saved as one animation or data
+# file (see qcf_grid.py). The interpolation weights are worked out once for the stations
+# and reused for every frame, and the frames are written one at a time:
+#	   --grid-output FILE            Save the gridded frames to this file: an animated
+#	                                 GIF (.gif), an MP4 video (.mp4, needs ffmpeg) or a
+#	                                 NetCDF file (.nc) with the variable on the grid at
+#	                                 every datetime. The datasets are gridded together.
+#	                                 GIF frames are kept in memory until the file is
+#	                                 written, so use .mp4 or .nc for long sequences.
+#	   --grid-size N                 Number of grid points along the latitude and the
+#	                                 longitude, 200 by default
+#	   --fps N                       Frames per second of the animation, 4 by default
+#
+# The time taken by each stage of a run (downloading, decoding, grouping, plotting,
+# saving...), with the rows, bytes and memory involved, can be measured (see
+# qcf_profile.py):
+#	   --profile                     Print a table of the stages at the end of the run
+#	   --profile-output FILE         Also save every stage to a JSON file, which can be
+#	                                 opened as a Chrome trace (chrome://tracing)
+#
 # NOTE: This script requires the following packages to be installed:
 #	   python3
-#	   pydap
+#	   requests
 #	   matplotlib
 #	   numpy
 #
+# The script also needs the qcf_fetch.py, qcf_cache.py, qcf_index.py, qcf_render.py,
+# qcf_output.py, qcf_meta.py, qcf_grid.py, qcf_export.py and qcf_profile.py modules from
+# this directory. Exporting to Parquet or Feather files also needs pyarrow, and saving
+# NetCDF files netCDF4 or scipy.
+#
 # Refer to the "Using Python to View OPeNDAP Files" document for more information on the script.
 # For questions about Python scripts and other features, refer to the Python help page at
 # https://www.python.org/about/help/
@@ -42,15 +147,19 @@
 # The 3D plots will be saved in the directory the script was called from and are *.png files.
 
 # The script uses the following hard-coded entities that may need to be changed:
-#   missing_value: This is a string containing the value used for missing data points
-#	   e.g. missing_value = "-999.99"
-#   var_index: This is the number of variables preceding the variables available to plot
-#	   against time. This includes any variables containing station information, time,
-#	   and location.
+#   missing_value: This is the value used for missing data points. It is set in
+#	   qcf_fetch.py, e.g. missing_value = -999.99
+#   location_fields: These are the numeric variables holding the location of the stations,
+#	   which are not offered for plotting. It is set in qcf_meta.py
 #   lines: This is a boolean value that determines whether the data points with a line
 #          down to the xy-plane will be plotted
-#   formatData: This is a string containing format information to convert strings to the 
-#	   python object datetime.
+#   triangulation_cache: The number of station sets whose Delaunay triangulation is kept
+#          for the plots of other datetimes with the same stations
+#   template_limit: The number of figures kept for reuse, one for each variable
+#   frame_rate: The default number of frames per second of the animations of --grid-output
+#   grid_formats: The file extensions --grid-output can save
+#   key_format: This is a string containing the format of the date and time keys the rows
+#	   are grouped by. It is set in qcf_index.py
 #   project_name: The name of the dataset's project for the title of the plots
 #   variable names: This script assumes that the variable names from the OPeNDAP file
 #	   are "date", "time", "network-name", "station-name"
@@ -67,21 +176,114 @@
 #                 adding the datetime to the list of available times to plot
 #              Added user selection to plot either nominal time or actual time
 #
+# October 2026: Replaced toArr with the qcf_fetch module, which returns typed numpy
+#               arrays with missing values set to NaN instead of lists of strings
+#               The variable, dates, times, latitudes and longitudes at the chosen
+#               datetimes are now downloaded together in a single filtered request
+#               (qcf_fetch.fetchColumns)
+#               Added the --datetime, --start and --end options, which are sent to the
+#               server so only the matching rows are downloaded
+#               Added the on-disk cache of downloaded variables (--cache-dir)
+#               Moved the main program into functions so python_batch.py can import the
+#               script, and added the --var, --time and --zlabel options to run without
+#               prompts
+#               Creating the 3D projection with add_subplot, as gca no longer accepts it
+#               Added the --jobs option to create the plots of the datetimes in parallel
+#               The available datetimes are counted with a group-by index of the rows
+#               (qcf_index.py) instead of a quadratic list count, and the index is cached
+#               The available datetimes are converted to python datetimes in bulk
+#               (qcf_fetch.toDateTime64) instead of with strptime
+#               Added the --stream option to read the data in chunks with bounded memory
+#               Several dataset links can be given, and are downloaded concurrently
+#               (qcf_fetch.fetchEach), with --merge to plot them together
+#               Added the --profile option to measure the time of each stage of a run
+#               The lines down to the xy-plane are drawn as one Line3DCollection and the
+#               points as one scatter instead of one artist per station, and the Delaunay
+#               triangulation is reused for datetimes with the same set of stations
+#               The figure of the plots is reused for every datetime, only swapping in the
+#               data of the surface, points and lines, the title and the limits
+#               (--new-figures to turn off)
+#               The plots are saved through qcf_output.py, in PNG, SVG or PDF format, to
+#               a directory, a tar file or memory (--format, --output-dir, --tarball)
+#               pydap and matplotlib are only imported when they are first needed, and
+#               matplotlib with the non-interactive Agg backend, as the plots are only
+#               saved; added the --list-vars and --list-datetimes options
+#               The variables, their types, units and missing values are read from the
+#               DDS and DAS of the dataset (qcf_meta.py) instead of with pydap, and the
+#               variables that can be plotted are the numeric ones instead of all the
+#               ones after the hard-coded var_index
+#               Added the --grid-output option to interpolate the variable onto a fixed
+#               grid at every datetime with weights computed once (qcf_grid.py), saved
+#               as a GIF or MP4 animation or a NetCDF file
+#               Added the --export option to save the rows of the plots to a Parquet,
+#               Feather or NetCDF file, one datetime at a time (qcf_export.py)
+#               Requests that fail are tried again with a growing wait (--retries,
+#               --timeout), and --range-rows downloads whole datasets in row ranges,
+#               resuming from the last complete range saved in the cache
+#
 
 # Import neccessary packages 
-from pydap.client import open_url
-import sys
+# matplotlib is imported when it is first needed (see loadPyplot), which
+# keeps runs that only list variables or datetimes or stop at a bad option fast
+import argparse
+from itertools import chain
 from datetime import datetime
-import matplotlib.pyplot as plt
 import numpy as np
-from matplotlib import cm
-from mpl_toolkits.mplot3d import Axes3D
+import qcf_cache
+import qcf_export
+import qcf_fetch
+import qcf_output
+import qcf_profile
+from qcf_fetch import datasetName, fetchColumns, fetchEach, joinColumns, parseDateTime, selectDateTimes, selectTimeWindow, subsetColumns, toDateTime64
+from qcf_index import countDateTimes, dateTimeKeys, groupRows, key_format, rowsOf, streamGroups
+from qcf_meta import describeDataset, fieldNames, formatField, plottableVars
+from qcf_output import savePlot
+from qcf_profile import stage
+from qcf_render import renderGroups, renderPlots
+
+#HARD-CODED
+lines = True
+project_name = "GCIP/ESOP 95"
+triangulation_cache = 16
+template_limit = 4
+frame_rate = 4
+grid_formats = [".gif", ".mp4", ".nc"]
+
+# Triangulations of the station sets plotted so far, keyed by the station positions
+triangulations = {}
+
+# Figures kept for the plots of each variable when figures are reused (see
+# updateTimeTemplate), and whether they are reused
+templates = {}
+reuse_figures = True
+
+# matplotlib.pyplot and the parts of matplotlib used for the 3D plots, once imported by
+# loadPyplot
+plt = None
+Triangulation = None
+Line3DCollection = None
 
 # Functions:
 
-# getVar() function prompts the user for the desired variable to plot, and collects the
-# information for later use.
-def getVar():
+# loadPyplot() function imports matplotlib.pyplot and the parts of matplotlib used for the
+# 3D plots the first time they are needed, with the non-interactive Agg backend since the
+# plots are only saved, never shown. Importing mplot3d adds the 3D projection.
+def loadPyplot():
+	global plt, Triangulation, Line3DCollection
+	if plt is None:
+		import matplotlib
+		matplotlib.use("Agg")
+		import matplotlib.pyplot as plt
+		from matplotlib.tri import Triangulation
+		from mpl_toolkits.mplot3d.art3d import Line3DCollection
+	return plt
+
+
+# getVar(url) function prompts the user for the desired variable to plot from the dataset at the
+# OPeNDAP link, and collects the information for later use.
+def getVar(url):
+# The variables of the dataset are read from its DDS and DAS (see qcf_meta.py)
+	names = fieldNames(url)
 # Prompt the user for desired variables and collect entries
 	while True:
 		var = input("\nWhich variable would you like to plot against space? To see a list of possible variables, enter 'list'. Please note that not entering the variable name as it appears within the file or OPeNDAP webform will result in errors.\n\n").strip()
@@ -91,12 +293,12 @@ def getVar():
 			print("\nThis file has the following variables available to plot against time: " + '\n\n')
 
 # Print the variables excluding the date, time, and location variables
-			print(list(dataset.keys())[var_index:])
+			print(plottableVars(url))
 			var = input("\n\nEnter variable to plot:\n").strip()
 
 # Check the validity of the user-entered variable by cross-referencing the list of possible variables
 # Once invalid variable is found, print the invalid variable and start this section over
-		if var not in dataset.keys():
+		if var not in names:
 			print("\nInvalid variable entered. Please enter your variable again.\n")
 			continue
 		else:
@@ -105,10 +307,16 @@ def getVar():
 # Return desired variable
 	return var
 
-# getTimes() function prompts the user for the date(s) and time(s) at which
-# to produce plots and stores that information for later use.
+# getDateTimeVars(timeToUse) function returns the names of the date and time variables
+# holding either the nominal or the actual time of each row.
+def getDateTimeVars(timeToUse):
+	if timeToUse == "nominal":
+		return "date_nominal", "time_nominal" # HARD-CODED
+	return "date", "time" # HARD-CODED
+
+# getTimeToUse() function prompts the user for either nominal time or actual time.
 
-def getTimes():
+def getTimeToUse():
 	error = False
 # Allow the user to specify either nominal time or actual time for the plot
 	while True:
@@ -122,38 +330,38 @@ def getTimes():
 		else:
 			break
 
-# Retrieve lists of dates and times from the dataset
-	if timeToUse == "nominal":
-		dates = toArr("date_nominal") # HARD-CODED
-		times = toArr("time_nominal") # HARD-CODED
-	else:
-		dates = toArr("date") # HARD-CODED
-		times = toArr("time") # HARD-CODED
-	datetimes = []
-
-# Create format string to use to convert dates and times to the python object datetime
-	formatData = "%Y/%m/%d-%H:%M:%S"
-
+# Return the choice of nominal or actual time
+	return timeToUse
+
+# availableTimes(urls, timeToUse, start, end) function returns the list of datetimes of the
+# dataset(s) (within the time window if one is given) that have enough data points for a plot.
+
+def availableTimes(urls, timeToUse, start=None, end=None):
+# Group the rows of the dataset by date and time in one pass, from only the dates and
+# times of the --start/--end time window if one was given, and count the rows at each
+# datetime. With the cache turned on, the grouping of the whole dataset is saved and
+# reused by later runs.
+# The datetimes of several datasets are counted at the same time and put together.
+	(dateVar, timeVar) = getDateTimeVars(timeToUse)
+	with stage("list"):
+		counted = fetchEach(urls, lambda url: countDateTimes(url, dateVar, timeVar, start, end))
+		(keys, group) = np.unique(np.concatenate([i[0] for i in counted]), return_inverse=True)
+		counts = np.bincount(group.reshape(-1), weights=np.concatenate([i[1] for i in counted]), minlength=len(keys))
+
+# Only keep the datetimes that have at least 3 data points. There has to be at least
+# 3 data points to produce a 3D plot. The keys are already sorted by time.
+		keys = keys[counts > 2]
+		return [i.item() for i in toDateTime64(keys, keys, timeOffset=10)]
+
+# getTimes(urls, timeToUse, start, end) function prompts the user for the date(s) and time(s)
+# at which to produce plots and returns the list of chosen datetimes.
+
+def getTimes(urls, timeToUse, start=None, end=None):
 # Create a list of unique datetimes to present to the user
-	uniqDateTimes = []
-
-# Create a dictionary that has the desired datetimes as the keys, and a list of indices
-# correlating to that datetime as the values
-	dateIndices = {}
-
-# Loop through the dates and times to create a python datetime object	
-	for i in range(len(dates)):
-		dateTimeStr = dates[i] + "-" + times[i]
-		curr = datetime.strptime(dateTimeStr, formatData)
-		datetimes.append(curr)
-
-# Add the datetime to the list of unique datetimes if it is not already added
-# Only add the datetime to the list of unique datetimes if there are at least
-# 3 data points.  There has to be at least 3 data points to produce a 3D plot.
-	for i in range(len(datetimes)):
-		if not datetimes[i] in uniqDateTimes:
-			if datetimes.count(datetimes[i]) > 2:
-				uniqDateTimes.append(datetimes[i])
+	uniqDateTimes = availableTimes(urls, timeToUse, start, end)
+
+# Create a list of the desired datetimes
+	dateList = []
 
 # Prompt the user for the desired datetimes(s) and collect their response.
 	error = False
@@ -178,145 +386,478 @@ def getTimes():
 			if i not in uniqDateTimes:
 				print("\n\nInvalid time entered: " + i.strftime("%Y/%m/%d-%H:%M") + ".\n")
 				error = True
-# If the datetime is valid, create a key in the dictionary with the datetime pointing to
-# an empty list
-			else:
-				dateIndices[i] = []
+# If the datetime is valid, add it to the list of desired datetimes
+			elif i not in dateList:
+				dateList.append(i)
                         
 		if error:
 			print("Please try again:\n")
 			error = False
+			dateList = []
 			continue
 		else:
 			break
-				
-# Loop through each occurence of the desired datetime(s) and note the indices in order
-# to retrieve the relevant data points later on.
-	for i in range(len(datetimes)):
-		if datetimes[i] in dateIndices.keys():
-			dateIndices[datetimes[i]].append(i)
-
-# Return dictionary of desired datetime(s) with list of relevant indices. 
-	return dateIndices, timeToUse 
-
-
-# toArr(var) function takes the name of a variable as seen in the OPeNDAP file and uses
-# the pydap client to retrieve an array of the values of that variable.
-def toArr(var):
-	commandStr = "enumerate(dataset."+var+".iterdata())"
-	arr = []
-	for i in eval(commandStr): arr.append(str(i[1]))
-	return arr
-
-
-# Main:
-
-#HARD-CODED
-missing = "-999.99"
-var_index = 9
-lines = True
-formatData = "%Y/%m/%d-%H:%M:%S"
-project_name = "GCIP/ESOP 95"
 
-# Pull OPeNDAP file link from command line argument 
-url = sys.argv[1]
+# Return list of desired datetime(s)
+	return dateList
+
+
+# plotTime(datetime, var, columns, rows, timeToUse, z_label, prefix, reuse) function creates the 3D
+# plot of the desired variable over all stations at one datetime from the given rows of the
+# downloaded columns, saves it to the current directory (with the prefix at the start of
+# the file name) and returns the name of the file, or None if there are fewer than 3 data
+# points. When reuse is True, the figure is kept and used again for the next datetime.
+def plotTime(datetime, var, columns, rows, timeToUse, z_label, prefix="", reuse=False):
+	loadPyplot()
+# Keep only the rows where the variable value isn't missing, along with the
+# corresponding latitude and longitude values
+	rows = rows[~np.isnan(columns[var][rows])]
+
+# There has to be at least 3 data points to produce a 3D plot
+	if len(rows) < 3:
+		return None
+
+	with stage("plot"):
+# Rename arrays as axises for plotting
+# The stations are put in order of latitude and longitude, so that the same set of
+# stations always gives the same positions and its triangulation can be reused
+		x = columns["latitude"][rows] # HARD-CODED
+		y = columns["longitude"][rows] # HARD-CODED
+		z = columns[var][rows]
+		order = np.lexsort((y, x))
+		(x, y, z) = (x[order], y[order], z[order])
+		triangulation = stationTriangulation(x, y)
 
-# Import dataset using the pydap client and specify QCF for NCAR/EOL datasets 
-dataset = open_url(url).QCF
-
-# Collect desired variable
-var = getVar()
-
-# Grab data values for desired variable 
-varValues = toArr(var)
-
-# Collect desired datetime(s)
-(relevantTimes, timeToUse) = getTimes()
-
-# Collect lists of latitudes and longitudes from the dataset 
-lats = toArr("latitude") # HARD-CODED
-lons = toArr("longitude") # HARD-CODED
-
-# Collect user input for the label on the z axis
-# e.g. "Degrees (celsius)
-z_label = input("\n\nWhat would you like the label to be on the z-axis?\n")
-
-print("\nCreating plots...\n\n")
+# Create array of all zeros to plot stations on the xy-plane
+		z0 = z * 0
 
-# Loop through each desired datetime to create plots
-for datetime in relevantTimes.keys():
-# Create an empty dictionary to hold values of latitude, longitude, and variable data values
-	values = {}
-
-# Create an empty list for each of latitude, longitude, and variable values
-	values["lat"] = []
-	values["lon"] = []
-	values[var] = []
-
-# Loop through the list of indices at the desired datetime and use those indices
-# to pull the data points from that time	
-	for i in relevantTimes[datetime]:
-
-# Check that variable value isn't missing before adding it and corresponding
-# latitude and longitude values to the list of values
-		if not varValues[i] == missing:
-			values[var].append(float(varValues[i]))
-			values["lat"].append(float(lats[i]))
-			values["lon"].append(float(lons[i]))
+# Find max and min value to create limits on z-axis
+		maxZ = z.max() + 5
+		minZ = z.min() - 5
 
 # Begin plotting
-# Create figure to hold graph	
-	fig = plt.figure(figsize=(20,15)) # HARD-CODED
+# Either reuse the figure made for earlier datetimes with the same variable, swapping in
+# the data of this datetime, or create a new figure to hold the graph
+		key = (var, timeToUse, z_label)
+		if reuse and key in templates:
+			ax = updateTimeTemplate(templates[key], triangulation, z, z0)
+			fig = ax.figure
+		else:
+			fig = plt.figure(figsize=(20,15)) # HARD-CODED
 
 # Create 3D projection
-	ax = fig.gca(projection='3d')
-
-# Rename lists as axises and convert to numpy array for plotting
-	x = np.array(values["lat"])
-	y = np.array(values["lon"])
-	z = np.array(values[var])
-
-# Create array of all zeros to plot stations on the xy-plane
-	z0 = z * 0
-
-# Find max and min value to create limits on z-axis
-	maxZ = max(z) + 5
-	minZ = min(z) - 5
+# The surface, the lines and the points are drawn in the order given by their zorder
+# instead of by their depth, as the lines are one artist that is partly in front of and
+# partly behind the surface
+			ax = fig.add_subplot(projection='3d', computed_zorder=False)
 
 # Plot triangulated surface
-	pt3 = ax.plot_trisurf(x, y, z, linewidth=0.2, antialiased=True, cmap='jet') 
+			pt3 = ax.plot_trisurf(triangulation, z, linewidth=0.2, antialiased=True, cmap='jet', zorder=2) 
 
 # If lines are wanted, plot points on triangulated surface, points on xy-axis
 # and lines connecting them
-	if lines:	
-# Two scatter plots
-		ax.scatter(x,y,z, marker='.', s=10, c="black", alpha=0.5)
-		ax.scatter(x,y,z0, marker='.', s=10, c='black', alpha=0.5)
-
-# Plot lines connecting points
-		for i in range(0, len(z)):
-			ax.plot([x[i],x[i]], [y[i],y[i]], [0,z[i]], linewidth=0.5, c='black')
-	
-# Set labels, colors, title, and view of graph
+			points = None
+			drops = None
+			if lines:	
+# One scatter plot of the points on the surface and on the xy-plane together
+				points = ax.scatter(np.concatenate((x, x)), np.concatenate((y, y)), np.concatenate((z, z0)), marker='.', s=10, c="black", alpha=0.5, zorder=3)
+
+# Plot lines connecting points, all of them as one collection
+				drops = Line3DCollection(dropLines(x, y, z, z0), linewidths=0.5, colors='black', zorder=1)
+				ax.add_collection3d(drops)
+		
+# Set labels, colors, and view of graph
 # HARD-CODED
-	ax.set_zlim(0, maxZ)
-	plt.xlabel('Latitude')
-	ax.set_zlabel(z_label)
-	plt.ylabel('Longitude')
-	ax.view_init(elev=20, azim = 45)
-	cbar=plt.colorbar(pt3)
-	cbar.set_label(z_label)
-	
+			plt.xlabel('Latitude')
+			ax.set_zlabel(z_label)
+			plt.ylabel('Longitude')
+			ax.view_init(elev=20, azim = 45)
+			cbar=plt.colorbar(pt3)
+			cbar.set_label(z_label)
+
+# Keep the figure for the next datetime, making room by closing the one kept the longest
+			if reuse:
+				if len(templates) >= template_limit:
+					plt.close(templates.pop(next(iter(templates)))["ax"].figure)
+				templates[key] = {"ax": ax, "surface": pt3, "points": points, "drops": drops}
+		ax.set_zlim(0, maxZ) # HARD-CODED
+		
 # Replace underscores in the variable name with spaces
-	varStr = var.replace('_', ' ').title()
-	plt.title(project_name + ' ' + varStr + ' on '+ datetime.strftime("%Y-%m-%d %H:%M:%S") + ' UTC (' + timeToUse.capitalize() + ' Time)')
-	
+		varStr = var.replace('_', ' ').title()
+		ax.set_title(project_name + ' ' + varStr + ' on '+ datetime.strftime("%Y-%m-%d %H:%M:%S") + ' UTC (' + timeToUse.capitalize() + ' Time)')
+		
 # Save plot to current directory with variable and date 
-	fig.savefig(datetime.strftime("%Y%m%d%H%M")  + '_' + var + '.png')
-
-# Close figure
-	plt.close(fig)
+		fileStr = prefix + datetime.strftime("%Y%m%d%H%M")  + '_' + var
+	with stage("save"):
+		fileStr = savePlot(fig, fileStr)
+
+# Close figure, unless it is kept for the next datetime
+	if not reuse:
+		plt.close(fig)
+	return fileStr
+
+
+# dropLines(x, y, z, z0) function returns the segments of the lines from the points on the
+# surface down to the xy-plane.
+def dropLines(x, y, z, z0):
+	return np.stack((np.column_stack((x, y, z0)), np.column_stack((x, y, z))), axis=1)
+
+
+# updateTimeTemplate(template, triangulation, z, z0) function swaps the data of a datetime
+# into a kept figure: the triangles and colors of the surface, the points and the lines,
+# and the limits of the latitude and longitude axes. It returns the axes of the figure.
+def updateTimeTemplate(template, triangulation, z, z0):
+	(x, y) = (triangulation.x, triangulation.y)
+	triangles = triangulation.get_masked_triangles()
+	verts = np.stack((x[triangles], y[triangles], z[triangles]), axis=-1)
+
+# Color the triangles by their average value like plot_trisurf, and rescale the colorbar
+	surface = template["surface"]
+	surface.set_verts(verts)
+	surface.set_array(verts[:, :, 2].mean(axis=1))
+	surface.autoscale()
+	if template["points"] is not None:
+		template["points"].set_offsets(np.column_stack((np.concatenate((x, x)), np.concatenate((y, y)))))
+		template["points"].set_3d_properties(np.concatenate((z, z0)), "z")
+		template["drops"].set_segments(dropLines(x, y, z, z0))
+	ax = template["ax"]
+	ax.auto_scale_xyz(x, y, z, had_data=False)
+	return ax
+
+
+# stationTriangulation(x, y) function returns the Delaunay triangulation of the stations at
+# the given latitudes and longitudes, reusing the one made for an earlier plot of the
+# same stations.
+def stationTriangulation(x, y):
+	key = (x.tobytes(), y.tobytes())
+	if key not in triangulations:
+		if len(triangulations) >= triangulation_cache:
+			triangulations.pop(next(iter(triangulations)))
+		triangulations[key] = Triangulation(x, y)
+	return triangulations[key]
+
+
+# timeSelections(dateVar, timeVar, datetimes, window) function returns the selection
+# clauses of the rows at the desired datetime(s), or, when datetimes holds every datetime
+# of the (start, end) time window given as window, of the rows of that time window, so
+# that the request doesn't name every datetime of the dataset.
+def timeSelections(dateVar, timeVar, datetimes, window=None):
+	if window is not None:
+		return selectTimeWindow(dateVar, *window)
+	return selectDateTimes(dateVar, timeVar, datetimes)
+
+
+# plotTimes(urls, var, datetimes, timeToUse, z_label, jobs, merge, window) function
+# downloads the desired variable at the desired datetime(s) from each dataset and creates
+# one 3D plot per datetime and dataset, or one plot per datetime for all the datasets
+# together when merge is True, on the given number of processes. When datetimes holds
+# every datetime of a time window, window is that (start, end) window (see
+# timeSelections). It returns the list of the names of the saved files.
+def plotTimes(urls, var, datetimes, timeToUse, z_label, jobs=1, merge=False, window=None):
+	(dateVar, timeVar) = getDateTimeVars(timeToUse)
+	fields = plotFields(dateVar, timeVar, var)
+	selections = timeSelections(dateVar, timeVar, datetimes, window)
+	if qcf_fetch.streaming:
+# Read the datasets one after another in chunks
+		results = chain.from_iterable(streamTimes(url, fields, selections, var, datetimes, timeToUse, z_label, jobs, filePrefix(urls, url)) for url in urls)
+	else:
+# Download the dates, times, latitudes, longitudes and desired variable for only the
+# rows at the desired datetime(s) in a single request per dataset, for all of the
+# datasets at once. Each column is a numpy array and the variable values are NaN where
+# missing.
+		datasets = fetchEach(urls, lambda url: fetchColumns(url, fields, selections))
+		if merge and len(datasets) > 1:
+			datasets = [joinColumns(datasets)]
+			urls = urls[:1]
+		results = chain.from_iterable(renderTimes(columns, var, datetimes, timeToUse, z_label, jobs, filePrefix(urls, url)) for (url, columns) in zip(urls, datasets))
+
+	files = []
+	plotted = set()
+	for (datetime, fileStr) in results:
 
 # Print the name of the plot and where it is saved.
-	print('Plot saved in the current directory with the name ' + datetime.strftime("%Y%m%d%H%M")  + '_' + var + '.png')
+		if fileStr is not None:
+			print('Plot saved in ' + qcf_output.location() + ' with the name ' + fileStr)
+			files.append(fileStr)
+			plotted.add(datetime)
+	for datetime in datetimes:
+		if datetime not in plotted:
+			print('Fewer than 3 data points found at ' + datetime.strftime("%Y/%m/%d-%H:%M") + ', no plot created.')
+	return files
+
+
+# renderTimes(columns, var, datetimes, timeToUse, z_label, jobs, prefix) function creates the
+# plot at each desired datetime from the downloaded columns of a dataset. It yields the
+# datetime and the name of the saved file of each plot.
+def renderTimes(columns, var, datetimes, timeToUse, z_label, jobs=1, prefix=""):
+# Group the downloaded rows by date and time, to find the rows at each desired datetime
+	(dateVar, timeVar) = getDateTimeVars(timeToUse)
+	index = groupRows(dateTimeKeys(columns[dateVar], columns[timeVar]))
+	qcf_export.exportGroups(columns, index, [datetime.strftime(key_format) for datetime in datetimes])
 
+# Loop through each desired datetime to create plots
+# The plots are created by the number of processes given with --jobs
+	tasks = [{"datetime": datetime, "var": var, "rows": rowsOf(index, datetime.strftime(key_format)), "timeToUse": timeToUse, "z_label": z_label, "prefix": prefix, "reuse": reuse_figures} for datetime in datetimes]
+	return zip(datetimes, renderPlots(plotTime, tasks, columns, jobs))
+
+
+# streamTimes(url, fields, selections, var, datetimes, timeToUse, z_label, jobs, prefix)
+# function downloads the fields in streaming mode, keeping only the rows at the desired
+# datetime(s), and creates the plot of each datetime as soon as all of its rows have
+# arrived (the rows of QCF datasets are sorted by nominal time; the actual times may be
+# out of order, so they are plotted once the whole download has arrived). It yields the
+# datetime and the name of the saved file of each plot.
+def streamTimes(url, fields, selections, var, datetimes, timeToUse, z_label, jobs=1, prefix=""):
+	(dateVar, timeVar) = getDateTimeVars(timeToUse)
+	wanted = dict((datetime.strftime(key_format).encode("ascii"), datetime) for datetime in datetimes)
+	def keysOf(columns):
+		return dateTimeKeys(columns[dateVar], columns[timeVar])
+	def keep(columns):
+		return np.isin(keysOf(columns), list(wanted))
+	def groups():
+		for (key, columns) in streamGroups(url, fields, selections, keysOf, keep, ordered=timeToUse == "nominal"):
+			qcf_export.exportColumns(columns)
+			yield {"datetime": wanted[key], "var": var, "rows": np.arange(len(columns[var])), "timeToUse": timeToUse, "z_label": z_label, "prefix": prefix, "reuse": reuse_figures}, columns
+	for (options, fileStr) in renderGroups(plotTime, groups(), jobs):
+		yield options["datetime"], fileStr
+
+
+# gridTimes(urls, var, datetimes, timeToUse, z_label, output, size, fps, window) function
+# downloads the desired variable at the desired datetime(s) from all the datasets,
+# interpolates it onto one latitude/longitude grid at every datetime and saves the frames
+# to the output file, an animation or a NetCDF file depending on its extension. When
+# datetimes holds every datetime of a time window, window is that (start, end) window
+# (see timeSelections). It returns the number of frames saved.
+def gridTimes(urls, var, datetimes, timeToUse, z_label, output, size=None, fps=frame_rate, window=None):
+# qcf_grid imports matplotlib, which is only imported when it is first needed
+	loadPyplot()
+	import qcf_grid
+	(dateVar, timeVar) = getDateTimeVars(timeToUse)
+	fields = plotFields(dateVar, timeVar, var)
+	datasets = fetchEach(urls, lambda url: fetchColumns(url, fields, timeSelections(dateVar, timeVar, datetimes, window)))
+	columns = joinColumns(datasets) if len(datasets) > 1 else datasets[0]
+
+# The rows of a whole time window also hold datetimes with too few data points, which
+# are left out of the grid and the color scale
+	if window is not None:
+		wanted = [datetime.strftime(key_format).encode("ascii") for datetime in datetimes]
+		columns = subsetColumns(columns, np.isin(dateTimeKeys(columns[dateVar], columns[timeVar]), wanted))
+
+# One grid covering every station, and one color scale for every frame
+	grid = qcf_grid.makeGrid(columns["latitude"], columns["longitude"], size or qcf_grid.grid_size) # HARD-CODED
+	with stage("index"):
+		index = groupRows(dateTimeKeys(columns[dateVar], columns[timeVar]))
+	qcf_export.exportGroups(columns, index, [datetime.strftime(key_format) for datetime in datetimes])
+	frames = qcf_grid.gridFrames(columns, var, ((datetime, rowsOf(index, datetime.strftime(key_format))) for datetime in datetimes), grid)
+	if output.endswith(".nc"):
+		attributes = dict((name, value) for (name, value) in describeDataset(urls[0])[fieldNames(urls[0]).index(var)]["attributes"].items() if isinstance(value, (str, float)))
+		cube = qcf_grid.openCube(output, var, grid, attributes)
+		try:
+			for (datetime, frame) in frames:
+				with stage("save"):
+					qcf_grid.addFrame(cube, datetime, frame)
+		finally:
+			qcf_grid.closeCube(cube)
+		return cube["frames"]
+	values = columns[var][~np.isnan(columns[var])]
+	limits = (values.min(), values.max()) if len(values) else (0, 1)
+	return animateFrames(frames, output, grid, var, timeToUse, z_label, limits, fps)
+
+
+# animateFrames(frames, output, grid, var, timeToUse, z_label, limits, fps) function draws
+# each gridded frame as a color map of the variable on one figure and streams it to a GIF
+# or MP4 animation, returning the number of frames saved. The animation is written by
+# ffmpeg for MP4 files and by Pillow, which keeps the frames until the end, for GIF files.
+def animateFrames(frames, output, grid, var, timeToUse, z_label, limits, fps=frame_rate):
+	from matplotlib import animation
+	if output.endswith(".mp4"):
+		if not animation.FFMpegWriter.isAvailable():
+			raise RuntimeError("Saving MP4 files needs ffmpeg, which was not found (save a .gif or .nc file instead)")
+		writer = animation.FFMpegWriter(fps=fps)
+	else:
+		writer = animation.PillowWriter(fps=fps)
+
+# HARD-CODED
+	fig = plt.figure(figsize=(12,10))
+	ax = fig.gca()
+	image = ax.imshow(np.full((len(grid[0]), len(grid[1])), np.nan), origin="lower", extent=(grid[1][0], grid[1][-1], grid[0][0], grid[0][-1]), aspect="auto", interpolation="nearest", cmap="jet", vmin=limits[0], vmax=limits[1])
+	ax.set_xlabel('Longitude')
+	ax.set_ylabel('Latitude')
+	cbar = fig.colorbar(image)
+	cbar.set_label(z_label)
+	varStr = var.replace('_', ' ').title()
+
+# Only the data and the title of the figure change from frame to frame
+	saved = 0
+	try:
+		with writer.saving(fig, output, dpi=100): # HARD-CODED
+			for (datetime, frame) in frames:
+				with stage("save"):
+					image.set_data(frame)
+					ax.set_title(project_name + ' ' + varStr + ' on '+ datetime.strftime("%Y-%m-%d %H:%M:%S") + ' UTC (' + timeToUse.capitalize() + ' Time)')
+					writer.grab_frame()
+				saved += 1
+	finally:
+		plt.close(fig)
+	return saved
+
+
+# plotFields(dateVar, timeVar, var) function returns the fields downloaded for the plots of
+# the variable: the date and time, the location and the variable, and the station names
+# when the rows are exported.
+def plotFields(dateVar, timeVar, var):
+	fields = [dateVar, timeVar, "latitude", "longitude", var] # HARD-CODED
+	if qcf_export.export_file is not None:
+		fields += ["network_name", "platform_name"] # HARD-CODED
+	return fields
+
+
+# filePrefix(urls, url) function returns the start of the file names of the plots of the
+# dataset at the OPeNDAP link: nothing when only one dataset is plotted, and the name of
+# the dataset otherwise, so the plots at the same datetime don't overwrite each other.
+def filePrefix(urls, url):
+	if len(urls) == 1:
+		return ""
+	return datasetName(url) + "_"
+
+
+# main(argv) function runs the script: it reads the command line options, prompts the
+# user for anything they don't give and creates the plots.
+def main(argv=None):
+# Pull OPeNDAP file link and selection options from command line arguments
+	parser = argparse.ArgumentParser(description="Plot a variable of an NCAR/EOL QCF dataset in 3D over all stations at the chosen datetimes.")
+	parser.add_argument("url", nargs="+", help="OPeNDAP link(s) to the desired dataset(s)")
+	parser.add_argument("--var", help="variable to plot")
+	parser.add_argument("--time", choices=["nominal", "actual"], help="use the nominal or the actual time of the data")
+	parser.add_argument("--datetime", action="append", help="datetime to plot, YYYY/mm/dd-HH:MM (UTC) (repeat or separate with commas for several), or 'all'")
+	parser.add_argument("--start", help="first datetime to offer, YYYY/mm/dd-HH:MM or YYYY/mm/dd (UTC)")
+	parser.add_argument("--end", help="last datetime to offer, YYYY/mm/dd-HH:MM or YYYY/mm/dd (UTC)")
+	parser.add_argument("--zlabel", help="label on the z-axis")
+	parser.add_argument("--list-vars", action="store_true", help="print the variables of the (first) dataset that can be plotted and exit")
+	parser.add_argument("--list-datetimes", action="store_true", help="print the datetimes of the dataset(s) with at least 3 data points and exit")
+	parser.add_argument("--cache-dir", help="directory of the on-disk cache of downloaded variables")
+	parser.add_argument("--cache-size", type=float, help="size limit of the cache in GB")
+	parser.add_argument("--no-cache", action="store_true", help="don't use the cache even if QCF_CACHE_DIR is set")
+	parser.add_argument("--stream", action="store_true", help="read the data in chunks, keeping only the rows of the plots in memory (the cache is not used)")
+	parser.add_argument("--chunk-size", type=float, help="size of the chunks read in streaming mode in MB, 64 MB by default")
+	parser.add_argument("--retries", type=int, help="number of times a failed request is tried again, 5 by default")
+	parser.add_argument("--timeout", type=float, help="seconds to wait on the server for each part of a response, 600 by default")
+	parser.add_argument("--range-rows", type=int, help="download every row of a dataset in requests of this many rows, resuming from the last complete one (with the cache)")
+	parser.add_argument("--jobs", type=int, default=1, help="number of processes creating plots at once, 0 for one per processor core")
+	parser.add_argument("--merge", action="store_true", help="plot the data of all the datasets together instead of one plot per dataset")
+	parser.add_argument("--new-figures", action="store_true", help="create a new figure for every plot instead of reusing one for the plots of the same variable")
+	parser.add_argument("--format", choices=qcf_output.output_formats, default="png", help="file format of the plots, png by default")
+	parser.add_argument("--output-dir", help="directory to save the plots in, the current one by default")
+	parser.add_argument("--tarball", help="add the plots to this tar file instead of saving them as separate files")
+	parser.add_argument("--grid-output", help="interpolate the variable onto a fixed grid at every datetime and save the frames to this .gif, .mp4 or .nc file instead of 3D plots")
+	parser.add_argument("--grid-size", type=int, help="number of grid points along the latitude and the longitude, 200 by default")
+	parser.add_argument("--fps", type=float, default=frame_rate, help="frames per second of the --grid-output animation")
+	parser.add_argument("--export", help="also save the rows of the plots to this Parquet (.parquet), Feather (.feather, .arrow) or NetCDF (.nc) file")
+	parser.add_argument("--profile", action="store_true", help="print the time, rows, bytes and memory of each stage of the run")
+	parser.add_argument("--profile-output", help="also save the profile to this JSON file, which can be opened as a Chrome trace")
+	args = parser.parse_args(argv)
+	urls = args.url
+	qcf_profile.setProfile(args.profile or bool(args.profile_output))
+	global reuse_figures
+	reuse_figures = not args.new_figures
+	if args.merge and args.stream:
+		parser.error("--merge can't be used with --stream")
+	if args.export:
+		try:
+			qcf_export.checkExport(args.export)
+		except ValueError as e:
+			parser.error(str(e))
+	if args.grid_output:
+		if args.stream:
+			parser.error("--grid-output can't be used with --stream")
+		if not any(args.grid_output.endswith(i) for i in grid_formats):
+			parser.error("--grid-output must be a " + ", ".join(grid_formats) + " file")
+		if args.grid_size is not None and args.grid_size < 2:
+			parser.error("--grid-size must be at least 2")
+
+# Set how failed requests are tried again and whether downloads are split into row ranges
+	if (args.retries is not None and args.retries < 0) or (args.timeout is not None and args.timeout <= 0) or (args.range_rows is not None and args.range_rows < 0):
+		parser.error("--retries and --range-rows can't be negative, and --timeout must be positive")
+	qcf_fetch.setRetries(args.retries, args.timeout, args.range_rows)
+
+# Turn on the cache of downloaded variables if a directory was given
+# In streaming mode the data is read in chunks instead and the cache is not used
+# Every setting is given again, so the jobs of python_batch.py don't inherit them
+	qcf_fetch.setStreaming(args.stream, args.chunk_size * 1024**2 if args.chunk_size else None)
+	qcf_cache.setCache(None if args.stream or args.no_cache else qcf_cache.cacheDir(args.cache_dir), args.cache_size * 1024**3 if args.cache_size else None)
+	qcf_fetch.setIncremental(False)
+	start = parseDateTime(args.start) if args.start else None
+	end = parseDateTime(args.end, end=True) if args.end else None
+
+# Print the variables and/or datetimes and stop, if asked to
+	if args.list_vars or args.list_datetimes:
+		if args.list_vars:
+			print("\n".join(formatField(field) for field in describeDataset(urls[0]) if field["plottable"]))
+		if args.list_datetimes:
+			print("\n".join(i.strftime("%Y/%m/%d-%H:%M") for i in availableTimes(urls, args.time or "nominal", start, end)))
+		return
+
+# Collect desired variable, prompting for it if it wasn't given with --var
+	if args.var:
+		var = args.var.strip()
+		if var not in fieldNames(urls[0]):
+			parser.error("Invalid variable entered: " + var + " (the variables that can be plotted are " + ", ".join(plottableVars(urls[0])) + ")")
+	else:
+# The variables of the first dataset are offered when several are given
+		var = getVar(urls[0])
+
+# Collect desired datetime(s). Datetimes given with --datetime are used as is, without
+# downloading the dates and times of the dataset.
+	timeToUse = args.time or getTimeToUse()
+	datetimes = [i.strip() for i in ",".join(args.datetime or []).split(",") if i.strip()]
+	window = None
+	if datetimes == ["all"]:
+		relevantTimes = availableTimes(urls, timeToUse, start, end)
+		window = (start, end)
+		if not relevantTimes:
+			print("No data found at any datetime, no plot created.")
+			return
+	elif datetimes:
+		relevantTimes = list(dict.fromkeys(parseDateTime(i) for i in datetimes))
+	else:
+		relevantTimes = getTimes(urls, timeToUse, start, end)
+
+# Collect user input for the label on the z axis
+# e.g. "Degrees (celsius)
+	if args.zlabel is not None:
+		z_label = args.zlabel
+	else:
+		z_label = input("\n\nWhat would you like the label to be on the z-axis?\n")
+
+# Choose the file to export the rows to, if any
+	if args.export:
+		qcf_export.setExport(args.export, *getDateTimeVars(timeToUse))
+	try:
+# Grid every datetime into one animation or NetCDF file instead of separate plots
+		if args.grid_output:
+			print("\nGridding " + str(len(relevantTimes)) + " datetime(s)...\n\n")
+			frames = gridTimes(urls, var, relevantTimes, timeToUse, z_label, args.grid_output, args.grid_size, args.fps, window)
+			print(str(frames) + ' frame(s) saved in ' + args.grid_output)
+		else:
+			print("\nCreating plots...\n\n")
+# Choose the format of the plots and where to save them
+			qcf_output.setOutput(args.format, args.output_dir, args.tarball)
+			try:
+				plotTimes(urls, var, relevantTimes, timeToUse, z_label, args.jobs, args.merge, window)
+			finally:
+				qcf_output.closeOutput()
+	finally:
+		exported = qcf_export.closeExport()
+	if args.export:
+		print(str(exported) + ' row(s) exported to ' + args.export)
+
+# Print and save the time taken by each stage of the run
+	if qcf_profile.enabled:
+		qcf_profile.report()
+		if args.profile_output:
+			qcf_profile.writeTrace(args.profile_output)
+			print("Profile saved in " + args.profile_output)
+
+
+if __name__ == "__main__":
+	main()
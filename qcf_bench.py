@@ -0,0 +1,308 @@
+# Authorship: NCAR Earth Observing Laboratory Data Management & Services Group
+# Contact: eol-archive@ucar.edu
+#
+# Licensing: The code associated with this document is provided freely and openly.
+# Users are hereby granted a license to access and use this code, unless otherwise
+# stated, subject to the terms and conditions of the GNU Affero General Public
+# License 3.0 (AGPL-3.0; https://www.gnu.org/licenses/agpl-3.0.en.html). This
+# documentation and associated code are provided "as is" and are not supported.
+# By using or downloading this code, the user agrees to the terms and conditions
+# set forth in this code and in the "Using Python to View OPeNDAP Files" document.
+#
+# Acknowledgment: This work was sponsored by the National Science Foundation.
+# This material is based upon work supported by the National Center for Atmospheric
+# Research, a major facility sponsored by the National Science Foundation and managed
+# by the University Corporation for Atmospheric Research. Any opinions, findings
+# and conclusions or recommendations expressed in this material do not necessarily
+# reflect the views of the National Science Foundation.
+#
+# To run this script, use the following command:
+#		python3 qcf_bench.py --output results.json
+#
+# The following options may be added:
+#		--sizes 10k,1M,50M	Numbers of rows of the synthetic datasets to time, 10k,
+#					100k and 1M by default
+#		--stations N		Number of stations of the datasets, 50 by default
+#		--scripts xy,xyz	Script(s) whose stages are timed, both by default
+#		--repeat N		Run every benchmark N times and keep the fastest time
+#					of each stage, 3 by default
+#		--latency SECONDS	Wait this long before the server answers each request
+#		--output FILE		Save the results to this JSON file
+#		--baseline FILE		Compare the results with those saved in an earlier run,
+#					and exit with status 1 if a stage got slower
+#		--tolerance RATIO	How much slower than the baseline a stage may be, 1.25
+#					(25% slower) by default
+#
+# NOTE: This script requires the same packages as python_xy.py and python_xyz.py.
+#
+# The qcf_bench.py script times the stages of python_xy.py and python_xyz.py on
+# synthetic QCF datasets served by qcf_standin.py, so that changes to the
+# scripts can be measured without the Field Data Archive. For every dataset size it
+# starts qcf_standin.py on a free port of this machine and times, for each script:
+#	startup: importing the script (in a new python process, so nothing is loaded yet)
+#	list_vars: running the script with --list-vars in a new python process, from start
+#		to exit
+#	list: listing the stations (python_xy.py) or the datetimes with at least 3 data
+#		points (python_xyz.py) of the whole dataset
+#	fetch: downloading the variables of the plots for the first stations or datetimes
+#	index: grouping the downloaded rows by station or datetime
+#	parse: converting the downloaded dates and times to numpy datetime64
+#	render: creating and saving the plots
+# The on-disk cache is not used, so every run downloads the data.
+#
+# The results are printed as a table and may be saved as JSON. Saving the results of
+# a run and passing them with --baseline to a later one reports the stages that got
+# slower by more than the tolerance (and by more than noise_floor seconds).
+#
+# The script uses the following hard-coded entities that may need to be changed:
+#	plot_count: The number of stations or datetimes plotted in each benchmark
+#	noise_floor: Stages that are slower than the baseline by fewer seconds than this
+#		are not reported as slower
+# To change any of these values, simply search "HARD-CODED" in this script
+#
+
+# Import necessary packages:
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+# Plots are only written to files, so use the non-interactive backend
+import matplotlib
+matplotlib.use("Agg")
+
+import numpy as np
+import python_xy
+import python_xyz
+import qcf_cache
+import qcf_fetch
+import qcf_standin
+from qcf_fetch import fetchColumns, selectDateTimes, selectStations, toDateTime64
+from qcf_index import countDateTimes, countStations, dateTimeKeys, groupRows, rowsOf, stationKeys
+
+
+#HARD-CODED
+plot_count = 5
+noise_floor = 0.05
+
+# Stages timed for each script, in order
+stages = ["startup", "list_vars", "list", "fetch", "index", "parse", "render"]
+
+
+# Functions:
+
+# parseSize(text) function converts a number of rows given as e.g. 10000, 10k or 50M into
+# an integer.
+def parseSize(text):
+	text = text.strip().lower()
+	for (suffix, factor) in (("k", 1000), ("m", 1000000)):
+		if text.endswith(suffix):
+			return int(float(text[:-len(suffix)]) * factor)
+	return int(text)
+
+
+# startServer(rows, stations, latency) function starts qcf_standin.py in a background
+# thread on a free port and returns the server and the OPeNDAP link of its dataset.
+def startServer(rows, stations, latency=0):
+	server = qcf_standin.makeServer(0, rows, stations, latency=latency)
+	thread = threading.Thread(target=server.serve_forever, daemon=True)
+	thread.start()
+	return server, "http://127.0.0.1:%d/qcf" % server.server_port
+
+
+# timeStartup(script) function returns the number of seconds it takes a new python
+# process to import the script.
+def timeStartup(script):
+	code = "import time; t = time.perf_counter(); import %s; print(time.perf_counter() - t)" % script
+	env = dict(os.environ, MPLBACKEND="Agg")
+	output = subprocess.run([sys.executable, "-c", code], cwd=os.path.dirname(os.path.abspath(__file__)), env=env, capture_output=True, text=True, check=True)
+	return float(output.stdout.split()[-1])
+
+
+# timeListVars(script, url) function returns the number of seconds a new python process
+# takes to run the script with --list-vars on the dataset at the link.
+def timeListVars(script, url):
+	env = dict(os.environ, MPLBACKEND="Agg")
+	directory = os.path.dirname(os.path.abspath(__file__))
+	clock = time.perf_counter()
+	subprocess.run([sys.executable, os.path.join(directory, script + ".py"), url, "--list-vars"], cwd=directory, env=env, capture_output=True, check=True)
+	return time.perf_counter() - clock
+
+
+# benchXy(url) function times the stages of python_xy.py on the dataset at the link and
+# returns a dictionary of the seconds taken by each stage and the number of rows fetched.
+def benchXy(url):
+	times = {"startup": timeStartup("python_xy"), "list_vars": timeListVars("python_xy", url)}
+	clock = time.perf_counter()
+	found = countStations(url)[0]
+	stations = found[:plot_count]
+	times["list"] = time.perf_counter() - clock
+
+# The stations are only named in the request when they are not all of them
+	vars = ["temp_air", "dew_point"] # HARD-CODED
+	clock = time.perf_counter()
+	columns = fetchColumns(url, ["network_name", "platform_name", "date", "time"] + vars, selectStations(stations) if len(stations) < len(found) else [])
+	times["fetch"] = time.perf_counter() - clock
+
+	clock = time.perf_counter()
+	index = groupRows(stationKeys(columns))
+	rows = [rowsOf(index, station) for station in stations]
+	times["index"] = time.perf_counter() - clock
+
+	clock = time.perf_counter()
+	toDateTime64(columns["date"], columns["time"])
+	times["parse"] = time.perf_counter() - clock
+
+	clock = time.perf_counter()
+	for (station, stationRows) in zip(stations, rows):
+		python_xy.plotStation(station, vars, columns, stationRows, "Degrees (celsius)")
+	times["render"] = time.perf_counter() - clock
+	return times, len(columns["date"])
+
+
+# benchXyz(url) function times the stages of python_xyz.py on the dataset at the link and
+# returns a dictionary of the seconds taken by each stage and the number of rows fetched.
+def benchXyz(url):
+	times = {"startup": timeStartup("python_xyz"), "list_vars": timeListVars("python_xyz", url)}
+	(dateVar, timeVar) = python_xyz.getDateTimeVars("nominal")
+	clock = time.perf_counter()
+	(keys, counts) = countDateTimes(url, dateVar, timeVar)
+	found = len(keys)
+	keys = keys[counts > 2][:plot_count]
+	datetimes = [i.item() for i in toDateTime64(keys, keys, timeOffset=10)]
+	times["list"] = time.perf_counter() - clock
+
+# The datetimes are only named in the request when they are not all of them
+	var = "temp_air" # HARD-CODED
+	clock = time.perf_counter()
+	columns = fetchColumns(url, [dateVar, timeVar, "latitude", "longitude", var], selectDateTimes(dateVar, timeVar, datetimes) if len(keys) < found else [])
+	times["fetch"] = time.perf_counter() - clock
+
+	clock = time.perf_counter()
+	index = groupRows(dateTimeKeys(columns[dateVar], columns[timeVar]))
+	rows = [rowsOf(index, key) for key in keys]
+	times["index"] = time.perf_counter() - clock
+
+	clock = time.perf_counter()
+	toDateTime64(columns[dateVar], columns[timeVar])
+	times["parse"] = time.perf_counter() - clock
+
+	clock = time.perf_counter()
+	for (datetime, timeRows) in zip(datetimes, rows):
+		python_xyz.plotTime(datetime, var, columns, timeRows, "nominal", "Degrees (celsius)")
+	times["render"] = time.perf_counter() - clock
+	return times, len(columns[var])
+
+
+# runBenchmarks(sizes, stations, scripts, repeat, latency) function runs the benchmarks of
+# each script on a synthetic dataset of each size and returns the results, keeping the
+# fastest time of each stage over the repeats.
+def runBenchmarks(sizes, stations, scripts, repeat=3, latency=0):
+	benchmarks = {"xy": benchXy, "xyz": benchXyz}
+	results = dict((script, {}) for script in scripts)
+	cwd = os.getcwd()
+	directory = tempfile.mkdtemp(prefix="qcf_bench_")
+	os.chdir(directory)
+	try:
+		for rows in sizes:
+			(server, url) = startServer(rows, stations, latency)
+			try:
+				for script in scripts:
+					best = {}
+					for i in range(repeat):
+# Start every run without the cache and without knowing the dataset
+						qcf_cache.cache_dir = None
+						qcf_fetch.validated.clear()
+						(times, fetched) = benchmarks[script](url)
+						for (stage, seconds) in times.items():
+							best[stage] = min(seconds, best.get(stage, seconds))
+					results[script][str(rows)] = {"rows": rows, "fetched": fetched, "stages": best}
+					print(formatRow(script, rows, best))
+			finally:
+				server.shutdown()
+				server.server_close()
+	finally:
+		os.chdir(cwd)
+		for name in os.listdir(directory):
+			os.remove(os.path.join(directory, name))
+		os.rmdir(directory)
+	return results
+
+
+# formatRow(script, rows, times) function returns a line of the printed table of results.
+def formatRow(script, rows, times):
+	return "%-4s %10d " % (script, rows) + " ".join("%9.3f" % times.get(stage, float("nan")) for stage in stages)
+
+
+# compareResults(results, baseline, tolerance) function returns a list of descriptions of
+# the stages that are slower than in the baseline results by more than the tolerance.
+def compareResults(results, baseline, tolerance):
+	slower = []
+	for (script, sizes) in results.items():
+		for (rows, result) in sizes.items():
+			old = baseline.get("results", {}).get(script, {}).get(rows)
+			if old is None:
+				continue
+			for (stage, seconds) in result["stages"].items():
+				before = old["stages"].get(stage)
+				if before is not None and seconds > before * tolerance and seconds - before > noise_floor:
+					slower.append("%s %s rows %s: %.3f s, was %.3f s" % (script, rows, stage, seconds, before))
+	return slower
+
+
+# main(argv) function runs the benchmarks and saves and compares the results.
+def main(argv=None):
+	parser = argparse.ArgumentParser(description="Time the stages of python_xy.py and python_xyz.py on synthetic QCF datasets.")
+	parser.add_argument("--sizes", default="10k,100k,1M", help="numbers of rows of the datasets, separated by commas (e.g. 10k,1M,50M)")
+	parser.add_argument("--stations", type=int, default=50, help="number of stations of the datasets")
+	parser.add_argument("--scripts", default="xy,xyz", help="script(s) to time, xy and/or xyz")
+	parser.add_argument("--repeat", type=int, default=3, help="number of runs of each benchmark; the fastest time of each stage is kept")
+	parser.add_argument("--latency", type=float, default=0, help="seconds the server waits before answering each request")
+	parser.add_argument("--output", help="JSON file to save the results in")
+	parser.add_argument("--baseline", help="JSON file of earlier results to compare with")
+	parser.add_argument("--tolerance", type=float, default=1.25, help="ratio to the baseline above which a stage is reported as slower")
+	args = parser.parse_args(argv)
+
+	sizes = [parseSize(i) for i in args.sizes.split(",") if i.strip()]
+	scripts = [i.strip() for i in args.scripts.split(",") if i.strip()]
+	for script in scripts:
+		if script not in ("xy", "xyz"):
+			parser.error("Invalid script entered: " + script + " (use xy or xyz)")
+
+	print("%-4s %10s " % ("", "rows") + " ".join("%9s" % stage for stage in stages) + "   (seconds)")
+	results = {
+		"created": datetime.now().isoformat(timespec="seconds"),
+		"python": platform.python_version(),
+		"numpy": np.__version__,
+		"matplotlib": matplotlib.__version__,
+		"machine": platform.machine(),
+		"stations": args.stations,
+		"plots": plot_count,
+		"latency": args.latency,
+		"results": runBenchmarks(sizes, args.stations, scripts, args.repeat, args.latency),
+	}
+	if args.output:
+		with open(args.output, "w") as f:
+			json.dump(results, f, indent=1)
+		print("\nResults saved in " + args.output)
+
+	if args.baseline:
+		with open(args.baseline) as f:
+			slower = compareResults(results["results"], json.load(f), args.tolerance)
+		if slower:
+			print("\nStages slower than in " + args.baseline + ":")
+			for i in slower:
+				print("  " + i)
+			return 1
+		print("\nNo stage is slower than in " + args.baseline)
+	return 0
+
+
+if __name__ == "__main__":
+	sys.exit(main())
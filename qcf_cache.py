@@ -0,0 +1,347 @@
+# Authorship: NCAR Earth Observing Laboratory Data Management & Services Group
+# Contact: eol-archive@ucar.edu
+#
+# Licensing: The code associated with this document is provided freely and openly.
+# Users are hereby granted a license to access and use this code, unless otherwise
+# stated, subject to the terms and conditions of the GNU Affero General Public
+# License 3.0 (AGPL-3.0; https://www.gnu.org/licenses/agpl-3.0.en.html). This
+# documentation and associated code are provided "as is" and are not supported.
+# By using or downloading this code, the user agrees to the terms and conditions
+# set forth in this code and in the "Using Python to View OPeNDAP Files" document.
+#
+# Acknowledgment: This work was sponsored by the National Science Foundation.
+# This material is based upon work supported by the National Center for Atmospheric
+# Research, a major facility sponsored by the National Science Foundation and managed
+# by the University Corporation for Atmospheric Research. Any opinions, findings
+# and conclusions or recommendations expressed in this material do not necessarily
+# reflect the views of the National Science Foundation.
+#
+# NOTE: This module requires the following packages to be installed:
+#		python3
+#		numpy
+#
+# The qcf_cache.py module keeps the columns downloaded by qcf_fetch.py on disk so
+# that running python_xy.py or python_xyz.py again on the same dataset does not
+# download them again. It is not run on its own.
+#
+# The cache is turned on with the --cache-dir option of the plotting scripts or by
+# setting the QCF_CACHE_DIR environment variable. Each dataset gets a sub-directory
+# named after a hash of its OPeNDAP link, holding one numpy .npy file per variable
+# (opened memory-mapped, so only the rows that are used are read from disk) and a
+# meta.json file recording the link, the validator of the dataset and when each
+# variable was last used.
+#
+# The validator is the Last-Modified date and a digest of the DDS returned by the
+# server. When it changes, the dataset has been updated on the server and all of its
+# cached variables are dropped. When the cache grows past its size limit, the
+# variables that were used least recently are deleted first, except those of the dataset
+# just stored. The meta.json files are only changed under a lock on the cache.lock file
+# of the cache, so runs sharing the cache (and the worker processes of --jobs) never lose
+# each other's changes.
+#
+# Datasets that only grow at the end (e.g. real-time datasets during a field campaign)
+# can instead be brought up to date with the --incremental option of python_xy.py (see
+# qcf_fetch.refreshColumns): meta.json then also records the last nominal date and time
+# in the cached rows, and only the rows from then on are downloaded and added to the
+# cached variables.
+#
+# Downloads split into row ranges (the --range-rows option, see qcf_fetch.downloadRanges)
+# save each range as it arrives in a parts-{hash of the variables} sub-directory of the
+# dataset, as one numpy .npz file per range, so a download that was stopped part way
+# resumes after the last complete range. The parts are deleted once the download is
+# complete and its variables are cached, or when the dataset changes on the server. They
+# count towards the size limit like the variables, and the parts of the downloads saved
+# the longest ago are evicted along with the least recently used variables.
+
+# The module uses the following hard-coded entities that may need to be changed:
+#	cache_limit: The default size limit of the cache in bytes
+#	cache_env: The environment variable that turns the cache on
+# To change any of these values, simply search "HARD-CODED" in this module
+#
+
+# Import necessary packages:
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+import numpy as np
+try:
+	import fcntl
+except ImportError:
+	fcntl = None
+
+
+#HARD-CODED
+cache_limit = 2 * 1024**3
+cache_env = "QCF_CACHE_DIR"
+
+# The hard-coded size limit, which setCache goes back to when no limit is given
+default_limit = cache_limit
+
+# Directory of the cache; None when caching is turned off
+cache_dir = None
+
+# Locks held while the meta.json files are read and written: cache_lock, as several
+# datasets may be fetched at once by different threads, and a lock on the cache.lock file
+# of the cache (where fcntl is available), as the cache is shared with the worker
+# processes of --jobs and with other runs. The file lock is taken once by the outermost
+# lockCache() of the thread holding cache_lock.
+cache_lock = threading.RLock()
+lock_file = None
+lock_depth = 0
+
+
+# Functions:
+
+# cacheDir(directory) function returns the directory of the cache asked for: the given
+# one, or the one in the QCF_CACHE_DIR environment variable if none is given (None if it
+# is not set either).
+def cacheDir(directory=None):
+	return directory or os.environ.get(cache_env)
+
+
+# setCache(directory, limit) function turns the cache on in the given directory with the
+# given size limit in bytes (the hard-coded cache_limit if none is given), or turns it
+# off if no directory is given.
+def setCache(directory=None, limit=None):
+	global cache_dir, cache_limit
+	cache_dir = None
+	if directory:
+		cache_dir = os.path.abspath(os.path.expanduser(directory))
+		os.makedirs(cache_dir, exist_ok=True)
+	cache_limit = int(limit) if limit else default_limit
+
+
+# lockCache() function holds the locks of the cache for the duration of a with block, so
+# the meta.json files are never changed by two threads or processes at once.
+@contextmanager
+def lockCache():
+	global lock_file, lock_depth
+	with cache_lock:
+		if lock_depth == 0 and fcntl is not None:
+			lock_file = open(os.path.join(cache_dir, "cache.lock"), "a")
+			fcntl.flock(lock_file, fcntl.LOCK_EX)
+		lock_depth += 1
+		try:
+			yield
+		finally:
+			lock_depth -= 1
+			if lock_depth == 0 and lock_file is not None:
+				fcntl.flock(lock_file, fcntl.LOCK_UN)
+				lock_file.close()
+				lock_file = None
+
+
+# datasetDir(url) function returns the sub-directory holding the cached variables of the
+# dataset at the OPeNDAP link.
+def datasetDir(url):
+	return os.path.join(cache_dir, hashlib.sha1(url.encode("utf-8")).hexdigest()[:16])
+
+
+# readMeta(directory) function returns the contents of the meta.json file of a dataset
+# sub-directory, or an empty record if there is none yet.
+def readMeta(directory):
+	try:
+		with open(os.path.join(directory, "meta.json")) as f:
+			return json.load(f)
+	except (OSError, ValueError):
+		return {"url": None, "validator": None, "columns": {}}
+
+
+# writeMeta(directory, meta) function replaces the meta.json file of a dataset
+# sub-directory. The file is written under a temporary name first so that runs sharing
+# the cache never see half of it.
+def writeMeta(directory, meta):
+	tmp = os.path.join(directory, "meta.json.%d" % os.getpid())
+	with open(tmp, "w") as f:
+		json.dump(meta, f, indent=1)
+	os.replace(tmp, os.path.join(directory, "meta.json"))
+
+
+# checkDataset(url, validator) function compares the validator of the dataset on the
+# server with the one recorded in the cache, and drops every cached variable of the
+# dataset if they differ.
+def checkDataset(url, validator):
+	with lockCache():
+		directory = datasetDir(url)
+		meta = readMeta(directory)
+		if meta["validator"] == validator:
+			return
+		for name in meta["columns"]:
+			removeFile(os.path.join(directory, name + ".npy"))
+		removeParts(url)
+		os.makedirs(directory, exist_ok=True)
+		writeMeta(directory, {"url": url, "validator": validator, "columns": {}})
+
+
+# datasetMeta(url) function returns the contents of the meta.json file of the dataset.
+def datasetMeta(url):
+	with lockCache():
+		return readMeta(datasetDir(url))
+
+
+# setLast(url, last) function records the last nominal date and time (a key of
+# qcf_index.dateTimeKeys, as a string) in the cached rows of the dataset.
+def setLast(url, last):
+	with lockCache():
+		directory = datasetDir(url)
+		meta = readMeta(directory)
+		meta["last"] = last
+		writeMeta(directory, meta)
+
+
+# cachedFields(url) function returns the names of the variables of the dataset that are
+# in the cache.
+def cachedFields(url):
+	directory = datasetDir(url)
+	return [name for name in readMeta(directory)["columns"] if os.path.exists(os.path.join(directory, name + ".npy"))]
+
+
+# loadColumns(url, fields) function opens the cached variables of the dataset as
+# memory-mapped numpy arrays and marks them as just used.
+def loadColumns(url, fields):
+	with lockCache():
+		directory = datasetDir(url)
+		columns = dict((name, np.load(os.path.join(directory, name + ".npy"), mmap_mode="r")) for name in fields)
+		meta = readMeta(directory)
+		for name in fields:
+			if name in meta["columns"]:
+				meta["columns"][name]["used"] = time.time()
+		writeMeta(directory, meta)
+		return columns
+
+
+# storeColumns(url, columns) function saves downloaded variables of the dataset to the
+# cache and then evicts the least recently used variables if the cache is too big.
+# The columns must hold every row of the dataset, in the order of the server.
+def storeColumns(url, columns):
+	with lockCache():
+		directory = datasetDir(url)
+		os.makedirs(directory, exist_ok=True)
+		meta = readMeta(directory)
+		for (name, column) in columns.items():
+			path = os.path.join(directory, name + ".npy")
+			tmp = path + ".%d.npy" % os.getpid()
+			np.save(tmp, np.ascontiguousarray(column))
+			os.replace(tmp, path)
+			meta["columns"][name] = {"bytes": os.path.getsize(path), "used": time.time()}
+		writeMeta(directory, meta)
+		evict(directory)
+
+
+# appendColumns(url, columns, keep, validator, last) function adds new rows to the cached
+# variables of the dataset: each cached variable keeps the rows for which keep is True
+# and gets the rows of the same variable in columns added at the end. Cached variables
+# without new rows (e.g. the saved groupings of qcf_index.py and statistics of
+# qcf_rollup.py) are dropped, as they would no longer match the others, and are worked
+# out again when they are next needed. The validator and the last date and time of the dataset
+# are recorded with them.
+def appendColumns(url, columns, keep, validator, last):
+	with lockCache():
+		directory = datasetDir(url)
+		meta = readMeta(directory)
+		for name in list(meta["columns"]):
+			path = os.path.join(directory, name + ".npy")
+			if name not in columns:
+				meta["columns"].pop(name)
+				removeFile(path)
+				continue
+			column = np.concatenate((np.load(path, mmap_mode="r")[keep], columns[name]))
+			tmp = path + ".%d.npy" % os.getpid()
+			np.save(tmp, column)
+			os.replace(tmp, path)
+			meta["columns"][name] = {"bytes": os.path.getsize(path), "used": time.time()}
+		meta["validator"] = validator
+		meta["last"] = last
+		writeMeta(directory, meta)
+		evict(directory)
+
+
+# partsDir(url, fields) function returns the sub-directory holding the ranges downloaded so
+# far of the given variables of the dataset at the OPeNDAP link.
+def partsDir(url, fields):
+	return os.path.join(datasetDir(url), "parts-" + hashlib.sha1(",".join(fields).encode("utf-8")).hexdigest()[:16])
+
+
+# storePart(url, fields, n, columns) function saves the columns of the n-th range (from 0)
+# of a download of the given variables of the dataset.
+def storePart(url, fields, n, columns):
+	with lockCache():
+		directory = partsDir(url, fields)
+		os.makedirs(directory, exist_ok=True)
+		path = os.path.join(directory, "%06d.npz" % n)
+		tmp = path + ".%d.npz" % os.getpid()
+		np.savez(tmp, **columns)
+		os.replace(tmp, path)
+		evict(datasetDir(url))
+
+
+# loadParts(url, fields) function returns the columns of the ranges saved by storePart for
+# a download of the given variables of the dataset, in order, up to the first one missing.
+def loadParts(url, fields):
+	with lockCache():
+		directory = partsDir(url, fields)
+		parts = []
+		while os.path.exists(os.path.join(directory, "%06d.npz" % len(parts))):
+			with np.load(os.path.join(directory, "%06d.npz" % len(parts))) as saved:
+				parts.append(dict((name, saved[name]) for name in fields))
+		return parts
+
+
+# removeParts(url, fields) function deletes the saved ranges of a download of the given
+# variables of the dataset, or of every download of the dataset if no variables are
+# given.
+def removeParts(url, fields=None):
+	with lockCache():
+		if fields is not None:
+			shutil.rmtree(partsDir(url, fields), ignore_errors=True)
+			return
+		directory = datasetDir(url)
+		if os.path.isdir(directory):
+			for sub in os.listdir(directory):
+				if sub.startswith("parts-"):
+					shutil.rmtree(os.path.join(directory, sub), ignore_errors=True)
+
+
+# evict(keep) function deletes the least recently used variables of all cached datasets,
+# and the saved ranges of their unfinished downloads, until the total size of the cache
+# is under the limit. The saved ranges of a download count as used when the last one was
+# saved. The variables and ranges in the keep sub-directory (the dataset just stored,
+# which is about to be read) are never deleted, even if they are more than the limit on
+# their own.
+def evict(keep=None):
+	with lockCache():
+		entries = []
+		for sub in os.listdir(cache_dir):
+			directory = os.path.join(cache_dir, sub)
+			if not os.path.isdir(directory):
+				continue
+			for (name, info) in readMeta(directory)["columns"].items():
+				entries.append((info["used"], info["bytes"], directory, name))
+			for name in os.listdir(directory):
+				if name.startswith("parts-"):
+					files = [os.stat(os.path.join(directory, name, i)) for i in os.listdir(os.path.join(directory, name))]
+					entries.append((max([i.st_mtime for i in files] or [0]), sum(i.st_size for i in files), directory, name))
+		total = sum(i[1] for i in entries)
+		for (used, size, directory, name) in sorted(i for i in entries if i[2] != keep):
+			if total <= cache_limit:
+				break
+			if name.startswith("parts-"):
+				shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+			else:
+				meta = readMeta(directory)
+				meta["columns"].pop(name, None)
+				writeMeta(directory, meta)
+				removeFile(os.path.join(directory, name + ".npy"))
+			total -= size
+
+
+# removeFile(path) function deletes a file if it exists.
+def removeFile(path):
+	try:
+		os.remove(path)
+	except FileNotFoundError:
+		pass
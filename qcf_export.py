@@ -0,0 +1,243 @@
+# Authorship: NCAR Earth Observing Laboratory Data Management & Services Group
+# Contact: eol-archive@ucar.edu
+#
+# Licensing: The code associated with this document is provided freely and openly.
+# Users are hereby granted a license to access and use this code, unless otherwise
+# stated, subject to the terms and conditions of the GNU Affero General Public
+# License 3.0 (AGPL-3.0; https://www.gnu.org/licenses/agpl-3.0.en.html). This
+# documentation and associated code are provided "as is" and are not supported.
+# By using or downloading this code, the user agrees to the terms and conditions
+# set forth in this code and in the "Using Python to View OPeNDAP Files" document.
+#
+# Acknowledgment: This work was sponsored by the National Science Foundation.
+# This material is based upon work supported by the National Center for Atmospheric
+# Research, a major facility sponsored by the National Science Foundation and managed
+# by the University Corporation for Atmospheric Research. Any opinions, findings
+# and conclusions or recommendations expressed in this material do not necessarily
+# reflect the views of the National Science Foundation.
+#
+# NOTE: This module requires the following packages to be installed:
+#		python3
+#		numpy
+# and, depending on the format of the file:
+#		pyarrow (Parquet and Feather files)
+#		netCDF4 or scipy (NetCDF files; scipy writes the whole file at the end)
+#
+# The qcf_export.py module saves the rows plotted by python_xy.py and python_xyz.py to a
+# file (their --export option), so they can be analysed with other tools without
+# downloading them again. It is not run on its own.
+#
+# The rows are written one group at a time (the rows of one station for python_xy.py,
+# of one datetime for python_xyz.py) as they are plotted, so only one group is held for
+# the export at a time. Every group has the same columns:
+#	time: the date and time of the row, as numpy datetime64 (Parquet and Feather) or as
+#		seconds since 1970-01-01 UTC (NetCDF), from the date and time variables of the
+#		plot (e.g. date_nominal and time_nominal). Times that can't be read are null in
+#		Parquet and Feather files and the _FillValue in NetCDF files
+#	network_name, platform_name: the station of the row, as text
+#	the other variables of the plot (e.g. latitude, longitude and temp_air, or the
+#		statistics of --rollup), as numbers with the missing values masked: null
+#		in Parquet and Feather files, and the _FillValue in NetCDF files
+#
+# The format is chosen by the extension of the file name:
+#	.parquet: a Parquet file with one row group per group
+#	.feather, .arrow: an uncompressed Feather (Arrow IPC) file with one record batch per
+#		group, which can be opened memory-mapped (pyarrow.memory_map)
+#	.nc: a NetCDF file with the rows along the unlimited "obs" dimension, which can be
+#		opened memory-mapped (e.g. with xarray or scipy.io.netcdf_file)
+#
+# The module uses the following hard-coded entities that may need to be changed:
+#	export_formats: The file extensions that can be exported to, and their format
+#	name_length: The length of the text variables of NetCDF files (longer text is cut)
+#	missing_value: The fill value of the NetCDF files, as in the QCF datasets. It is set
+#		in qcf_fetch.py
+# To change any of these values, simply search "HARD-CODED" in this module
+#
+
+# Import necessary packages:
+import numpy as np
+from qcf_fetch import isText, missing_value, toDateTime64, toStr
+from qcf_index import rowsOf
+from qcf_profile import count, stage
+
+
+#HARD-CODED
+export_formats = {".parquet": "parquet", ".feather": "feather", ".arrow": "feather", ".nc": "netcdf"}
+name_length = 32
+
+# The file the rows are exported to, None when they aren't: its name, format, the date
+# and time variables of the rows, and the writer once the first group has been written
+export_file = None
+
+
+# Functions:
+
+# exportFormat(fileName) function returns the format of the file to export to, from the
+# extension of its name, raising a ValueError if it can't be exported to.
+def exportFormat(fileName):
+	for (extension, format) in export_formats.items():
+		if fileName.lower().endswith(extension):
+			return format
+	raise ValueError("Invalid export file: " + fileName + " (use " + ", ".join(export_formats) + ")")
+
+
+# checkExport(fileName) function raises a ValueError if the file can't be exported to,
+# because of its extension or because the package its format needs isn't installed, so
+# the scripts can stop before downloading anything.
+def checkExport(fileName):
+	format = exportFormat(fileName)
+	try:
+		if format == "netcdf":
+			try:
+				import netCDF4
+			except ImportError:
+				import scipy.io
+		else:
+			import pyarrow
+	except ImportError:
+		raise ValueError("Exporting to " + fileName + " needs the " + ("netCDF4 or the scipy" if format == "netcdf" else "pyarrow") + " package")
+
+
+# setExport(fileName, dateVar, timeVar) function starts exporting the rows to the file,
+# with the date and time of each row read from the given variables.
+def setExport(fileName, dateVar="date", timeVar="time"): # HARD-CODED
+	global export_file
+	closeExport()
+	export_file = {"name": fileName, "format": exportFormat(fileName), "dateVar": dateVar, "timeVar": timeVar, "writer": None, "rows": 0}
+
+
+# closeExport() function finishes the file the rows were exported to, if any, and
+# returns the number of rows written.
+def closeExport():
+	global export_file
+	if export_file is None:
+		return 0
+	(done, export_file) = (export_file, None)
+	if done["writer"] is not None:
+		done["writer"].close()
+	return done["rows"]
+
+
+# exportTable(columns) function returns the columns of a group as they are exported: the
+# time first, then the station and the other variables, without the date and time text.
+def exportTable(columns):
+	(dateVar, timeVar) = (export_file["dateVar"], export_file["timeVar"])
+	table = {"time": toDateTime64(columns[dateVar], columns[timeVar])}
+	for name in ["network_name", "platform_name"] + list(columns): # HARD-CODED
+		if name in columns and name not in table and name not in (dateVar, timeVar, "date", "time", "datetime"):
+			table[name] = np.asarray(columns[name])
+	return table
+
+
+# exportColumns(columns) function adds the rows of a group to the export file, if the rows
+# are being exported, opening the file with the columns of the first group.
+def exportColumns(columns):
+	if export_file is None:
+		return
+	table = exportTable(columns)
+	rows = len(table["time"])
+	if rows == 0:
+		return
+	with stage("export"):
+		count(rows=rows)
+		if export_file["format"] == "netcdf":
+			writeNetcdf(table)
+		else:
+			writeArrow(table)
+		export_file["rows"] += rows
+
+
+# exportGroups(columns, index, keys) function adds the rows of each key of the index (see
+# qcf_index.groupRows) to the export file, one key at a time.
+def exportGroups(columns, index, keys):
+	if export_file is None:
+		return
+	for key in keys:
+		exportColumns(dict((name, column[rowsOf(index, key)]) for (name, column) in columns.items()))
+
+
+# writeArrow(table) function writes the rows of a group to a Parquet or Feather file.
+def writeArrow(table):
+	try:
+		import pyarrow as pa
+		import pyarrow.ipc
+		import pyarrow.parquet
+	except ImportError:
+		raise RuntimeError("Exporting to Parquet and Feather files needs the pyarrow package (or export to a .nc file)")
+	arrays = {}
+	for (name, column) in table.items():
+		if isText(column.dtype):
+			arrays[name] = pa.array(toStr(column), type=pa.string())
+		elif column.dtype.kind == "f":
+			arrays[name] = pa.array(column, mask=np.isnan(column))
+		else:
+			arrays[name] = pa.array(column)
+	batch = pa.table(arrays)
+	if export_file["writer"] is None:
+		if export_file["format"] == "parquet":
+			export_file["writer"] = pyarrow.parquet.ParquetWriter(export_file["name"], batch.schema)
+		else:
+			export_file["writer"] = pyarrow.ipc.new_file(export_file["name"], batch.schema)
+	export_file["writer"].write_table(batch)
+
+
+# openNetcdf(fileName) function creates a NetCDF file with netCDF4 if it is installed, and
+# with scipy otherwise, and returns it.
+def openNetcdf(fileName):
+	try:
+		from netCDF4 import Dataset
+		return Dataset(fileName, "w")
+	except ImportError:
+		try:
+			from scipy.io import netcdf_file
+		except ImportError:
+			raise RuntimeError("Saving NetCDF files needs the netCDF4 or the scipy package")
+		return netcdf_file(fileName, "w")
+
+
+# createVariable(nc, name, type, dimensions, fill) function adds a variable to a NetCDF
+# file opened by openNetcdf, with the fill value of its missing values if one is given.
+# netCDF4 only takes the fill value when the variable is created, and scipy only as an
+# attribute afterwards.
+def createVariable(nc, name, type, dimensions, fill=None):
+	if fill is None:
+		return nc.createVariable(name, type, dimensions)
+	try:
+		variable = nc.createVariable(name, type, dimensions, fill_value=fill)
+	except TypeError:
+		variable = nc.createVariable(name, type, dimensions)
+		variable._FillValue = fill
+	variable.missing_value = fill
+	return variable
+
+
+# writeNetcdf(table) function writes the rows of a group to a NetCDF file, creating its
+# dimensions and variables with the first group.
+def writeNetcdf(table):
+	if export_file["writer"] is None:
+		nc = openNetcdf(export_file["name"])
+		nc.createDimension("obs", None)
+		nc.createDimension("name_length", name_length)
+		for (name, column) in table.items():
+			if name == "time":
+				variable = createVariable(nc, name, "d", ("obs",), missing_value)
+				variable.units = "seconds since 1970-01-01 00:00:00 UTC"
+			elif isText(column.dtype):
+				nc.createVariable(name, "c", ("obs", "name_length"))
+			elif column.dtype.kind == "f":
+				createVariable(nc, name, "d", ("obs",), missing_value)
+			else:
+				nc.createVariable(name, "i", ("obs",))
+		export_file["writer"] = nc
+	nc = export_file["writer"]
+	(first, last) = (export_file["rows"], export_file["rows"] + len(table["time"]))
+	for (name, column) in table.items():
+		if name == "time":
+			column = np.where(np.isnat(column), missing_value, column.astype("datetime64[s]").astype(np.int64).astype(np.float64))
+		elif isText(column.dtype):
+			column = np.asarray(column, dtype="S" + str(name_length)).view("S1").reshape(len(column), name_length)
+		elif column.dtype.kind == "f":
+			column = np.where(np.isnan(column), missing_value, column)
+		else:
+			column = column.astype(np.int32)
+		nc.variables[name][first:last] = column
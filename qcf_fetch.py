@@ -0,0 +1,989 @@
+# Authorship: NCAR Earth Observing Laboratory Data Management & Services Group
+# Contact: eol-archive@ucar.edu
+#
+# Licensing: The code associated with this document is provided freely and openly.
+# Users are hereby granted a license to access and use this code, unless otherwise
+# stated, subject to the terms and conditions of the GNU Affero General Public
+# License 3.0 (AGPL-3.0; https://www.gnu.org/licenses/agpl-3.0.en.html). This
+# documentation and associated code are provided "as is" and are not supported.
+# By using or downloading this code, the user agrees to the terms and conditions
+# set forth in this code and in the "Using Python to View OPeNDAP Files" document.
+#
+# Acknowledgment: This work was sponsored by the National Science Foundation.
+# This material is based upon work supported by the National Center for Atmospheric
+# Research, a major facility sponsored by the National Science Foundation and managed
+# by the University Corporation for Atmospheric Research. Any opinions, findings
+# and conclusions or recommendations expressed in this material do not necessarily
+# reflect the views of the National Science Foundation.
+#
+# NOTE: This module requires the following packages to be installed:
+#		python3
+#		requests
+#		numpy
+#
+# The qcf_fetch.py module holds the data retrieval code shared by python_xy.py and
+# python_xyz.py. It is not run on its own; keep it in the same directory as the
+# plotting scripts so they can import it.
+#
+# The module pulls the variables of an NCAR/EOL QCF sequence out of an OPeNDAP
+# dataset as typed numpy arrays: measurement variables come back as float64 arrays
+# with the missing value replaced by NaN, and text variables (dates, times, network
+# and platform names) come back as fixed-width byte string arrays.
+#
+# All of the variables needed for a plot are requested together: fetchColumns()
+# builds a single OPeNDAP constraint expression that projects the wanted QCF fields
+# and carries any row filters (e.g. the chosen stations or datetimes), so only one
+# download of the filtered sequence is made. The binary DAP2 response is decoded
+# directly into the column arrays.
+#
+# Selections such as the stations given with --station or the time window given with
+# --start/--end are sent to the server as DAP2 selection clauses, so that only the
+# matching rows cross the wire. DAP2 only allows clauses to be AND-ed together, so
+# the clauses may let through a few extra rows (e.g. other pairings of the chosen
+# networks and platforms, or the rest of the first and last day of a time window);
+# the plotting scripts drop those with the matching functions below after the download.
+#
+# Several datasets (e.g. one per network of a project) can be fetched at once with
+# fetchEach(), which runs the downloads in a pool of threads sharing one HTTP session.
+#
+# For datasets too large to hold in memory, streamColumns() reads the response in chunks
+# of a fixed size and decodes the complete rows of each chunk as it arrives, so only one
+# chunk of the raw data is held at a time. The plotting scripts use it in streaming mode
+# (their --stream option), keeping only the rows of the plots they make.
+#
+# When the on-disk cache of qcf_cache.py is turned on, fetchColumns() downloads only
+# the variables that are not cached yet, for every row of the dataset, and applies the
+# selection clauses itself to the cached columns. Later runs asking for other stations
+# or time windows of the same variables then need no download at all.
+#
+# Requests that fail because the connection dropped or timed out, because the response
+# was cut off before the end of the sequence, or because the server answered with a 5xx
+# or 429 status, are tried again up to retries times (the --retries option). The first
+# retry waits retry_delay seconds and each of the next ones twice as long as the one
+# before, up to retry_max_delay, with some random jitter so several runs don't retry in
+# step. A binary response is only decoded once it ended with the end-of-sequence marker.
+# In streaming mode only the request itself is tried again; a response that is cut off
+# part way stops the run, as the rows before the cut may already have been plotted.
+#
+# Downloads of every row of a dataset (those without selection clauses, e.g. the
+# downloads of whole variables into the cache) can also be split into requests of
+# range_rows rows each (the --range-rows option), with the DAP2 row number constraint
+# of the sequence (QCF[first:1:last], with rows numbered from 0 and the last one
+# included) after the projected fields, e.g. QCF.date,QCF.time,QCF[0:1:99999], so a
+# failure only costs the rows of one request. This is the slice syntax of the pydap
+# client, and the pydap server answers it with only the rows of the range and the
+# projected fields. As a server could still number its rows differently, every range
+# but the first starts one row early, and that row must match the last row of the
+# range before it, and only the last range may come back with fewer rows than asked
+# for, so ranges that would leave a gap or overlap stop the download instead of being
+# joined. The download ends with the first range without new rows. With the cache
+# turned on, each range is saved in the cache as soon as it arrives (see
+# qcf_cache.storePart), and the next run resumes a download that was stopped part way
+# after the last complete range.
+
+# The module uses the following hard-coded entities that may need to be changed:
+#	missing_value: This is the number used for missing data points
+#		e.g. missing_value = -999.99
+#	missing_tolerance: QCF measurements are stored as 32-bit floats, so the missing
+#		value is matched within this tolerance rather than exactly.
+#	sequence_name: The name of the sequence holding the data in NCAR/EOL QCF datasets
+#	connect_timeout: The number of seconds to wait for a connection to the OPeNDAP server
+#	request_timeout: The default number of seconds to wait on the OPeNDAP server for each
+#		part of a response
+#	retries: The default number of times a failed request is tried again
+#	retry_delay: The number of seconds to wait before the first retry of a request
+#	retry_max_delay: The longest wait before a retry, in seconds
+#	range_rows: The default number of rows of each request of a download split into row
+#		ranges (0 to download all of the rows in one request)
+#	chunk_size: The default number of bytes read at a time in streaming mode
+#	host_limit: The number of datasets downloaded from the same server at once
+#	fetch_threads: The number of datasets downloaded at once in total
+#	refresh_vars: The nominal date and time variables that the rows of a dataset are
+#		ordered by, which cached datasets are brought up to date by in incremental
+#		mode (see refreshColumns)
+# To change any of these values, simply search "HARD-CODED" in this module
+#
+
+# Import necessary packages:
+import hashlib
+import operator
+import random
+import re
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from urllib.parse import urlsplit, urlunsplit
+import numpy as np
+import requests
+import qcf_cache
+from qcf_profile import count, stage
+
+
+#HARD-CODED
+missing_value = -999.99
+missing_tolerance = 0.005
+sequence_name = "QCF"
+connect_timeout = 30
+request_timeout = 600
+retries = 5
+retry_delay = 1
+retry_max_delay = 60
+range_rows = 0
+chunk_size = 64 * 1024**2
+host_limit = 4
+fetch_threads = 16
+refresh_vars = ("date_nominal", "time_nominal")
+
+# The hard-coded values of the settings of setStreaming and setRetries, which they go back
+# to when no value is given, so every run of python_batch.py starts from them
+defaults = {"chunk_size": chunk_size, "request_timeout": request_timeout, "retries": retries, "range_rows": range_rows}
+
+# Rows of a streamed chunk checked at a time for a run of rows of the same length, and
+# rows decoded one at a time when the runs are shorter (see decodeChunk)
+run_window = 64
+row_window = 4096
+
+# DAP2 markers written before every row of a sequence and after its last row
+start_of_instance = b"\x5a\x00\x00\x00"
+end_of_sequence = b"\xa5\x00\x00\x00"
+
+# Numpy dtypes of the DAP2 base types as they are encoded on the wire. Every value is
+# padded to a multiple of 4 bytes, so Byte and Int16 arrive as 32-bit integers.
+# Strings are stored as a 4 byte length followed by the padded characters.
+dap_types = {
+	"Byte": ">u4",
+	"Int16": ">i4",
+	"UInt16": ">u4",
+	"Int32": ">i4",
+	"UInt32": ">u4",
+	"Float32": ">f4",
+	"Float64": ">f8",
+	"String": None,
+	"Url": None,
+}
+
+# Positions of the digits in YYYY/mm/dd dates and HH:MM:SS times
+date_digits = [0, 1, 2, 3, 5, 6, 8, 9]
+time_digits = [0, 1, 3, 4, 6, 7]
+
+# Suffixes that may be on the end of an OPeNDAP link copied from the archive
+dap_suffixes = (".html", ".dds", ".das", ".dods", ".ascii", ".info")
+
+# True when the plotting scripts were asked to stream the data (see streamColumns)
+streaming = False
+
+# A single HTTP session is shared by all requests so the connection is reused
+session = None
+
+# Semaphores limiting the downloads from each server, keyed by host name
+host_slots = {}
+host_lock = threading.Lock()
+
+# (cache directory, link) pairs of the datasets whose cache entries were checked against
+# the server in this run
+validated = set()
+
+# True when cached datasets are brought up to date with their new rows instead of being
+# dropped when they change (see refreshColumns), and the rows added to each dataset in
+# this run (None for a dataset whose rows were all downloaded)
+incremental = False
+added_rows = {}
+
+# Prefixes of the cached entries worked out from the downloaded variables rather than
+# downloaded (the groupings of qcf_index.py and the statistics of qcf_rollup.py)
+derived_prefixes = ("index-", "rollup-")
+
+# Comparisons allowed in selection clauses, applied to cached numpy columns
+selection_ops = {
+	"=": operator.eq,
+	"!=": operator.ne,
+	"<": operator.lt,
+	"<=": operator.le,
+	">": operator.gt,
+	">=": operator.ge,
+}
+
+
+# Functions:
+
+# isText(dtype) function returns True if the numpy dtype describes a string variable
+# (e.g. date, time, network_name, platform_name) rather than a measurement.
+def isText(dtype):
+	return np.dtype(dtype).kind in "SU"
+
+
+# maskMissing(arr) function converts a column of measurements to float64 and replaces
+# every occurrence of the missing value with NaN, so later steps can use np.isnan()
+# instead of comparing strings.
+def maskMissing(arr, missing=missing_value):
+	arr = np.array(arr, dtype=np.float64)
+	arr[np.abs(arr - missing) < missing_tolerance] = np.nan
+	return arr
+
+
+# toStr(arr) function converts a fixed-width byte string column to a numpy unicode
+# array for printing, comparing against user input and building labels.
+def toStr(arr):
+	return np.char.decode(arr, "ascii")
+
+
+# getSession() function returns the HTTP session used for all OPeNDAP requests.
+def getSession():
+	global session
+	with host_lock:
+		if session is None:
+			session = requests.Session()
+			adapter = requests.adapters.HTTPAdapter(pool_maxsize=max(host_limit, 10))
+			session.mount("http://", adapter)
+			session.mount("https://", adapter)
+	return session
+
+
+# hostSlot(url) function returns the semaphore limiting the downloads from the server of
+# the OPeNDAP link to host_limit at a time.
+def hostSlot(url):
+	host = urlsplit(url).netloc
+	with host_lock:
+		if host not in host_slots:
+			host_slots[host] = threading.BoundedSemaphore(host_limit)
+		return host_slots[host]
+
+
+# fetchEach(urls, func) function calls func(url) for each OPeNDAP link and returns the
+# results in the same order. The calls are made at once in a pool of threads sharing the
+# HTTP session, at most host_limit of them for the same server, so fetching several
+# datasets takes about as long as the slowest one.
+def fetchEach(urls, func):
+	if len(urls) == 1:
+		return [func(urls[0])]
+	def limited(url):
+		with hostSlot(url):
+			return func(url)
+	with ThreadPoolExecutor(min(len(urls), fetch_threads)) as pool:
+		return list(pool.map(limited, urls))
+
+
+# quote(value) function formats a string value for use in a constraint expression.
+def quote(value):
+	return '"' + str(value).replace('"', '\\"') + '"'
+
+
+# selectAny(field, values) function returns a selection clause keeping the rows of the
+# sequence where the field is equal to any one of the given values.
+def selectAny(field, values):
+	values = sorted(set(values))
+	if len(values) == 1:
+		return sequence_name + "." + field + "=" + quote(values[0])
+	return sequence_name + "." + field + "={" + ",".join(quote(i) for i in values) + "}"
+
+
+# selectStations(stations) function takes station names in the network_name-platform_name
+# convention and returns the selection clauses that keep only the rows of those stations.
+# DAP2 selections cannot be OR-ed together, so the clauses keep every pairing of the
+# chosen networks and platforms; compare stationNames() of the result with the chosen
+# stations to drop the extra pairings afterwards.
+def selectStations(stations):
+	networks = [i.split("-", 1)[0] for i in stations]
+	platforms = [i.split("-", 1)[1] for i in stations]
+	return [selectAny("network_name", networks), selectAny("platform_name", platforms)] # HARD-CODED
+
+
+# stationNames(columns) function joins the network_name and platform_name columns into
+# an array of station names in the network_name-platform_name convention.
+def stationNames(columns):
+	return toStr(np.char.add(np.char.add(columns["network_name"], b"-"), columns["platform_name"])) # HARD-CODED
+
+
+# selectDateTimes(dateVar, timeVar, datetimes) function returns the selection clauses
+# that keep only the rows at the given python datetimes. As with selectStations(), the
+# clauses may let through extra combinations of the dates and times.
+def selectDateTimes(dateVar, timeVar, datetimes):
+	return [selectAny(dateVar, [i.strftime("%Y/%m/%d") for i in datetimes]),
+		selectAny(timeVar, [i.strftime("%H:%M:%S") for i in datetimes])]
+
+
+# selectTimeWindow(dateVar, start, end) function returns the selection clauses
+# that keep only the rows between the python datetimes start and end (either may be
+# None). Dates are compared as YYYY/mm/dd strings, so the clauses keep whole days;
+# use inTimeWindow() on the result to trim the first and last day.
+def selectTimeWindow(dateVar, start=None, end=None):
+	selections = []
+	if start is not None:
+		selections.append(sequence_name + "." + dateVar + ">=" + quote(start.strftime("%Y/%m/%d")))
+	if end is not None:
+		selections.append(sequence_name + "." + dateVar + "<=" + quote(end.strftime("%Y/%m/%d")))
+	return selections
+
+
+# inTimeWindow(dates, times, start, end) function returns a boolean array that is True
+# for the rows whose date and time fall between the python datetimes start and end.
+def inTimeWindow(dates, times, start=None, end=None):
+	dateTimes = np.char.add(dates, times)
+	keep = np.ones(len(dateTimes), dtype=bool)
+	if start is not None:
+		keep &= dateTimes >= start.strftime("%Y/%m/%d%H:%M:%S").encode("ascii")
+	if end is not None:
+		keep &= dateTimes <= end.strftime("%Y/%m/%d%H:%M:%S").encode("ascii")
+	return keep
+
+
+# joinColumns(parts) function joins a list of dictionaries of columns with the same
+# fields, one after the other, into one dictionary of columns.
+def joinColumns(parts):
+	return dict((name, np.concatenate([part[name] for part in parts])) for name in parts[0])
+
+
+# subsetColumns(columns, rows) function returns the columns keeping only the given rows
+# (a boolean array or an array of indices).
+def subsetColumns(columns, rows):
+	return dict((name, column[rows]) for (name, column) in columns.items())
+
+
+# parseDateTime(text, end) function converts a date/time given on the command line as
+# YYYY/mm/dd-HH:MM (or just YYYY/mm/dd) into a python datetime. A date alone is taken as
+# the start of that day, or as its last second when end is True.
+def parseDateTime(text, end=False):
+	text = text.strip()
+	try:
+		return datetime.strptime(text, "%Y/%m/%d-%H:%M")
+	except ValueError:
+		day = datetime.strptime(text, "%Y/%m/%d")
+		if end:
+			return day + timedelta(days=1, seconds=-1)
+		return day
+
+
+# toDateTime64(dates, times, timeOffset) function converts arrays of YYYY/mm/dd dates and
+# HH:MM:SS times (e.g. the date/time or date_nominal/time_nominal variables) into one
+# numpy datetime64[s] array, without parsing each row on its own. The digits are read
+# at their fixed positions in the bytes of the strings; the times are read from
+# timeOffset on, so that combined YYYY/mm/ddHH:MM:SS strings can be passed as both
+# arguments with a timeOffset of 10. Rows that are not in this format become NaT.
+def toDateTime64(dates, times, timeOffset=0):
+	with stage("parse"):
+		count(rows=len(dates))
+# Empty downloads come back as 1-byte strings, too short to hold the digits
+		if len(dates) == 0:
+			return np.array([], dtype="datetime64[s]")
+		dates = np.ascontiguousarray(dates)
+		times = np.ascontiguousarray(times)
+		dateChars = dates.view(np.uint8).reshape(len(dates), dates.dtype.itemsize)
+		timeChars = times.view(np.uint8).reshape(len(times), times.dtype.itemsize)
+		digits = np.concatenate((dateChars[:, date_digits], timeChars[:, [timeOffset + i for i in time_digits]]), axis=1).astype(np.int64) - ord("0")
+		bad = ((digits < 0) | (digits > 9)).any(axis=1)
+		digits[bad] = 0
+
+# Combine the digits of each part of the date and time
+		parts = []
+		for (start, stop) in ((0, 4), (4, 6), (6, 8), (8, 10), (10, 12), (12, 14)):
+			value = np.zeros(len(digits), dtype=np.int64)
+			for i in range(start, stop):
+				value = value * 10 + digits[:, i]
+			parts.append(value)
+		(year, month, day, hour, minute, second) = parts
+
+# Count months from the year, days from the month and seconds from the day
+		result = (year - 1970).astype("datetime64[Y]").astype("datetime64[M]") + (month - 1)
+		result = result.astype("datetime64[D]") + (day - 1)
+		result = result.astype("datetime64[s]") + (hour * 3600 + minute * 60 + second)
+		result[bad] = np.datetime64("NaT")
+		return result
+
+
+# datasetName(url) function returns the name of the dataset at the OPeNDAP link, the last
+# part of its path without any OPeNDAP suffix.
+def datasetName(url):
+	path = urlsplit(url).path.rstrip("/")
+	for i in dap_suffixes:
+		if path.endswith(i):
+			path = path[:-len(i)]
+	return path.rsplit("/", 1)[-1]
+
+
+# buildConstraint(fields, selections, rows) function builds the OPeNDAP constraint
+# expression that projects the given QCF fields and applies the given selection clauses,
+# and if a (first, last) pair of row numbers is given, only asks for those rows.
+def buildConstraint(fields, selections=None, rows=None):
+	projection = ",".join(sequence_name + "." + i for i in fields)
+	if rows is not None:
+		projection += ",%s[%d:1:%d]" % (sequence_name, rows[0], rows[1])
+	return "&".join([projection] + list(selections or []))
+
+
+# dataUrl(url, constraint, suffix) function returns the address of the binary (.dods)
+# response of the dataset for the given constraint expression, or of another response
+# (e.g. .dds) when a different suffix is given.
+def dataUrl(url, constraint, suffix=".dods"):
+	(scheme, netloc, path, query, fragment) = urlsplit(url)
+	for i in dap_suffixes:
+		if path.endswith(i):
+			path = path[:-len(i)]
+	return urlunsplit((scheme, netloc, path + suffix, constraint, ""))
+
+
+# parseDds(dds) function returns a list of (name, type) pairs for the variables of the
+# sequence described by the DDS text at the start of a DAP2 response.
+def parseDds(dds):
+	body = dds[dds.index("Sequence {") + len("Sequence {"):]
+	body = body[:body.index("}")]
+	return [(name, dapType) for (dapType, name) in re.findall(r"(\w+)\s+([^\s;]+)\s*;", body)]
+
+
+# decodeUniform(data, fields) function decodes a sequence whose rows all take the same
+# number of bytes (e.g. the text fields always have the same length) in one pass with
+# numpy. It returns None if the rows turn out not to be uniform.
+def decodeUniform(data, fields):
+	layout = [("marker", ">u4")]
+	pos = 4
+	for (name, dapType) in fields:
+		if dap_types[dapType] is None:
+			n = int.from_bytes(data[pos:pos+4], "big")
+			if n == 0:
+				return None
+			layout += [(name + "_length", ">u4"), (name, "S%d" % n)]
+			if n % 4:
+				layout.append((name + "_pad", "V%d" % (4 - n % 4)))
+			pos += 4 + n + (-n % 4)
+		else:
+			layout.append((name, dap_types[dapType]))
+			pos += np.dtype(dap_types[dapType]).itemsize
+	count = (len(data) - 4) // pos
+	if count * pos + 4 != len(data) or data[-4:] != end_of_sequence:
+		return None
+	rows = np.frombuffer(data, dtype=np.dtype(layout), count=count)
+	if not np.all(rows["marker"] == 0x5a000000):
+		return None
+	columns = {}
+	for (name, dapType) in fields:
+		if dap_types[dapType] is None:
+			if not np.all(rows[name + "_length"] == rows[name + "_length"][0]):
+				return None
+		columns[name] = rows[name]
+	return columns
+
+
+# decodeRows(data, fields) function decodes a sequence row by row. It is used when the
+# rows have different lengths, e.g. when platform names are not all the same length.
+# It raises an EOFError if the data ends part way through a row, as a response cut off
+# there can still end in the bytes of the end of the sequence.
+def decodeRows(data, fields):
+	(columns, pos) = unpackRows(data, fields)
+	if data[pos:pos+4] == start_of_instance:
+		raise EOFError("The OPeNDAP response ended part way through a row, after " + str(len(next(iter(columns.values())))) + " complete rows")
+	if data[pos:pos+4] != end_of_sequence:
+		raise ValueError("Unexpected data at byte " + str(pos) + " of the sequence")
+	return columns
+
+
+# unpackRows(data, fields, pos, limit) function decodes the rows of a sequence one at a
+# time from byte pos on, at most limit of them if a limit is given, stopping before a
+# row that the data ends in the middle of. It returns the columns of the rows and the
+# byte after the last one.
+def unpackRows(data, fields, pos=0, limit=None):
+# Group neighbouring numeric fields so they are unpacked with one call per row
+	groups = []
+	for (name, dapType) in fields:
+		if dap_types[dapType] is None:
+			groups.append((None, [name]))
+		elif groups and groups[-1][0] is not None:
+			groups[-1][1].append(name)
+			groups[-1] = (groups[-1][0] + np.dtype(dap_types[dapType]).char, groups[-1][1])
+		else:
+			groups.append((">" + np.dtype(dap_types[dapType]).char, [name]))
+	groups = [(struct.Struct(i) if i else None, names) for (i, names) in groups]
+	values = dict((name, []) for (name, dapType) in fields)
+	rows = 0
+	while data[pos:pos+4] == start_of_instance and (limit is None or rows < limit):
+		start = pos
+		pos += 4
+		for (unpacker, names) in groups:
+			if unpacker is None:
+				n = int.from_bytes(data[pos:pos+4], "big")
+				values[names[0]].append(data[pos+4:pos+4+n])
+				pos += 4 + n + (-n % 4)
+			elif pos + unpacker.size <= len(data):
+				for (name, value) in zip(names, unpacker.unpack_from(data, pos)):
+					values[name].append(value)
+				pos += unpacker.size
+			else:
+				pos = len(data) + 1
+				break
+
+# Drop the values of a row cut off by the end of the data
+		if pos > len(data):
+			for name in values:
+				del values[name][rows:]
+			pos = start
+			break
+		rows += 1
+	columns = {}
+	for (name, dapType) in fields:
+		if dap_types[dapType] is None:
+			columns[name] = np.array(values[name], dtype="S")
+		else:
+			columns[name] = np.array(values[name], dtype=dap_types[dapType])
+	return columns, pos
+
+
+# rowLayout(data, pos, fields) function returns the numpy dtype of the row of a sequence
+# starting at byte pos of the data, or None if the data ends before the row does.
+def rowLayout(data, pos, fields):
+	layout = [("marker", ">u4")]
+	pos += 4
+	for (name, dapType) in fields:
+		if dap_types[dapType] is None:
+			if pos + 4 > len(data):
+				return None
+			n = int.from_bytes(data[pos:pos+4], "big")
+			layout.append((name + "_length", ">u4"))
+			if n:
+				layout.append((name, "S%d" % n))
+			if n % 4:
+				layout.append((name + "_pad", "V%d" % (4 - n % 4)))
+			pos += 4 + n + (-n % 4)
+		else:
+			layout.append((name, dap_types[dapType]))
+			pos += np.dtype(dap_types[dapType]).itemsize
+	if pos > len(data):
+		return None
+	return np.dtype(layout)
+
+
+# runLength(data, pos, layout, fields) function returns the number of rows from byte pos
+# on that have the layout (the same marker and string lengths as the first one), and the
+# rows read with it. The rows are checked in windows that grow fourfold, so a run costs
+# about as much as its own rows, however many rows follow it.
+def runLength(data, pos, layout, fields):
+	available = (len(data) - pos) // layout.itemsize
+	window = min(available, run_window)
+	while True:
+		rows = np.frombuffer(data, dtype=layout, count=window, offset=pos)
+		same = rows["marker"] == 0x5a000000
+		for (name, dapType) in fields:
+			if dap_types[dapType] is None:
+				same &= rows[name + "_length"] == rows[name + "_length"][0]
+		if not same.all():
+			return int(np.argmin(same)), rows
+		if window == available:
+			return window, rows
+		window = min(available, window * 4)
+
+
+# decodeChunk(data, fields) function decodes the complete rows at the start of a piece of
+# a sequence. Rows are decoded in runs that take the same number of bytes, each run in one
+# pass with numpy; where the runs are shorter than run_window rows (e.g. string lengths
+# that change from row to row), the next row_window rows are decoded one at a time
+# instead. It returns the columns of the decoded rows (None if there are none), the
+# number of bytes they took and whether the end of the sequence was reached.
+def decodeChunk(data, fields):
+	parts = []
+	pos = 0
+	while data[pos:pos+4] == start_of_instance:
+		layout = rowLayout(data, pos, fields)
+		if layout is None:
+			break
+		(count, rows) = runLength(data, pos, layout, fields)
+		if count < run_window:
+			(columns, pos) = unpackRows(data, fields, pos, row_window)
+			parts.append(columns)
+			continue
+
+# Keep the rows up to the first one with another marker or other string lengths, as the
+# rows after it are not aligned with the layout
+		columns = {}
+		for (name, dapType) in fields:
+			if name in layout.names:
+				columns[name] = rows[name][:count]
+			else:
+				columns[name] = np.zeros(count, dtype="S1")
+		parts.append(columns)
+		pos += count * layout.itemsize
+	if data[pos:pos+4] != end_of_sequence and len(data) - pos >= 4 and data[pos:pos+4] != start_of_instance:
+		raise ValueError("Unexpected data in the sequence")
+	return (joinColumns(parts) if parts else None), pos, data[pos:pos+4] == end_of_sequence
+
+
+# decodeSequence(data, fields) function turns the binary part of a DAP2 sequence
+# response into a dictionary of numpy arrays, one per field. Text fields are returned
+# as byte strings and numeric fields as float64 with missing values set to NaN.
+def decodeSequence(data, fields, missing=missing_value):
+	if data[:4] == end_of_sequence:
+		columns = dict((name, np.array([], dtype="S" if dap_types[dapType] is None else dap_types[dapType])) for (name, dapType) in fields)
+	else:
+		columns = decodeUniform(data, fields)
+		if columns is None:
+			columns = decodeRows(data, fields)
+	for (name, dapType) in fields:
+		if dap_types[dapType] is not None:
+			columns[name] = maskMissing(columns[name], missing)
+	return columns
+
+
+# parseSelection(selection) function splits a selection clause made by the functions
+# above into the field name, the comparison and the value(s) it is compared with.
+def parseSelection(selection):
+	(field, op, value) = re.match(r"\s*" + sequence_name + r"\.(\w+)\s*(<=|>=|!=|=|<|>)\s*(.*)$", selection).groups()
+	values = re.findall(r'"((?:[^"\\]|\\.)*)"|([^,{}\s]+)', value)
+	values = [text.replace('\\"', '"').encode("ascii") if not number else float(number) for (text, number) in values]
+	return field, op, values
+
+
+# applySelections(columns, selections) function returns a boolean array that is True for
+# the rows of the columns that pass all of the selection clauses, as the server would.
+def applySelections(columns, selections):
+	keep = None
+	for selection in selections or []:
+		(field, op, values) = parseSelection(selection)
+		column = np.asarray(columns[field])
+		match = np.zeros(len(column), dtype=bool)
+		for value in values:
+			match |= selection_ops[op](column, value)
+		keep = match if keep is None else keep & match
+	if keep is None:
+		keep = np.ones(len(next(iter(columns.values()))), dtype=bool)
+	return keep
+
+
+# retryable(error) function returns True if a request that failed with the error may
+# succeed if it is made again: the connection dropped or timed out, the response was cut
+# off, or the server answered that it is busy or failing (5xx or 429).
+def retryable(error):
+	if isinstance(error, requests.HTTPError):
+		return error.response is not None and (error.response.status_code >= 500 or error.response.status_code == 429)
+	return isinstance(error, (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError, EOFError))
+
+
+# withRetries(request) function calls request() and returns its result, calling it again
+# after a growing wait each time it fails in a way that may not happen again, at most
+# retries times.
+def withRetries(request):
+	attempt = 0
+	while True:
+		try:
+			return request()
+		except (requests.RequestException, EOFError) as e:
+			if attempt >= retries or not retryable(e):
+				raise
+			delay = min(retry_delay * 2**attempt, retry_max_delay) * random.uniform(0.5, 1)
+			attempt += 1
+			print("Request failed (" + str(e) + "), trying again in %.1f seconds (%d of %d)" % (delay, attempt, retries))
+			with stage("retry"):
+				time.sleep(delay)
+
+
+# getResponse(address) function requests the given address of the OPeNDAP server once and
+# returns the response, read in full, raising an error for an HTTP error status.
+def getResponse(address):
+	response = getSession().get(address, timeout=(connect_timeout, request_timeout))
+	response.raise_for_status()
+	count(bytes=len(response.content))
+	return response
+
+
+# getDds(url) function downloads the DDS of the dataset at the OPeNDAP link and returns
+# the response.
+def getDds(url):
+	return withRetries(lambda: getResponse(dataUrl(url, "", ".dds")))
+
+
+# datasetValidator(url) function returns a string that changes whenever the dataset is
+# updated on the server: its Last-Modified date and a digest of its DDS.
+def datasetValidator(url):
+	with stage("validate"):
+		response = getDds(url)
+	return response.headers.get("Last-Modified", "") + " " + hashlib.sha1(response.content).hexdigest()
+
+
+# setStreaming(on, size) function turns streaming mode on or off, with chunks of the given
+# number of bytes, or of the hard-coded chunk_size if none is given.
+def setStreaming(on=True, size=None):
+	global streaming, chunk_size
+	streaming = on
+	chunk_size = int(size) if size else defaults["chunk_size"]
+
+
+# setRetries(times, timeout, rows) function sets the number of times failed requests are
+# tried again, the number of seconds to wait on the server for each part of a response,
+# and the number of rows of each request of downloads split into row ranges (0 for
+# none), going back to the hard-coded value of any that isn't given.
+def setRetries(times=None, timeout=None, rows=None):
+	global retries, request_timeout, range_rows
+	retries = int(times) if times is not None else defaults["retries"]
+	request_timeout = float(timeout) if timeout else defaults["request_timeout"]
+	range_rows = int(rows) if rows is not None else defaults["range_rows"]
+
+
+# setIncremental(on) function turns incremental mode on or off, and starts a new run:
+# the cached datasets are checked against the server again and no rows count as added.
+def setIncremental(on=True):
+	global incremental
+	incremental = on
+	validated.clear()
+	added_rows.clear()
+
+
+# validateCache(url) function drops the cached variables of the dataset at the OPeNDAP
+# link if it changed on the server since they were saved, or in incremental mode adds
+# the new rows to them. The server is only asked once per run.
+def validateCache(url):
+	if (qcf_cache.cache_dir, url) not in validated:
+		if incremental:
+			added_rows[url] = refreshColumns(url)
+		else:
+			qcf_cache.checkDataset(url, datasetValidator(url))
+		validated.add((qcf_cache.cache_dir, url))
+
+
+# refreshColumns(url, dateVar, timeVar) function brings the cached variables of a dataset
+# that only grows at the end up to date, instead of dropping them when the dataset
+# changed on the server. The rows are ordered by nominal time, so only the rows from the
+# day of the last nominal date and time in the cache on are downloaded, for every cached
+# variable. Those before that last time must be the cached ones, in the same order, and
+# the rest replace the cached rows from that last time on (so rows added at that time
+# since are picked up too). It returns the columns of the new rows, or None if the cache
+# held nothing to bring up to date or the rows before its last time changed; the cache
+# is then checked as usual and the next fetchColumns() downloads every row.
+def refreshColumns(url, dateVar=refresh_vars[0], timeVar=refresh_vars[1]):
+	meta = qcf_cache.datasetMeta(url)
+	validator = datasetValidator(url)
+	names = [i for i in qcf_cache.cachedFields(url) if not i.startswith(derived_prefixes)]
+	last = meta.get("last")
+	if meta["validator"] is None or last is None or dateVar not in names or timeVar not in names:
+		qcf_cache.checkDataset(url, validator)
+		return None
+	if meta["validator"] == validator:
+		return dict((name, np.zeros(0, dtype=column.dtype)) for (name, column) in qcf_cache.loadColumns(url, names).items())
+
+# Download the rows from the day of the last cached time on
+	day = datetime.strptime(last, "%Y/%m/%d%H:%M:%S")
+	columns = downloadColumns(url, names, selectTimeWindow(dateVar, day))
+	last = last.encode("ascii")
+	keys = np.char.add(columns[dateVar], columns[timeVar])
+	before = keys < last
+
+# The rows of that day before the last cached time must still be the last cached rows
+# before it, or rows were added or changed before the end of the dataset
+	cached = qcf_cache.loadColumns(url, names)
+	cachedKeys = np.char.add(cached[dateVar], cached[timeVar])
+	keep = cachedKeys < last
+	tail = keep & (cached[dateVar] >= day.strftime("%Y/%m/%d").encode("ascii"))
+	if not (keep[:keep.sum()].all() and before[:before.sum()].all() and sameColumns(subsetColumns(cached, tail), subsetColumns(columns, before))):
+		print("The rows of " + url + " before its last cached time changed on the server, downloading every row again")
+		qcf_cache.checkDataset(url, validator)
+		return None
+
+# Replace the cached rows from the last cached time on with the downloaded ones
+	columns = subsetColumns(columns, ~before)
+	keys = keys[~before]
+	qcf_cache.appendColumns(url, columns, keep, validator, max(keys.tolist(), default=last).decode("ascii"))
+
+# Return the rows after the last cached time, and those at that time only if more of
+# them arrived since
+	if (keys == last).sum() <= (~keep).sum():
+		return subsetColumns(columns, keys > last)
+	return columns
+
+
+# sameColumns(before, after) function returns True if the columns before and after hold
+# the same rows in the same order, missing values included.
+def sameColumns(before, after):
+	for name in before:
+		if not np.array_equal(before[name], after[name], equal_nan=before[name].dtype.kind == "f"):
+			return False
+	return True
+
+
+# markLast(url, dateVar, timeVar) function records the last nominal date and time in the
+# cached rows of the dataset, for the next refreshColumns().
+def markLast(url, dateVar=refresh_vars[0], timeVar=refresh_vars[1]):
+	with qcf_cache.lockCache():
+		if dateVar not in qcf_cache.cachedFields(url) or timeVar not in qcf_cache.cachedFields(url):
+			return
+		cached = qcf_cache.loadColumns(url, [dateVar, timeVar])
+	keys = np.char.add(cached[dateVar], cached[timeVar])
+	if len(keys):
+		qcf_cache.setLast(url, max(keys.tolist()).decode("ascii"))
+
+
+# fetchColumns(url, fields, selections) function returns the given QCF fields of the
+# dataset at the OPeNDAP link as a dictionary of numpy arrays keyed by field name,
+# keeping only the rows that pass the selection clauses. The fields are downloaded in a
+# single request, or read from the on-disk cache when it is turned on.
+def fetchColumns(url, fields, selections=None, missing=missing_value):
+	fields = list(dict.fromkeys(fields))
+	if qcf_cache.cache_dir is None:
+		return downloadColumns(url, fields, selections, missing)
+
+# Drop the cached variables if the dataset changed on the server since they were saved
+	validateCache(url)
+
+# Download every row of the variables that are not cached yet, including the ones the
+# selection clauses refer to, then filter the cached columns locally.
+# The cached variables are looked up and opened under the lock of the cache, so another
+# process can't evict them in between (an opened variable stays readable once its file
+# is deleted). Variables evicted after they were downloaded are downloaded again.
+	needed = list(dict.fromkeys(fields + [parseSelection(i)[0] for i in selections or []]))
+	while True:
+		with qcf_cache.lockCache():
+			cached = qcf_cache.cachedFields(url)
+			missingFields = [i for i in needed if i not in cached]
+
+# In incremental mode, also cache the nominal times the cache is brought up to date by
+			if incremental:
+				missingFields += [i for i in refresh_vars if i not in cached and i not in missingFields]
+			if not missingFields:
+				with stage("cache"):
+					columns = qcf_cache.loadColumns(url, needed)
+				break
+		qcf_cache.storeColumns(url, downloadColumns(url, missingFields, None, missing))
+
+# Record the last nominal date and time of the rows in incremental mode, once every row is
+# cached
+		if incremental and qcf_cache.datasetMeta(url).get("last") is None:
+			markLast(url)
+	with stage("cache"):
+		if not selections:
+			count(rows=len(columns[fields[0]]))
+			return dict((name, columns[name]) for name in fields)
+		keep = applySelections(columns, selections)
+		columns = dict((name, columns[name][keep]) for name in fields)
+		count(rows=len(columns[fields[0]]))
+	return columns
+
+
+# downloadColumns(url, fields, selections) function downloads the given QCF fields of the
+# dataset at the OPeNDAP link in a single request, keeping only the rows that pass the
+# selection clauses, and returns a dictionary of numpy arrays keyed by field name. Every
+# row is downloaded in row ranges instead when there are no selection clauses and
+# range_rows is set (see downloadRanges).
+def downloadColumns(url, fields, selections=None, missing=missing_value):
+	if range_rows and not selections:
+		return downloadRanges(url, fields, missing)
+	return withRetries(lambda: requestColumns(url, buildConstraint(fields, selections), missing))
+
+
+# requestColumns(url, constraint, missing) function makes one request of the dataset at
+# the OPeNDAP link for the constraint expression and decodes the response, raising an
+# EOFError if it was cut off before the end of the sequence.
+def requestColumns(url, constraint, missing=missing_value):
+	with stage("download"):
+		response = getResponse(dataUrl(url, constraint))
+	(dds, sep, data) = response.content.partition(b"\nData:\n")
+	if not sep and not dds.startswith(b"Dataset"):
+		raise RuntimeError("The OPeNDAP server did not return data:\n" + response.text)
+	if not data.endswith(end_of_sequence):
+		raise EOFError("The OPeNDAP response ended before the end of the sequence")
+	with stage("decode"):
+		columns = decodeSequence(data, parseDds(dds.decode("ascii")), missing)
+		count(rows=len(next(iter(columns.values()))))
+	return columns
+
+
+# sameRow(before, after) function returns True if the last row of the columns before
+# matches the first row of the columns after, missing values included.
+def sameRow(before, after):
+	for name in before:
+		(x, y) = (before[name][-1], after[name][0])
+		if x != y and not (x != x and y != y):
+			return False
+	return True
+
+
+# downloadRanges(url, fields, missing) function downloads every row of the given QCF
+# fields of the dataset at the OPeNDAP link in requests of range_rows rows each, until
+# one has no new rows, and returns the columns. Every range but the first starts with
+# the last row of the range before it, which is checked and dropped, and a range with
+# fewer rows than asked for must be the last one. With the cache turned on, each range
+# is saved in the cache as it arrives, and the ranges saved by an earlier run that was
+# stopped part way are read back instead of being downloaded again.
+def downloadRanges(url, fields, missing=missing_value):
+	keep = qcf_cache.cache_dir is not None
+	parts = qcf_cache.loadParts(url, fields) if keep else []
+	first = sum(len(part[fields[0]]) for part in parts)
+	if parts:
+		print("Resuming the download of " + url + " after " + str(first) + " rows")
+	size = range_rows
+	short = False
+	while True:
+		rows = (max(first - 1, 0), first + size - 1)
+		columns = withRetries(lambda: requestColumns(url, buildConstraint(fields, None, rows), missing))
+		found = len(columns[fields[0]])
+		if found > rows[1] - rows[0] + 1:
+			raise RuntimeError("The OPeNDAP server does not support row ranges (QCF[first:1:last]), download without --range-rows")
+		if first:
+			if not found or not sameRow(parts[-1], columns):
+				raise RuntimeError("The row ranges of the OPeNDAP server leave a gap or overlap at row " + str(first) + ", download without --range-rows")
+			columns = dict((name, column[1:]) for (name, column) in columns.items())
+			found -= 1
+		if not found:
+			break
+		if short:
+			raise RuntimeError("The row ranges of the OPeNDAP server leave a gap before row " + str(first) + ", download without --range-rows")
+		short = found < size
+		if keep:
+			qcf_cache.storePart(url, fields, len(parts), columns)
+		parts.append(columns)
+		first += found
+	if not parts:
+		return columns
+	columns = dict((name, np.concatenate([part[name] for part in parts])) for name in fields)
+	if keep:
+		qcf_cache.removeParts(url, fields)
+	return columns
+
+
+# openStream(address) function requests the given address of the OPeNDAP server once and
+# returns the response without reading it, raising an error for an HTTP error status.
+def openStream(address):
+	response = getSession().get(address, timeout=(connect_timeout, request_timeout), stream=True)
+	response.raise_for_status()
+	return response
+
+
+# streamColumns(url, fields, selections) function downloads the given QCF fields of the
+# dataset at the OPeNDAP link like downloadColumns(), but reads the response chunk_size
+# bytes at a time and yields the columns of the complete rows of each chunk as soon as
+# it arrives, so the whole response is never held in memory.
+def streamColumns(url, fields, selections=None, missing=missing_value):
+	with stage("download"):
+		response = withRetries(lambda: openStream(dataUrl(url, buildConstraint(fields, selections))))
+	with response:
+		buffer = b""
+		types = None
+		pieces = response.iter_content(chunk_size=chunk_size)
+		while True:
+# Time the wait for each chunk apart from the decoding and the plotting of its rows
+			with stage("download"):
+				piece = next(pieces, None)
+				if piece is not None:
+					count(bytes=len(piece))
+			if piece is None:
+				break
+			buffer += piece
+
+# Read the DDS at the start of the response to learn the types of the fields
+			if types is None:
+				(dds, sep, data) = buffer.partition(b"\nData:\n")
+				if not sep:
+					continue
+				types = parseDds(dds.decode("ascii"))
+				buffer = data
+
+# Decode the complete rows and keep the bytes of the last, partial row for the next chunk
+			with stage("decode"):
+				(columns, used, finished) = decodeChunk(buffer, types)
+				buffer = buffer[used:]
+				if columns is not None:
+					for (name, dapType) in types:
+						if dap_types[dapType] is not None:
+							columns[name] = maskMissing(columns[name], missing)
+					count(rows=len(columns[types[0][0]]))
+			if columns is not None:
+				yield columns
+			if finished:
+				return
+	if types is None:
+		raise RuntimeError("The OPeNDAP server did not return data:\n" + buffer.decode("ascii", "replace"))
+	raise RuntimeError("The OPeNDAP response ended before the end of the sequence")
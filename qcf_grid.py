@@ -0,0 +1,193 @@
+# Authorship: NCAR Earth Observing Laboratory Data Management & Services Group
+# Contact: eol-archive@ucar.edu
+#
+# Licensing: The code associated with this document is provided freely and openly.
+# Users are hereby granted a license to access and use this code, unless otherwise
+# stated, subject to the terms and conditions of the GNU Affero General Public
+# License 3.0 (AGPL-3.0; https://www.gnu.org/licenses/agpl-3.0.en.html). This
+# documentation and associated code are provided "as is" and are not supported.
+# By using or downloading this code, the user agrees to the terms and conditions
+# set forth in this code and in the "Using Python to View OPeNDAP Files" document.
+#
+# Acknowledgment: This work was sponsored by the National Science Foundation.
+# This material is based upon work supported by the National Center for Atmospheric
+# Research, a major facility sponsored by the National Science Foundation and managed
+# by the University Corporation for Atmospheric Research. Any opinions, findings
+# and conclusions or recommendations expressed in this material do not necessarily
+# reflect the views of the National Science Foundation.
+#
+# NOTE: This module requires the following packages to be installed:
+#		python3
+#		numpy
+#		matplotlib
+# and, to save NetCDF files, netCDF4 (or scipy, which writes the whole file at the end).
+#
+# The qcf_grid.py module puts the data of python_xyz.py onto a fixed latitude/longitude
+# grid, one frame per datetime, for its --grid-output option. It is not run on its own.
+#
+# The value at each grid point is interpolated linearly within the triangle of stations
+# around it (the Delaunay triangulation that python_xyz.py draws as a surface). The three
+# stations and their weights for every grid point only depend on the positions of the
+# stations, so they are worked out once for every station position found at any of the
+# datetimes, and used for every frame. Each frame is then a single sparse matrix-vector
+# product: the weights times the values of the stations. Stations without a value at a
+# datetime (missing, or not reporting then) are left out of the product and the weights
+# of the others are scaled up; grid points whose stations with values hold less than
+# min_weight of the weight, or that are outside of the stations, are NaN. A station with
+# several rows at a datetime (at the same position) gets the mean of their values, so
+# the frame does not depend on the order of the rows.
+#
+# The frames can be saved as a NetCDF file holding the variable on the grid at every
+# datetime (openCube, addFrame, closeCube), one frame at a time.
+#
+# The module uses the following hard-coded entities that may need to be changed:
+#	grid_size: The default number of grid points along the latitude and the longitude
+#	min_weight: The share of the interpolation weight that stations with values must
+#		hold at a grid point for it to get a value
+#	weights_cache: The number of sets of station positions whose weights are kept
+#	missing_value: The fill value of the NetCDF files, as in the QCF datasets
+# To change any of these values, simply search "HARD-CODED" in this module
+#
+
+# Import necessary packages:
+from datetime import timezone
+import numpy as np
+from matplotlib.tri import Triangulation
+from qcf_export import createVariable, openNetcdf
+from qcf_profile import count, stage
+
+
+#HARD-CODED
+grid_size = 200
+min_weight = 0.5
+weights_cache = 16
+missing_value = -999.99
+
+# Interpolation weights of the station sets gridded so far, keyed by the station positions
+weights = {}
+
+
+# Functions:
+
+# makeGrid(lats, lons, size) function returns the latitudes and longitudes of a grid of
+# size by size points covering the given station positions.
+def makeGrid(lats, lons, size=grid_size):
+	return np.linspace(np.nanmin(lats), np.nanmax(lats), size), np.linspace(np.nanmin(lons), np.nanmax(lons), size)
+
+
+# gridWeights(lats, lons, grid) function returns the stations (indices into the positions)
+# and weights of the linear interpolation at every point of the grid, both arrays of
+# shape (points, 3). The weights of points outside of the stations are 0.
+def gridWeights(lats, lons, grid):
+	(gridLons, gridLats) = np.meshgrid(grid[1], grid[0])
+	(px, py) = (gridLons.ravel(), gridLats.ravel())
+	triangulation = Triangulation(lons, lats)
+	found = triangulation.get_trifinder()(px, py)
+	stations = triangulation.triangles[found]
+	(x, y) = (lons[stations], lats[stations])
+
+# Barycentric coordinates of each point in its triangle
+	with np.errstate(divide="ignore", invalid="ignore"):
+		det = (y[:, 1] - y[:, 2]) * (x[:, 0] - x[:, 2]) + (x[:, 2] - x[:, 1]) * (y[:, 0] - y[:, 2])
+		w0 = ((y[:, 1] - y[:, 2]) * (px - x[:, 2]) + (x[:, 2] - x[:, 1]) * (py - y[:, 2])) / det
+		w1 = ((y[:, 2] - y[:, 0]) * (px - x[:, 2]) + (x[:, 0] - x[:, 2]) * (py - y[:, 2])) / det
+	pointWeights = np.column_stack((w0, w1, 1 - w0 - w1))
+	pointWeights[(found < 0) | ~np.isfinite(pointWeights).all(axis=1)] = 0
+	return stations, pointWeights
+
+
+# cachedWeights(lats, lons, grid) function returns the interpolation weights of the
+# stations at the given positions, reusing the ones worked out for an earlier frame with
+# the same stations.
+def cachedWeights(lats, lons, grid):
+	key = (lats.tobytes(), lons.tobytes())
+	if key not in weights:
+		if len(weights) >= weights_cache:
+			weights.pop(next(iter(weights)))
+		weights[key] = gridWeights(lats, lons, grid)
+	return weights[key]
+
+
+# gridFrame(z, weights, grid) function returns the values z of the stations interpolated
+# onto the grid with their weights (see gridWeights), as an array of shape (latitudes,
+# longitudes). Stations without a value have a NaN value.
+def gridFrame(z, weights, grid):
+# The sparse matrix-vector product, with three stations per grid point, scaled by the
+# weight of the stations that have a value
+	(stations, pointWeights) = weights
+	valid = ~np.isnan(z)
+	total = (pointWeights * valid[stations]).sum(axis=1)
+	with np.errstate(divide="ignore", invalid="ignore"):
+		frame = (pointWeights * np.where(valid, z, 0)[stations]).sum(axis=1) / total
+	frame[total < min_weight] = np.nan
+	return frame.reshape(len(grid[0]), len(grid[1]))
+
+
+# gridFrames(columns, var, frames, grid) function yields the datetime and the gridded
+# values of the variable for each (datetime, rows) pair of frames, skipping the
+# datetimes with fewer than 3 stations. The rows of a station at a datetime are averaged.
+def gridFrames(columns, var, frames, grid):
+	frames = list(frames)
+	(lats, lons) = (columns["latitude"], columns["longitude"]) # HARD-CODED
+
+# Put every station position of the frames in order, and triangulate them once
+	rows = np.concatenate([i[1] for i in frames]) if frames else np.zeros(0, dtype=np.intp)
+	rows = rows[~(np.isnan(lats[rows]) | np.isnan(lons[rows]))]
+	positions = np.unique(lats[rows] + 1j * lons[rows])
+	weights = cachedWeights(positions.real.copy(), positions.imag.copy(), grid) if len(positions) >= 3 else None
+	for (datetime, rows) in frames:
+		frame = None
+		with stage("grid"):
+			count(rows=len(rows))
+			rows = rows[~(np.isnan(lats[rows]) | np.isnan(lons[rows]))]
+			station = np.searchsorted(positions, lats[rows] + 1j * lons[rows])
+			if len(np.unique(station)) >= 3:
+# Average the values of the rows at the same position (a station reporting more than
+# once at the datetime), leaving out the missing ones
+				values = np.asarray(columns[var][rows], dtype=np.float64)
+				valid = ~np.isnan(values)
+				n = np.bincount(station[valid], minlength=len(positions))
+				total = np.bincount(station[valid], weights=values[valid], minlength=len(positions))
+				with np.errstate(divide="ignore", invalid="ignore"):
+					z = np.where(n > 0, total / n, np.nan)
+				frame = gridFrame(z, weights, grid)
+		if frame is None:
+			print('Fewer than 3 stations found at ' + datetime.strftime("%Y/%m/%d-%H:%M") + ', no frame created.')
+			continue
+		yield datetime, frame
+
+
+# openCube(fileName, var, grid, attributes) function creates a NetCDF file for the gridded
+# values of the variable, with the given attributes (e.g. units), and returns it.
+# netCDF4 is used if it is installed, and scipy otherwise (see qcf_export.openNetcdf).
+def openCube(fileName, var, grid, attributes=None):
+	cube = openNetcdf(fileName)
+	cube.title = "Gridded " + var
+	cube.createDimension("time", None)
+	cube.createDimension("latitude", len(grid[0]))
+	cube.createDimension("longitude", len(grid[1]))
+	times = cube.createVariable("time", "d", ("time",))
+	times.units = "seconds since 1970-01-01 00:00:00 UTC"
+	for (name, values, units) in (("latitude", grid[0], "degrees_north"), ("longitude", grid[1], "degrees_east")):
+		axis = cube.createVariable(name, "d", (name,))
+		axis.units = units
+		axis[:] = values
+	data = createVariable(cube, var, "f", ("time", "latitude", "longitude"), np.float32(missing_value))
+	for (name, value) in (attributes or {}).items():
+		if name not in ("_FillValue", "missing_value"):
+			setattr(data, name, value)
+	return {"file": cube, "var": var, "frames": 0}
+
+
+# addFrame(cube, datetime, frame) function adds the gridded values at a datetime to the
+# NetCDF file.
+def addFrame(cube, datetime, frame):
+	i = cube["frames"]
+	cube["file"].variables["time"][i] = datetime.replace(tzinfo=timezone.utc).timestamp()
+	cube["file"].variables[cube["var"]][i] = np.where(np.isnan(frame), missing_value, frame).astype(np.float32)
+	cube["frames"] = i + 1
+
+
+# closeCube(cube) function finishes the NetCDF file.
+def closeCube(cube):
+	cube["file"].close()
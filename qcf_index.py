@@ -0,0 +1,199 @@
+# Authorship: NCAR Earth Observing Laboratory Data Management & Services Group
+# Contact: eol-archive@ucar.edu
+#
+# Licensing: The code associated with this document is provided freely and openly.
+# Users are hereby granted a license to access and use this code, unless otherwise
+# stated, subject to the terms and conditions of the GNU Affero General Public
+# License 3.0 (AGPL-3.0; https://www.gnu.org/licenses/agpl-3.0.en.html). This
+# documentation and associated code are provided "as is" and are not supported.
+# By using or downloading this code, the user agrees to the terms and conditions
+# set forth in this code and in the "Using Python to View OPeNDAP Files" document.
+#
+# Acknowledgment: This work was sponsored by the National Science Foundation.
+# This material is based upon work supported by the National Center for Atmospheric
+# Research, a major facility sponsored by the National Science Foundation and managed
+# by the University Corporation for Atmospheric Research. Any opinions, findings
+# and conclusions or recommendations expressed in this material do not necessarily
+# reflect the views of the National Science Foundation.
+#
+# NOTE: This module requires the following packages to be installed:
+#		python3
+#		numpy
+#
+# The qcf_index.py module groups the rows of a QCF dataset by station or by datetime,
+# so the plotting scripts can list the stations and datetimes of a dataset and find
+# the rows of each one without scanning every row again. It is not run on its own.
+#
+# An index is built in one vectorized pass over the key of every row (the
+# network_name-platform_name of the station, or the date and time) and holds:
+#	keys: the sorted unique keys
+#	group: the position in keys of the key of every row
+#	order: the row numbers sorted by key, so the rows of a key are contiguous
+#	offsets: where the rows of each key start in order (one more entry than keys)
+# The number of rows of each key is then np.diff(offsets).
+#
+# In streaming mode (see qcf_fetch.streamColumns), the rows are counted one chunk of
+# the download at a time, and streamGroups() collects the rows of each key as the chunks
+# arrive instead.
+#
+# When the on-disk cache of qcf_cache.py is turned on, the index of the whole dataset
+# is saved in the cache next to the variables it was built from (as the variables
+# "index-{fields}.keys" etc.), so later runs read it instead of building it. It is
+# dropped along with the variables when the dataset changes on the server.
+#
+
+# Import necessary packages:
+import numpy as np
+import qcf_cache
+import qcf_fetch
+from qcf_profile import count, stage
+from qcf_fetch import fetchColumns, inTimeWindow, joinColumns, selectTimeWindow, streamColumns, subsetColumns, toStr, validateCache
+
+
+#HARD-CODED
+# Format of the date and time keys of dateTimeKeys(), for datetime.strptime/strftime
+key_format = "%Y/%m/%d%H:%M:%S"
+
+# Arrays making up an index
+index_parts = ["keys", "group", "order", "offsets"]
+
+
+# Functions:
+
+# stationKeys(columns) function returns the network_name-platform_name station name of
+# every row of the columns, as byte strings.
+def stationKeys(columns):
+	return np.char.add(np.char.add(columns["network_name"], b"-"), columns["platform_name"]) # HARD-CODED
+
+
+# dateTimeKeys(dates, times) function returns the date and time of every row as one byte
+# string, YYYY/mm/ddHH:MM:SS, which sorts in time order.
+def dateTimeKeys(dates, times):
+	return np.char.add(dates, times)
+
+
+# groupRows(keys) function builds the index of an array holding the key of every row.
+def groupRows(keys):
+	with stage("index"):
+		count(rows=len(keys))
+		(uniq, group, counts) = np.unique(keys, return_inverse=True, return_counts=True)
+		return {
+			"keys": uniq,
+			"group": group.reshape(-1),
+			"order": np.argsort(group.reshape(-1), kind="stable"),
+			"offsets": np.concatenate(([0], np.cumsum(counts))),
+		}
+
+
+# rowsOf(index, key) function returns the row numbers with the given key (a byte string
+# or str), or an empty array if there are none.
+def rowsOf(index, key):
+	if isinstance(key, str):
+		key = key.encode("ascii")
+	keys = index["keys"]
+	i = np.searchsorted(keys, key)
+	if i == len(keys) or keys[i] != key:
+		return np.zeros(0, dtype=np.intp)
+	return np.asarray(index["order"][index["offsets"][i]:index["offsets"][i + 1]])
+
+
+# cachedIndex(url, fields, keysOf) function returns the index of every row of the dataset
+# at the OPeNDAP link, grouped by the keys keysOf() makes from the given fields. It is
+# read from the on-disk cache, or built from the (cached) fields and saved there.
+def cachedIndex(url, fields, keysOf):
+	validateCache(url)
+	prefix = "index-" + "-".join(fields) + "."
+	names = [prefix + i for i in index_parts]
+	if all(name in qcf_cache.cachedFields(url) for name in names):
+		saved = qcf_cache.loadColumns(url, names)
+		return dict((i, saved[prefix + i]) for i in index_parts)
+	index = groupRows(keysOf(fetchColumns(url, fields)))
+	qcf_cache.storeColumns(url, dict((prefix + i, index[i]) for i in index_parts))
+	return index
+
+
+# countGroups(url, fields, keysOf, dateVar, timeVar, start, end) function returns the
+# sorted keys made by keysOf() from the given fields, and the number of rows with each
+# key, counting only the rows within the time window if one is given. Keys without any
+# rows in the window are left out.
+def countGroups(url, fields, keysOf, dateVar="date", timeVar="time", start=None, end=None): # HARD-CODED
+	if qcf_fetch.streaming:
+# Add up the rows of each key one chunk of the download at a time
+		totals = {}
+		for columns in streamColumns(url, list(dict.fromkeys(fields + [dateVar, timeVar])), selectTimeWindow(dateVar, start, end)):
+			columns = subsetColumns(columns, inTimeWindow(columns[dateVar], columns[timeVar], start, end))
+			(keys, counts) = np.unique(keysOf(columns), return_counts=True)
+			for (key, count) in zip(keys.tolist(), counts.tolist()):
+				totals[key] = totals.get(key, 0) + count
+		keys = sorted(totals)
+		return np.array(keys, dtype="S"), np.array([totals[i] for i in keys], dtype=np.int64)
+	if qcf_cache.cache_dir is not None:
+# Count the rows of each key in the cached index of the whole dataset
+		index = cachedIndex(url, fields, keysOf)
+		if start is None and end is None:
+			counts = np.diff(index["offsets"])
+		else:
+			dateTimes = fetchColumns(url, [dateVar, timeVar])
+			window = inTimeWindow(dateTimes[dateVar], dateTimes[timeVar], start, end)
+			counts = np.bincount(index["group"][window], minlength=len(index["keys"]))
+	else:
+# Download the fields for the time window only and group them
+		columns = fetchColumns(url, list(dict.fromkeys(fields + [dateVar, timeVar])), selectTimeWindow(dateVar, start, end))
+		columns = subsetColumns(columns, inTimeWindow(columns[dateVar], columns[timeVar], start, end))
+		index = groupRows(keysOf(columns))
+		counts = np.diff(index["offsets"])
+	found = counts > 0
+	return index["keys"][found], counts[found]
+
+
+# countStations(url, start, end) function returns the sorted list of the stations of the
+# dataset at the OPeNDAP link (within the time window if one is given) and the number
+# of rows of each.
+def countStations(url, start=None, end=None):
+	(keys, counts) = countGroups(url, ["network_name", "platform_name"], stationKeys, start=start, end=end) # HARD-CODED
+	return list(toStr(keys)), counts
+
+
+# countDateTimes(url, dateVar, timeVar, start, end) function returns the sorted date and
+# time keys (see dateTimeKeys()) of the dataset at the OPeNDAP link (within the time
+# window if one is given) and the number of rows at each.
+def countDateTimes(url, dateVar, timeVar, start=None, end=None):
+	return countGroups(url, [dateVar, timeVar], lambda columns: dateTimeKeys(columns[dateVar], columns[timeVar]), dateVar, timeVar, start, end)
+
+
+# streamGroups(url, fields, selections, keysOf, keep, ordered) function downloads the
+# given fields in streaming mode and yields the key and the columns of the rows of each
+# key made by keysOf(), keeping only the rows for which keep() (if given) is True. A
+# key's rows are only held until they are yielded. When ordered is True and the rows
+# arrive sorted by key (e.g. nominal datetimes), each key is yielded as soon as a later
+# key arrives; otherwise the keys are yielded at the end of the download. If rows of a key
+# that was already yielded arrive later, a RuntimeError is raised rather than yielding
+# the key twice.
+def streamGroups(url, fields, selections, keysOf, keep=None, ordered=False):
+	pending = {}
+	yielded = set()
+	last = None
+	for columns in streamColumns(url, fields, selections):
+		if keep is not None:
+			columns = subsetColumns(columns, keep(columns))
+		keys = keysOf(columns)
+		if len(keys) == 0:
+			continue
+		index = groupRows(keys)
+		late = [key for key in index["keys"] if key in yielded]
+		if late:
+			raise RuntimeError("More rows of " + late[0].decode("ascii", "replace") + " arrived after it was plotted, as the dataset is not sorted by it; run without --stream")
+		for (i, key) in enumerate(index["keys"]):
+			pending.setdefault(key, []).append(subsetColumns(columns, index["order"][index["offsets"][i]:index["offsets"][i + 1]]))
+
+# Yield the keys that are complete, as long as the rows have been sorted by key so far
+		if ordered:
+			if (last is not None and keys[0] < last) or (keys[1:] < keys[:-1]).any():
+				ordered = False
+			else:
+				last = keys[-1]
+				for key in sorted(i for i in pending if i < last):
+					yielded.add(key)
+					yield key, joinColumns(pending.pop(key))
+	for key in sorted(pending):
+		yield key, joinColumns(pending.pop(key))
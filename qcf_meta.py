@@ -0,0 +1,125 @@
+# Authorship: NCAR Earth Observing Laboratory Data Management & Services Group
+# Contact: eol-archive@ucar.edu
+#
+# Licensing: The code associated with this document is provided freely and openly.
+# Users are hereby granted a license to access and use this code, unless otherwise
+# stated, subject to the terms and conditions of the GNU Affero General Public
+# License 3.0 (AGPL-3.0; https://www.gnu.org/licenses/agpl-3.0.en.html). This
+# documentation and associated code are provided "as is" and are not supported.
+# By using or downloading this code, the user agrees to the terms and conditions
+# set forth in this code and in the "Using Python to View OPeNDAP Files" document.
+#
+# Acknowledgment: This work was sponsored by the National Science Foundation.
+# This material is based upon work supported by the National Center for Atmospheric
+# Research, a major facility sponsored by the National Science Foundation and managed
+# by the University Corporation for Atmospheric Research. Any opinions, findings
+# and conclusions or recommendations expressed in this material do not necessarily
+# reflect the views of the National Science Foundation.
+#
+# NOTE: This module requires the following packages to be installed:
+#		python3
+#		requests
+#
+# The qcf_meta.py module finds out what a QCF dataset holds from its metadata alone, for
+# the variable prompts and the --list-vars option of python_xy.py and python_xyz.py and
+# the /vars request of qcf_service.py. It is not run on its own.
+#
+# The fields of the QCF sequence and their types are read from the DDS of the dataset,
+# and the attributes of each field (e.g. units, long_name and missing_value) from its
+# DAS, two small text responses that don't hold any data. The fields that can be plotted
+# are the numeric ones other than the location of the stations; the dates, times and
+# names are text, and quality flags sent as text are left out the same way.
+#
+# The description of each dataset is kept for the rest of the run (or the life of
+# qcf_service.py), so listing the variables again is free. The stations of a dataset
+# are not in its metadata; they are found by qcf_index.countStations(), which only
+# downloads the network and platform names, or reads them from the on-disk cache.
+#
+# The module uses the following hard-coded entities that may need to be changed:
+#	location_fields: The numeric fields that hold the location of the stations and
+#		are not offered for plotting
+# To change any of these values, simply search "HARD-CODED" in this module
+#
+
+# Import necessary packages:
+import re
+from qcf_fetch import dap_types, dataUrl, getDds, getResponse, parseDds, withRetries
+from qcf_profile import stage
+
+
+#HARD-CODED
+location_fields = ["latitude", "longitude", "elevation"]
+
+# The descriptions of the datasets read so far, keyed by OPeNDAP link
+descriptions = {}
+
+
+# Functions:
+
+# parseValue(text) function converts the value of a DAS attribute to a number, or to a
+# string without its quotes.
+def parseValue(text):
+	text = text.strip()
+	if text.startswith('"'):
+		return text.strip('"')
+	try:
+		return float(text)
+	except ValueError:
+		return text
+
+
+# parseDas(das) function returns the attributes of each field described by the DAS text
+# as a dictionary of dictionaries keyed by field name and attribute name. Fields are
+# found by the name of their attribute container, with or without the name of the
+# sequence in front (QCF { temp_air { or QCF.temp_air {).
+def parseDas(das):
+	attributes = {}
+	containers = []
+	for line in das.splitlines():
+		line = line.strip()
+		opened = re.match(r"^([^\s{]+)\s*\{$", line)
+		if opened:
+			containers.append(opened.group(1).rsplit(".", 1)[-1])
+		elif line.startswith("}"):
+			if containers:
+				containers.pop()
+		else:
+			attribute = re.match(r"^(\w+)\s+(\S+)\s+(.*);$", line)
+			if attribute and containers:
+				values = [parseValue(i) for i in re.findall(r'"[^"]*"|[^,\s][^,]*', attribute.group(3))]
+				attributes.setdefault(containers[-1], {})[attribute.group(2)] = values[0] if len(values) == 1 else values
+	return attributes
+
+
+# describeDataset(url) function returns the fields of the QCF sequence of the dataset at
+# the OPeNDAP link, in order, as a list of dictionaries holding the name, DAP2 type,
+# attributes (from the DAS) and whether the field can be plotted.
+def describeDataset(url):
+	if url not in descriptions:
+		with stage("open_url"):
+			fields = parseDds(getDds(url).text)
+			response = withRetries(lambda: getResponse(dataUrl(url, "", ".das")))
+			attributes = parseDas(response.text)
+		descriptions[url] = [{"name": name, "type": dapType, "attributes": attributes.get(name, {}), "plottable": dap_types.get(dapType) is not None and name not in location_fields} for (name, dapType) in fields]
+	return descriptions[url]
+
+
+# fieldNames(url) function returns the names of every field of the dataset at the
+# OPeNDAP link.
+def fieldNames(url):
+	return [field["name"] for field in describeDataset(url)]
+
+
+# plottableVars(url) function returns the names of the fields of the dataset at the
+# OPeNDAP link that can be plotted.
+def plottableVars(url):
+	return [field["name"] for field in describeDataset(url) if field["plottable"]]
+
+
+# formatField(field) function returns a line describing a field for --list-vars: its
+# name, type, units and missing value, separated by tabs, so that tools can take the
+# names from the first column.
+def formatField(field):
+	attributes = field["attributes"]
+	missing = attributes.get("missing_value", attributes.get("_FillValue", ""))
+	return "\t".join([field["name"], field["type"], str(attributes.get("units", "")), "%g" % missing if isinstance(missing, float) else str(missing)])
@@ -0,0 +1,188 @@
+# Authorship: NCAR Earth Observing Laboratory Data Management & Services Group
+# Contact: eol-archive@ucar.edu
+#
+# Licensing: The code associated with this document is provided freely and openly.
+# Users are hereby granted a license to access and use this code, unless otherwise
+# stated, subject to the terms and conditions of the GNU Affero General Public
+# License 3.0 (AGPL-3.0; https://www.gnu.org/licenses/agpl-3.0.en.html). This
+# documentation and associated code are provided "as is" and are not supported.
+# By using or downloading this code, the user agrees to the terms and conditions
+# set forth in this code and in the "Using Python to View OPeNDAP Files" document.
+#
+# Acknowledgment: This work was sponsored by the National Science Foundation.
+# This material is based upon work supported by the National Center for Atmospheric
+# Research, a major facility sponsored by the National Science Foundation and managed
+# by the University Corporation for Atmospheric Research. Any opinions, findings
+# and conclusions or recommendations expressed in this material do not necessarily
+# reflect the views of the National Science Foundation.
+#
+# NOTE: This module requires the following packages to be installed:
+#		python3
+#		matplotlib
+#
+# The qcf_output.py module saves the plots of python_xy.py and python_xyz.py (their
+# --format, --output-dir and --tarball options). It is not run on its own.
+#
+# Every plot is drawn into an in-memory buffer in the chosen format (PNG, SVG or PDF)
+# and the bytes are handed to the output chosen with setOutput():
+#	a directory (the current one by default): the plot is written to a temporary file
+#		that is then renamed, so runs saving a plot of the same name at the same time
+#		never leave a mix of the two
+#	a tar file: the plots are added to one archive instead of separate files
+#	a callback: a function called with the file name and the bytes of each plot, for
+#		programs (e.g. a web service) that use the scripts without touching the disk
+#
+# With --jobs, the worker processes write to a directory themselves, and send the
+# bytes of their plots back to the main process for a tar file or a callback.
+#
+# The module uses the following hard-coded entities that may need to be changed:
+#	output_formats: The formats the plots can be saved in
+# To change any of these values, simply search "HARD-CODED" in this module
+#
+
+# Import necessary packages:
+import io
+import os
+import tarfile
+import tempfile
+import threading
+import time
+
+
+#HARD-CODED
+output_formats = ["png", "svg", "pdf"]
+
+# The format of the plots, and where they go: a directory (None for the current one),
+# an open tar file or a callback
+output_format = "png"
+output_dir = None
+output_tar = None
+output_callback = None
+output_lock = threading.Lock()
+
+# In a worker process sending its plots back to the main process, the plots saved since
+# they were last sent
+collected = None
+
+# Permissions of the saved files, as the umask of the process allows
+umask = os.umask(0)
+os.umask(umask)
+file_mode = 0o666 & ~umask
+
+
+# Functions:
+
+# setOutput(format, directory, tarball, callback) function chooses the format of the plots
+# and where they are saved: in the directory, added to a new tar file, or handed to the
+# callback, in the current directory if none of them is given.
+def setOutput(format="png", directory=None, tarball=None, callback=None):
+	global output_format, output_dir, output_tar, output_callback
+	closeOutput()
+	if format not in output_formats:
+		raise ValueError("Invalid output format: " + format + " (use " + ", ".join(output_formats) + ")")
+	output_format = format
+	output_dir = directory
+	if directory is not None:
+		os.makedirs(directory, exist_ok=True)
+	output_callback = callback
+	if tarball is not None:
+		output_tar = tarfile.open(tarball, "w")
+
+
+# closeOutput() function finishes the tar file the plots were added to, if any.
+def closeOutput():
+	global output_tar
+	with output_lock:
+		if output_tar is not None:
+			output_tar.close()
+			output_tar = None
+
+
+# location() function describes where the plots are saved, for the messages of the scripts.
+def location():
+	if output_callback is not None:
+		return "memory"
+	if output_tar is not None:
+		return "the tar file " + output_tar.name
+	if output_dir is not None:
+		return "the directory " + output_dir
+	return "the current directory"
+
+
+# renderPlot(fig, format) function returns the bytes of the figure saved in the format.
+def renderPlot(fig, format=None):
+	buffer = io.BytesIO()
+	fig.savefig(buffer, format=format or output_format)
+	return buffer.getvalue()
+
+
+# savePlot(fig, name) function saves the figure in the chosen format and output, with the
+# name and the extension of the format as its file name, and returns the file name.
+def savePlot(fig, name):
+	fileName = name + "." + output_format
+	data = renderPlot(fig)
+	if collected is not None:
+		collected.append((fileName, data))
+	else:
+		deliver(fileName, data)
+	return fileName
+
+
+# deliver(fileName, data) function hands the bytes of a plot to the chosen output.
+def deliver(fileName, data):
+	if output_callback is not None:
+		output_callback(fileName, data)
+		return
+	if output_tar is not None:
+		info = tarfile.TarInfo(fileName)
+		info.size = len(data)
+		info.mtime = time.time()
+		with output_lock:
+			output_tar.addfile(info, io.BytesIO(data))
+		return
+
+# Write to a temporary file next to the plot and rename it over the plot in one step
+	directory = output_dir or "."
+	(handle, temporary) = tempfile.mkstemp(dir=directory, prefix="." + fileName + ".")
+	try:
+		with os.fdopen(handle, "wb") as f:
+			f.write(data)
+		os.chmod(temporary, file_mode)
+		os.replace(temporary, os.path.join(directory, fileName))
+	except BaseException:
+		os.remove(temporary)
+		raise
+
+
+# workerSettings() function returns what a worker process needs to save plots like this
+# process: the format, and the directory to write to or None to send the plots back.
+def workerSettings():
+	if output_callback is not None or output_tar is not None:
+		return (output_format, None, True)
+	return (output_format, output_dir, False)
+
+
+# initWorker(settings) function is run in each worker process with the settings of
+# workerSettings().
+def initWorker(settings):
+	global output_format, output_dir, output_tar, output_callback, collected
+	(output_format, output_dir, collect) = settings
+	output_tar = None
+	output_callback = None
+	collected = [] if collect else None
+
+
+# takeOutputs() function returns the plots saved by a worker process since it was last
+# called, for the main process to deliver.
+def takeOutputs():
+	global collected
+	if collected is None:
+		return []
+	(taken, collected) = (collected, [])
+	return taken
+
+
+# addOutputs(outputs) function delivers the plots sent back by a worker process.
+def addOutputs(outputs):
+	for (fileName, data) in outputs:
+		deliver(fileName, data)
@@ -0,0 +1,177 @@
+# Authorship: NCAR Earth Observing Laboratory Data Management & Services Group
+# Contact: eol-archive@ucar.edu
+#
+# Licensing: The code associated with this document is provided freely and openly.
+# Users are hereby granted a license to access and use this code, unless otherwise
+# stated, subject to the terms and conditions of the GNU Affero General Public
+# License 3.0 (AGPL-3.0; https://www.gnu.org/licenses/agpl-3.0.en.html). This
+# documentation and associated code are provided "as is" and are not supported.
+# By using or downloading this code, the user agrees to the terms and conditions
+# set forth in this code and in the "Using Python to View OPeNDAP Files" document.
+#
+# Acknowledgment: This work was sponsored by the National Science Foundation.
+# This material is based upon work supported by the National Center for Atmospheric
+# Research, a major facility sponsored by the National Science Foundation and managed
+# by the University Corporation for Atmospheric Research. Any opinions, findings
+# and conclusions or recommendations expressed in this material do not necessarily
+# reflect the views of the National Science Foundation.
+#
+# NOTE: This module only requires python3.
+#
+# The qcf_profile.py module measures where the time of a run of python_xy.py or
+# python_xyz.py goes (their --profile option). It is not run on its own.
+#
+# Each stage of the scripts is wrapped in stage(), which records when it started, how
+# long it took, the rows and bytes it handled (added with count()), and the peak memory
+# (RSS) of the process when it ended. The stages are:
+#	open_url: reading the DDS and DAS of the dataset, to offer its variables
+#	validate: checking whether the cached variables of a dataset are still current
+#	list: finding the stations or datetimes of the dataset(s) to offer
+#	download: receiving an OPeNDAP response (bytes)
+#	retry: waiting before trying a failed request again
+#	decode: decoding the rows of a response into numpy columns (rows)
+#	cache: reading variables from the on-disk cache (rows)
+#	index: grouping rows by station or datetime (rows)
+#	parse: converting dates and times to numpy datetime64 (rows)
+#	decimate: thinning out long records before plotting them (rows)
+#	rollup: summing up rows into hourly or daily statistics of each station (rows)
+#	plot: drawing a plot (e.g. plot_trisurf)
+#	grid: interpolating the rows of a datetime onto the grid of --grid-output (rows)
+#	save: saving a plot with savefig, or a frame of --grid-output
+#	export: writing the rows of a station or datetime to the --export file (rows)
+# Stages may be nested (e.g. the downloads of list), and the stages run by the worker
+# processes of --jobs are sent back to the main process along with their plots.
+#
+# When profiling is off, stage() and count() do nothing.
+#
+# The summary printed by report() adds up the calls of each stage. The file written by
+# writeTrace() is JSON holding the same summary under "stages" and every call under
+# "traceEvents", in the Trace Event Format of Chrome, so it can also be opened with
+# chrome://tracing or https://ui.perfetto.dev to see the stages on a timeline.
+#
+
+# Import necessary packages:
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+try:
+	import resource
+except ImportError:
+	resource = None
+
+
+# True when the stages are being recorded
+enabled = False
+
+# The recorded stages, and when profiling was turned on (time.perf_counter() seconds)
+events = []
+started = 0
+events_lock = threading.Lock()
+
+# The stages open in each thread, innermost last
+local = threading.local()
+
+
+# Functions:
+
+# setProfile(on) function turns profiling on or off and forgets the recorded stages.
+def setProfile(on=True):
+	global enabled, events, started
+	enabled = on
+	events = []
+	started = time.perf_counter()
+
+
+# peakRss() function returns the peak resident memory of this process so far in bytes,
+# or 0 where it can't be found.
+def peakRss():
+	if resource is None:
+		return 0
+	rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+# Linux reports kilobytes, macOS bytes
+	return rss if sys.platform == "darwin" else rss * 1024
+
+
+# stage(name) function records the time taken by the code in its with block as a call
+# of the named stage.
+@contextmanager
+def stage(name):
+	if not enabled:
+		yield
+		return
+	if not hasattr(local, "stack"):
+		local.stack = []
+	record = {"name": name, "rows": 0, "bytes": 0}
+	local.stack.append(record)
+	start = time.perf_counter()
+	try:
+		yield
+	finally:
+		record["start"] = start
+		record["seconds"] = time.perf_counter() - start
+		record["pid"] = os.getpid()
+		record["tid"] = threading.get_ident()
+		record["peak_rss"] = peakRss()
+		local.stack.pop()
+		with events_lock:
+			events.append(record)
+
+
+# count(rows, bytes) function adds rows and/or bytes to the innermost stage open in this
+# thread.
+def count(rows=0, bytes=0):
+	stack = getattr(local, "stack", None)
+	if stack:
+		stack[-1]["rows"] += int(rows)
+		stack[-1]["bytes"] += int(bytes)
+
+
+# takeEvents() function returns the recorded stages and forgets them, for a worker
+# process to send them to the main process.
+def takeEvents():
+	global events
+	with events_lock:
+		(taken, events) = (events, [])
+	return taken
+
+
+# addEvents(more) function adds the stages recorded by a worker process.
+def addEvents(more):
+	with events_lock:
+		events.extend(more)
+
+
+# summary() function adds up the recorded calls of each stage, in the order the stages
+# were first called, and returns a list of dictionaries.
+def summary():
+	stages = {}
+	for event in sorted(events, key=lambda i: i["start"]):
+		total = stages.setdefault(event["name"], {"name": event["name"], "calls": 0, "seconds": 0.0, "rows": 0, "bytes": 0, "peak_rss": 0})
+		total["calls"] += 1
+		total["seconds"] += event["seconds"]
+		total["rows"] += event["rows"]
+		total["bytes"] += event["bytes"]
+		total["peak_rss"] = max(total["peak_rss"], event["peak_rss"])
+	return list(stages.values())
+
+
+# report() function prints the summary of the recorded stages as a table.
+def report():
+	print("\n%-10s %7s %10s %12s %10s %14s" % ("stage", "calls", "seconds", "rows", "MB", "peak RSS (MB)"))
+	for total in summary():
+		print("%-10s %7d %10.3f %12d %10.1f %14.1f" % (total["name"], total["calls"], total["seconds"], total["rows"], total["bytes"] / 1e6, total["peak_rss"] / 1e6))
+	print("%-10s %7s %10.3f %12s %10s %14.1f" % ("total", "", time.perf_counter() - started, "", "", peakRss() / 1e6))
+	print("Nested stages (e.g. the downloads of list) are counted in both, and stages run by")
+	print("--jobs worker processes may overlap, so the stages may add up to more than the total.")
+	print("The peak RSS of the total is that of the main process only.")
+
+
+# writeTrace(fileName) function writes the summary and every recorded call to a JSON file
+# that can also be opened as a Chrome trace.
+def writeTrace(fileName):
+	trace = [{"name": event["name"], "cat": "qcf", "ph": "X", "ts": event["start"] * 1e6, "dur": event["seconds"] * 1e6, "pid": event["pid"], "tid": event["tid"], "args": {"rows": event["rows"], "bytes": event["bytes"], "peak_rss": event["peak_rss"]}} for event in events]
+	with open(fileName, "w") as f:
+		json.dump({"command": sys.argv, "seconds": time.perf_counter() - started, "peak_rss": peakRss(), "stages": summary(), "traceEvents": trace, "displayTimeUnit": "ms"}, f, indent=1)
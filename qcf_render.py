@@ -0,0 +1,275 @@
+# Authorship: NCAR Earth Observing Laboratory Data Management & Services Group
+# Contact: eol-archive@ucar.edu
+#
+# Licensing: The code associated with this document is provided freely and openly.
+# Users are hereby granted a license to access and use this code, unless otherwise
+# stated, subject to the terms and conditions of the GNU Affero General Public
+# License 3.0 (AGPL-3.0; https://www.gnu.org/licenses/agpl-3.0.en.html). This
+# documentation and associated code are provided "as is" and are not supported.
+# By using or downloading this code, the user agrees to the terms and conditions
+# set forth in this code and in the "Using Python to View OPeNDAP Files" document.
+#
+# Acknowledgment: This work was sponsored by the National Science Foundation.
+# This material is based upon work supported by the National Center for Atmospheric
+# Research, a major facility sponsored by the National Science Foundation and managed
+# by the University Corporation for Atmospheric Research. Any opinions, findings
+# and conclusions or recommendations expressed in this material do not necessarily
+# reflect the views of the National Science Foundation.
+#
+# NOTE: This module requires the following packages to be installed:
+#		python3
+#		matplotlib
+#		numpy
+#
+# The qcf_render.py module creates the plots of python_xy.py and python_xyz.py on
+# several processor cores at once (the --jobs option of the scripts). It is not run on
+# its own.
+#
+# Every plot (one station of python_xy.py, one datetime of python_xyz.py) is a task
+# handed to a pool of worker processes, each drawing with the non-interactive Agg
+# backend. The downloaded columns are not copied to every task: they are written once
+# to numpy .npy files in a temporary directory, and every worker opens them
+# memory-mapped and read-only, so all the workers share the same pages of memory.
+# Columns that are already whole .npy files of the on-disk cache (see qcf_cache.py) are
+# not written again: their files are linked into the directory instead, so they stay
+# there for the workers even if the cache replaces or evicts them meanwhile.
+# A task only carries the indices of its rows and its plot options.
+#
+# When profiling is turned on (the --profile option of the scripts, see qcf_profile.py),
+# every worker sends the stages it recorded back along with the result of each plot.
+# Likewise, when the plots go to a tar file or a callback (see qcf_output.py), every
+# worker sends the bytes of its plots back for the main process to save.
+#
+# In streaming mode (the --stream option of the scripts), the rows of each plot are
+# handed over as soon as they have all been downloaded, with renderGroups(). Such a task
+# carries its own (small) columns, and only a few tasks are kept waiting for the workers
+# at a time, so the memory used stays bounded.
+#
+# The workers are started with the forkserver (or spawn) method rather than forked, as
+# the pools are started after the downloads ran other threads (see qcf_fetch.fetchEach),
+# and forking a process that runs other threads can leave the child waiting forever on
+# a lock held by a thread that was not copied. Such workers don't share the settings of
+# the main process, so they are handed over when the pool starts.
+#
+# A long-running process (see qcf_service.py) starts one pool with startPool() before
+# it starts any threads, and every call then uses that pool instead of a pool of its
+# own. Every task for that pool carries the settings of its call, and a worker applies
+# them again when it runs the first task of another call.
+#
+# The module uses the following hard-coded entities that may need to be changed:
+#	tasks_per_chunk: The number of chunks of tasks given to each worker; smaller chunks
+#		spread uneven plots better, larger ones cost less to hand out
+#	tasks_per_worker: In streaming mode, the number of plots waiting for each worker
+#		before no more data is read
+# To change any of these values, simply search "HARD-CODED" in this module
+#
+
+# Import necessary packages:
+import itertools
+import multiprocessing
+import os
+import shutil
+import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import qcf_cache
+import qcf_output
+import qcf_profile
+
+
+#HARD-CODED
+tasks_per_chunk = 4
+tasks_per_worker = 2
+
+# Columns shared with a worker process, opened by initWorker()
+columns = None
+
+# Pool of worker processes kept from startPool() to closePool(), and its number of
+# processes
+pool = None
+pool_jobs = 1
+
+# Key of each call using the kept pool, and the key of the call whose settings were last
+# applied in a worker process (see runKept)
+call_keys = itertools.count()
+applied_key = None
+
+
+# Functions:
+
+# jobCount(jobs) function returns the number of worker processes to use for the --jobs
+# option: the number given, or one per processor core this process may run on for 0.
+def jobCount(jobs):
+	if not jobs:
+		if hasattr(os, "sched_getaffinity"):
+			return len(os.sched_getaffinity(0))
+		return os.cpu_count() or 1
+	return max(1, int(jobs))
+
+
+# workerContext() function returns the multiprocessing context the worker processes are
+# started with: forkserver where available, and spawn otherwise.
+def workerContext():
+	method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+	return multiprocessing.get_context(method)
+
+
+# startPool(jobs) function starts the pool of that many worker processes (see jobCount)
+# used by every call until closePool(), with the forkserver method where available and
+# spawn otherwise. With a single job, no pool is started and the plots are created one
+# at a time in the calling thread.
+def startPool(jobs):
+	global pool, pool_jobs
+	closePool()
+	pool_jobs = jobCount(jobs)
+	if pool_jobs > 1:
+		pool = ProcessPoolExecutor(pool_jobs, mp_context=workerContext(), initializer=initWorker)
+
+
+# closePool() function stops the worker processes started by startPool(), if any.
+def closePool():
+	global pool, pool_jobs
+	if pool is not None:
+		pool.shutdown()
+	pool = None
+	pool_jobs = 1
+
+
+# linkColumn(column, path) function links the .npy file of the on-disk cache that a
+# memory-mapped column was loaded from (see qcf_cache.loadColumns) to the path, and
+# returns True, if the column is the whole file and the file can be linked there.
+def linkColumn(column, path):
+	source = getattr(column, "filename", None)
+	if not isinstance(column, np.memmap) or source is None or qcf_cache.cache_dir is None:
+		return False
+	with qcf_cache.lockCache():
+		try:
+			whole = np.load(source, mmap_mode="r")
+			if whole.shape != column.shape or whole.dtype != column.dtype or whole.strides != column.strides:
+				return False
+			os.link(source, path)
+		except (OSError, ValueError):
+			return False
+	return True
+
+
+# shareColumns(columns, directory) function puts a .npy file of each column in the
+# directory for the worker processes to open, linking the files of the on-disk cache
+# and writing the other columns.
+def shareColumns(columns, directory):
+	for (name, column) in columns.items():
+		path = os.path.join(directory, name + ".npy")
+		if not linkColumn(column, path):
+			np.save(path, np.ascontiguousarray(column))
+
+
+# initWorker(profiling, output, directory, names) function is run once in each worker
+# process. It selects the Agg backend, turns profiling on or off and saves the plots like
+# in the main process (see qcf_output.workerSettings), and opens the shared columns
+# memory-mapped and read-only.
+def initWorker(profiling=False, output=None, directory=None, names=()):
+	global columns
+	import matplotlib
+	matplotlib.use("Agg")
+	qcf_profile.setProfile(profiling)
+	if output is not None:
+		qcf_output.initWorker(output)
+	columns = dict((name, np.load(os.path.join(directory, name + ".npy"), mmap_mode="r")) for name in names)
+
+
+# runTask(task) function creates one plot in a worker process by calling the plotting
+# function with the shared columns and the options of the task. It returns the result,
+# the stages recorded while creating the plot and the plot if it is to be sent back.
+def runTask(task):
+	(func, options) = task
+	return func(columns=columns, **options), qcf_profile.takeEvents(), qcf_output.takeOutputs()
+
+
+# runGroup(task) function creates one plot in a worker process from the columns of the
+# task, and returns the result, the stages recorded while creating it and the plot if it
+# is to be sent back.
+def runGroup(task):
+	(func, options, columns) = task
+	return func(columns=columns, **options), qcf_profile.takeEvents(), qcf_output.takeOutputs()
+
+
+# runKept(task) function runs a task of a call on a worker of the kept pool with run()
+# (runTask or runGroup), after applying the settings of the call (the arguments of
+# initWorker) unless the worker already did.
+def runKept(task):
+	global applied_key
+	(run, key, settings, job) = task
+	if key != applied_key:
+		initWorker(*settings)
+		applied_key = key
+	return run(job)
+
+
+# workerResult(returned) function keeps the stages recorded by a worker process, saves
+# the plot it sent back, if any, and returns the result of its plot.
+def workerResult(returned):
+	(result, events, outputs) = returned
+	qcf_profile.addEvents(events)
+	qcf_output.addOutputs(outputs)
+	return result
+
+
+# renderPlots(func, tasks, columns, jobs) function calls the plotting function once for
+# each task (a dict of its arguments other than columns) and returns the results in
+# the order of the tasks. With more than one job, the calls are spread over that many
+# worker processes sharing the columns, those of the kept pool if one was started.
+def renderPlots(func, tasks, columns, jobs=1):
+	jobs = min(pool_jobs if pool is not None else jobCount(jobs), len(tasks))
+	if jobs <= 1:
+		return [func(columns=columns, **options) for options in tasks]
+
+	directory = tempfile.mkdtemp(prefix="qcf_render_")
+	try:
+		shareColumns(columns, directory)
+		chunksize = max(1, len(tasks) // (jobs * tasks_per_chunk))
+		settings = (qcf_profile.enabled, qcf_output.workerSettings(), directory, list(columns))
+		tasks = [(func, options) for options in tasks]
+		if pool is not None:
+			key = next(call_keys)
+			return [workerResult(i) for i in pool.map(runKept, [(runTask, key, settings, task) for task in tasks], chunksize=chunksize)]
+		with ProcessPoolExecutor(jobs, mp_context=workerContext(), initializer=initWorker, initargs=settings) as workers:
+			return [workerResult(i) for i in workers.map(runTask, tasks, chunksize=chunksize)]
+	finally:
+		shutil.rmtree(directory, ignore_errors=True)
+
+
+# waitGroups(func, groups, jobs, submit) function hands each (options, columns) pair
+# yielded by groups to submit() as a task of runGroup, and yields the options and the
+# result of each plot in the same order, reading groups ahead by a few plots only.
+def waitGroups(func, groups, jobs, submit):
+	waiting = deque()
+	for (options, columns) in groups:
+		waiting.append((options, submit((func, options, columns))))
+		while len(waiting) > jobs * tasks_per_worker:
+			(done, future) = waiting.popleft()
+			yield done, workerResult(future.result())
+	while waiting:
+		(done, future) = waiting.popleft()
+		yield done, workerResult(future.result())
+
+
+# renderGroups(func, groups, jobs) function calls the plotting function for each (options,
+# columns) pair yielded by groups as soon as it is yielded, and yields the options and
+# the result of each call in the same order. With more than one job, the calls are
+# spread over that many worker processes (those of the kept pool if one was started),
+# and groups is only read ahead by a few plots.
+def renderGroups(func, groups, jobs=1):
+	jobs = pool_jobs if pool is not None else jobCount(jobs)
+	if jobs <= 1:
+		for (options, columns) in groups:
+			yield options, func(columns=columns, **options)
+		return
+
+	settings = (qcf_profile.enabled, qcf_output.workerSettings())
+	if pool is not None:
+		key = next(call_keys)
+		yield from waitGroups(func, groups, jobs, lambda task: pool.submit(runKept, (runGroup, key, settings, task)))
+		return
+	with ProcessPoolExecutor(jobs, mp_context=workerContext(), initializer=initWorker, initargs=settings) as workers:
+		yield from waitGroups(func, groups, jobs, lambda task: workers.submit(runGroup, task))
@@ -0,0 +1,183 @@
+# Authorship: NCAR Earth Observing Laboratory Data Management & Services Group
+# Contact: eol-archive@ucar.edu
+#
+# Licensing: The code associated with this document is provided freely and openly.
+# Users are hereby granted a license to access and use this code, unless otherwise
+# stated, subject to the terms and conditions of the GNU Affero General Public
+# License 3.0 (AGPL-3.0; https://www.gnu.org/licenses/agpl-3.0.en.html). This
+# documentation and associated code are provided "as is" and are not supported.
+# By using or downloading this code, the user agrees to the terms and conditions
+# set forth in this code and in the "Using Python to View OPeNDAP Files" document.
+#
+# Acknowledgment: This work was sponsored by the National Science Foundation.
+# This material is based upon work supported by the National Center for Atmospheric
+# Research, a major facility sponsored by the National Science Foundation and managed
+# by the University Corporation for Atmospheric Research. Any opinions, findings
+# and conclusions or recommendations expressed in this material do not necessarily
+# reflect the views of the National Science Foundation.
+#
+# NOTE: This module requires the following packages to be installed:
+#		python3
+#		numpy
+#
+# The qcf_rollup.py module sums up the rows of a QCF dataset into hourly or daily
+# statistics of each station, for the --rollup option of python_xy.py. It is not run on
+# its own.
+#
+# The rows are grouped by station and by period (the hour or day they fall in, UTC) in
+# one vectorized pass, and the mean, minimum, maximum and number of the values of each
+# variable are worked out for every group. Missing values are left out; a period
+# without any value of a variable has a NaN mean, minimum and maximum and a count of 0.
+# The result has the same form as the downloaded columns: a network_name,
+# platform_name, date and time (the start of the period) for every station and period,
+# sorted by station and then by time, and one column per variable and statistic named
+# {variable}_{statistic} (e.g. temp_air_mean), so it can be plotted like raw rows.
+#
+# When the on-disk cache of qcf_cache.py is turned on, the statistics of every station
+# and period of the whole dataset are saved in the cache next to the variables they
+# were worked out from (as the variables "rollup-{period}.{name}"), and later runs read
+# them instead of the rows: a season of 1-minute data of a station is a few thousand
+# daily statistics. They are dropped along with the variables when the dataset changes
+# on the server, and worked out again from the cached rows after an --incremental
+# update. Without the cache, the statistics are worked out from the rows of the chosen
+# stations and time window on every run. Either way, a time window is widened to whole
+# periods, so the first and last periods have the same statistics as any other.
+#
+# The statistics are worked out here rather than by the server: the OPeNDAP (DAP2)
+# protocol of the QCF datasets can only select rows and variables, not aggregate them,
+# so the rows of the window are downloaded (or read from the cache) and summed up
+# locally.
+#
+# The module uses the following hard-coded entities that may need to be changed:
+#	rollup_periods: The periods the rows can be summed up by, and their length in seconds
+#	statistics: The statistics worked out for each variable
+#	variable names: The module assumes that the variable names from the OPeNDAP file
+#		are "date", "time", "network_name", "platform_name"
+# To change any of these values, simply search "HARD-CODED" in this module
+#
+
+# Import necessary packages:
+from datetime import timedelta
+import numpy as np
+import qcf_cache
+from qcf_fetch import fetchColumns, inTimeWindow, selectStations, selectTimeWindow, subsetColumns, toDateTime64, validateCache
+from qcf_index import stationKeys
+from qcf_profile import count, stage
+
+
+#HARD-CODED
+rollup_periods = {"hourly": 3600, "daily": 86400}
+statistics = ["mean", "min", "max", "count"]
+
+# The fields every rollup has, naming the station and the start of the period of each row
+key_fields = ["network_name", "platform_name", "date", "time"] # HARD-CODED
+
+
+# Functions:
+
+# statName(var, statistic) function returns the name of the column holding a statistic of
+# a variable.
+def statName(var, statistic):
+	return var + "_" + statistic
+
+
+# rollupColumns(columns, vars, period) function returns the statistics of the variables in
+# the columns for each station and period (e.g. "hourly"), as described above.
+def rollupColumns(columns, vars, period):
+	with stage("rollup"):
+		count(rows=len(columns["date"]))
+		seconds = rollup_periods[period]
+
+# Leave out the rows whose date or time can't be read
+		dateTimes = toDateTime64(columns["date"], columns["time"])
+		columns = subsetColumns(columns, ~np.isnat(dateTimes))
+		bins = dateTimes[~np.isnat(dateTimes)].astype(np.int64) // seconds
+		low = bins.min() if len(bins) else 0
+
+# One number per station and period, ordered by station and then by period
+		stations = np.unique(stationKeys(columns), return_inverse=True)[1].reshape(-1)
+		span = bins.max() - low + 1 if len(bins) else 1
+		(groups, first, group) = np.unique(stations * span + (bins - low), return_index=True, return_inverse=True)
+		group = group.reshape(-1)
+		order = np.argsort(group, kind="stable")
+		starts = np.flatnonzero(np.concatenate(([True], group[order][1:] != group[order][:-1]))) if len(group) else np.zeros(0, dtype=np.intp)
+
+# The station and the start of the period of each group, as QCF dates and times
+		begins = np.datetime_as_string((bins[first] * seconds).astype("datetime64[s]"), unit="s").astype("S19")
+		chars = begins.view("S1").reshape(len(first), 19)
+		days = chars[:, :10].copy()
+		days[:, [4, 7]] = b"/"
+		result = {
+			"network_name": columns["network_name"][first],
+			"platform_name": columns["platform_name"][first],
+			"date": days.view("S10").reshape(-1),
+			"time": np.ascontiguousarray(chars[:, 11:]).view("S8").reshape(-1),
+		}
+
+# Sum up each variable, leaving out its missing values
+		for var in vars:
+			values = np.asarray(columns[var], dtype=np.float64)
+			valid = ~np.isnan(values)
+			n = np.bincount(group[valid], minlength=len(groups))
+			total = np.bincount(group[valid], weights=values[valid], minlength=len(groups))
+			with np.errstate(divide="ignore", invalid="ignore"):
+				result[statName(var, "mean")] = np.where(n > 0, total / n, np.nan)
+			if len(group):
+				with np.errstate(invalid="ignore"):
+					result[statName(var, "min")] = np.fmin.reduceat(values[order], starts)
+					result[statName(var, "max")] = np.fmax.reduceat(values[order], starts)
+			else:
+				result[statName(var, "min")] = result[statName(var, "max")] = np.zeros(0)
+			result[statName(var, "count")] = n
+		return result
+
+
+# cachedRollup(url, vars, period) function returns the statistics of the variables of every
+# station and period of the dataset at the OPeNDAP link. They are read from the on-disk
+# cache, or worked out from the (cached) rows of the whole dataset and saved there.
+def cachedRollup(url, vars, period):
+	validateCache(url)
+	prefix = "rollup-" + period + "."
+	names = key_fields + [statName(var, statistic) for var in vars for statistic in statistics]
+	cached = set(qcf_cache.cachedFields(url))
+	if all(prefix + name in cached for name in names):
+		saved = qcf_cache.loadColumns(url, [prefix + name for name in names])
+		return dict((name, saved[prefix + name]) for name in names)
+	rollup = rollupColumns(fetchColumns(url, key_fields + vars), vars, period)
+	qcf_cache.storeColumns(url, dict((prefix + name, column) for (name, column) in rollup.items()))
+	return rollup
+
+
+# periodStart(when, period) function returns the start of the period a datetime falls in.
+def periodStart(when, period):
+	seconds = rollup_periods[period]
+	day = when.replace(hour=0, minute=0, second=0, microsecond=0)
+	return day + timedelta(seconds=(when - day).seconds // seconds * seconds)
+
+
+# periodWindow(start, end, period) function returns the time window widened to whole
+# periods: from the start of the period the start falls in to the end of the period the
+# end falls in. Either of them can be None for no limit.
+def periodWindow(start, end, period):
+	if start is not None:
+		start = periodStart(start, period)
+	if end is not None:
+		end = periodStart(end, period) + timedelta(seconds=rollup_periods[period] - 1)
+	return start, end
+
+
+# fetchRollup(url, vars, period, stations, start, end, every) function returns the
+# statistics of the variables for the given stations and the periods of the time window
+# (all of them if no window is given) of the dataset at the OPeNDAP link, from the cache
+# if it is turned on, or from the rows of the stations and window otherwise. On both
+# paths the periods at the ends of the window are whole (see periodWindow): their
+# statistics include the rows just outside of the window. When every is True, stations
+# holds every station of the dataset, which are then not named in the request.
+def fetchRollup(url, vars, period, stations, start=None, end=None, every=False):
+	(start, end) = periodWindow(start, end, period)
+	if qcf_cache.cache_dir is not None:
+		columns = cachedRollup(url, vars, period)
+		keep = np.isin(stationKeys(columns), np.array(stations, dtype="S")) & inTimeWindow(columns["date"], columns["time"], start, end)
+		return subsetColumns(columns, keep)
+	columns = fetchColumns(url, key_fields + vars, ([] if every else selectStations(stations)) + selectTimeWindow("date", start, end)) # HARD-CODED
+	return rollupColumns(subsetColumns(columns, inTimeWindow(columns["date"], columns["time"], start, end)), vars, period)
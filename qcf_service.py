@@ -0,0 +1,423 @@
+# Authorship: NCAR Earth Observing Laboratory Data Management & Services Group
+# Contact: eol-archive@ucar.edu
+#
+# Licensing: The code associated with this document is provided freely and openly.
+# Users are hereby granted a license to access and use this code, unless otherwise
+# stated, subject to the terms and conditions of the GNU Affero General Public
+# License 3.0 (AGPL-3.0; https://www.gnu.org/licenses/agpl-3.0.en.html). This
+# documentation and associated code are provided "as is" and are not supported.
+# By using or downloading this code, the user agrees to the terms and conditions
+# set forth in this code and in the "Using Python to View OPeNDAP Files" document.
+#
+# Acknowledgment: This work was sponsored by the National Science Foundation.
+# This material is based upon work supported by the National Center for Atmospheric
+# Research, a major facility sponsored by the National Science Foundation and managed
+# by the University Corporation for Atmospheric Research. Any opinions, findings
+# and conclusions or recommendations expressed in this material do not necessarily
+# reflect the views of the National Science Foundation.
+#
+# To run this script, use the following command:
+#		python3 qcf_service.py --port 8760
+# and ask it for plots of any QCF dataset over HTTP, e.g.
+#		curl -o plot.png "http://127.0.0.1:8760/xy?url={OPeNDAP link}&vars=temp_air,dew_point&station=ASOS-KICT&ylabel=Degrees%20(celsius)"
+#
+# The following options may be added:
+#		--port N		Port to listen on, 8760 by default
+#		--host HOST		Address to listen on, 127.0.0.1 (this machine only)
+#					by default
+#		--memory GB		Size limit of the variables kept in memory, 4 GB by
+#					default
+#		--jobs N		Number of processes creating the plots, started once
+#					before serving, 0 for one per core; by default
+#					the plots are created one at a time on a single
+#					thread
+#		--cache-dir DIR		Also keep the downloaded variables in the on-disk cache
+#					(see qcf_cache.py), so a restarted service doesn't
+#					download them again
+#		--cache-size GB		Size limit of the on-disk cache, 2 GB by default
+#
+# NOTE: This script requires the same packages as python_xy.py and python_xyz.py.
+#
+# The qcf_service.py script runs python_xy.py and python_xyz.py as a long-running
+# service, for quick looks at the data. A run of the scripts starts python, imports
+# matplotlib and downloads the variables of the plots before drawing anything;
+# the service does all of that once and keeps the downloaded variables of each dataset
+# in memory, along with the grouping of their rows by station and by datetime (see
+# qcf_index.py), and the figures of the scripts (see --new-figures). Later plots of the
+# same dataset are only drawn.
+#
+# The service answers the following requests (GET, with the options in the query
+# string):
+#	/xy: the plots of python_xy.py, with the options
+#		url: OPeNDAP link to the dataset (repeat for several datasets)
+#		vars: variable(s) to plot, separated by commas
+#		station: station(s) to plot, named network_name-platform_name, separated by commas
+#		ylabel: label on the y-axis
+#		start, end: time window, YYYY/mm/dd-HH:MM or YYYY/mm/dd (UTC)
+#		decimate: 1 to thin out long records (see python_xy.py --decimate)
+#		format: png (the default), svg or pdf
+#	/xyz: the plots of python_xyz.py, with the options
+#		url: OPeNDAP link to the dataset (repeat for several datasets)
+#		var: variable to plot
+#		datetime: datetime(s) to plot, YYYY/mm/dd-HH:MM (UTC), separated by commas
+#		time: nominal (the default) or actual
+#		zlabel: label on the z-axis
+#		format: png (the default), svg or pdf
+#	/vars: the fields of the dataset at url, with their type, attributes (e.g. units)
+#		and whether they can be plotted, read from its metadata (see qcf_meta.py), as
+#		a JSON list
+#	/stations: the stations of the dataset at url, as a JSON list
+#	/datetimes: the datetimes of the dataset at url (with time as for /xyz) that have
+#		enough data points for a plot of python_xyz.py, as a JSON list
+#	/status: the datasets kept in memory and the number of waiting requests, as JSON
+# A request for one plot is answered with the plot; a request for several with a tar
+# file of the plots. Requests without any data to plot are answered with 404.
+#
+# The requests are put in a queue and answered one at a time by a single thread, as
+# matplotlib can only draw one figure at a time in a process. The plots of a request
+# can be spread over several processes with --jobs: one pool of processes is started
+# before the server starts any threads (see qcf_render.startPool) and used by every
+# request. Without --jobs, the plots are created one at a time by the same thread. When queue_limit requests are
+# already waiting, new requests are answered with 503.
+#
+# The variables kept in memory are checked against the server (like the on-disk cache)
+# when they are used and more than refresh_interval seconds have passed since the last
+# check, and downloaded again if the dataset changed. When they take more than the size
+# limit, the datasets used the longest ago are dropped.
+#
+# The script uses the following hard-coded entities that may need to be changed:
+#	memory_limit: The size limit of the variables kept in memory
+#	refresh_interval: How often the variables kept in memory are checked against the
+#		server, in seconds
+#	queue_limit: The number of requests that may wait to be answered
+#	content_types: The content type sent with the plots of each format
+# To change any of these values, simply search "HARD-CODED" in this script
+#
+
+# Import necessary packages:
+import argparse
+import io
+import json
+import queue
+import tarfile
+import threading
+import time
+import traceback
+from concurrent.futures import Future
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+# Plots are only sent back over HTTP, so use the non-interactive backend
+import matplotlib
+matplotlib.use("Agg")
+
+import numpy as np
+import python_xy
+import python_xyz
+import qcf_cache
+import qcf_output
+import qcf_render
+from qcf_fetch import datasetValidator, fetchColumns, inTimeWindow, parseDateTime, subsetColumns, toDateTime64, toStr
+from qcf_index import dateTimeKeys, groupRows, key_format, rowsOf, stationKeys
+from qcf_meta import describeDataset
+
+
+#HARD-CODED
+memory_limit = 4 * 1024**3
+refresh_interval = 60
+queue_limit = 16
+content_types = {"png": "image/png", "svg": "image/svg+xml", "pdf": "application/pdf"}
+
+# The datasets kept in memory, keyed by OPeNDAP link, the datasets used the longest ago
+# first. Each holds its downloaded columns, the groupings of its rows, the validator of
+# the dataset (see qcf_fetch.datasetValidator) and when it was last checked.
+datasets = {}
+
+# The requests waiting to be answered, and the number of processes creating the plots
+# of each
+requests = queue.Queue(queue_limit)
+jobs = 1
+
+
+# Functions:
+
+# openDataset(url) function returns the dataset at the OPeNDAP link kept in memory,
+# dropping its columns first if the dataset changed on the server since they were
+# downloaded.
+def openDataset(url):
+	dataset = datasets.pop(url, None)
+	if dataset is None or time.time() - dataset["checked"] > refresh_interval:
+		validator = datasetValidator(url)
+		if dataset is None or dataset["validator"] != validator:
+			dataset = {"columns": {}, "indexes": {}, "validator": validator}
+# Check the on-disk cache against the server too, as it is only checked once per run
+			if qcf_cache.cache_dir is not None:
+				qcf_cache.checkDataset(url, validator)
+		dataset["checked"] = time.time()
+	datasets[url] = dataset
+	return dataset
+
+
+# warmColumns(url, fields) function returns every row of the given fields of the dataset at
+# the OPeNDAP link, downloading only the fields that are not kept in memory yet.
+def warmColumns(url, fields):
+	dataset = openDataset(url)
+	missingFields = [i for i in fields if i not in dataset["columns"]]
+	if missingFields:
+		dataset["columns"].update(fetchColumns(url, missingFields))
+		evict()
+	return dict((name, dataset["columns"][name]) for name in fields)
+
+
+# warmIndex(url, name, fields, keysOf) function returns the rows of the dataset at the
+# OPeNDAP link grouped by the keys keysOf() makes from the given fields, building the
+# grouping the first time it is asked for.
+def warmIndex(url, name, fields, keysOf):
+	columns = warmColumns(url, fields)
+	indexes = datasets[url]["indexes"]
+	if name not in indexes:
+		indexes[name] = groupRows(keysOf(columns))
+		evict()
+	return indexes[name]
+
+
+# datasetSize(dataset) function returns the bytes taken by the columns and groupings of a
+# dataset kept in memory.
+def datasetSize(dataset):
+	return sum(i.nbytes for i in dataset["columns"].values()) + sum(i.nbytes for index in dataset["indexes"].values() for i in index.values())
+
+
+# evict() function drops the datasets used the longest ago until the ones kept in memory
+# fit within memory_limit. The dataset used last is always kept.
+def evict():
+	while len(datasets) > 1 and sum(datasetSize(i) for i in datasets.values()) > memory_limit:
+		del datasets[next(iter(datasets))]
+
+
+# stationColumns(url, fields, stations, start, end) function returns the columns of the dataset at the
+# OPeNDAP link holding every desired variable, keeping only the rows of the desired
+# station(s) within the time window.
+def stationColumns(url, fields, stations, start=None, end=None):
+	index = warmIndex(url, "stations", ["network_name", "platform_name"], stationKeys) # HARD-CODED
+	rows = np.sort(np.concatenate([rowsOf(index, station) for station in stations]))
+	columns = subsetColumns(warmColumns(url, fields), rows)
+	return subsetColumns(columns, inTimeWindow(columns["date"], columns["time"], start, end)) # HARD-CODED
+
+
+# timeColumns(url, fields, datetimes, timeToUse) function returns the columns of the
+# dataset at the OPeNDAP link holding every desired variable, keeping only the rows at
+# the desired datetime(s).
+def timeColumns(url, fields, datetimes, timeToUse):
+	(dateVar, timeVar) = python_xyz.getDateTimeVars(timeToUse)
+	index = warmIndex(url, timeToUse, [dateVar, timeVar], lambda columns: dateTimeKeys(columns[dateVar], columns[timeVar]))
+	rows = np.sort(np.concatenate([rowsOf(index, datetime.strftime(key_format)) for datetime in datetimes]))
+	return subsetColumns(warmColumns(url, fields), rows)
+
+
+# option(params, name, default) function returns the value of an option of a request, or
+# the default if it wasn't given.
+def option(params, name, default=None):
+	return params.get(name, [default])[-1]
+
+
+# required(params, name) function returns the values of an option of a request that must
+# be given, split at commas.
+def required(params, name):
+	if name not in params:
+		raise ValueError("Missing option: " + name)
+	return python_xy.splitList(params[name])
+
+
+# timeOption(params) function returns the choice of nominal or actual time of a request.
+def timeOption(params):
+	timeToUse = option(params, "time", "nominal")
+	if timeToUse not in ("nominal", "actual"):
+		raise ValueError("Invalid time entered: " + timeToUse + " (use nominal or actual)")
+	return timeToUse
+
+
+# renderRequest(params, render) function creates the plots of a request in the format it
+# asks for by calling render(url, prefix) for each of its datasets, and returns the
+# names and bytes of the plots.
+def renderRequest(params, render):
+	urls = required(params, "url")
+	plots = []
+	qcf_output.setOutput(option(params, "format", "png"), callback=lambda fileName, data: plots.append((fileName, data)))
+	try:
+		for url in urls:
+			list(render(url, python_xy.filePrefix(urls, url)))
+	finally:
+		qcf_output.setOutput()
+	return plots
+
+
+# plotXy(params) function creates the plots of a /xy request.
+def plotXy(params):
+	vars = required(params, "vars")
+	stations = required(params, "station")
+	for i in python_xy.invalidStations(stations):
+		raise ValueError("Invalid station entered: " + i + " (name stations network_name-platform_name)")
+	y_label = option(params, "ylabel", "")
+	start = parseDateTime(params["start"][-1]) if "start" in params else None
+	end = parseDateTime(params["end"][-1], end=True) if "end" in params else None
+	decimate = option(params, "decimate", "0") == "1"
+	fields = ["network_name", "platform_name", "date", "time"] + vars # HARD-CODED
+	def render(url, prefix):
+		return python_xy.renderStations(stationColumns(url, fields, stations, start, end), vars, stations, y_label, jobs, prefix, decimate)
+	return renderRequest(params, render)
+
+
+# plotXyz(params) function creates the plots of a /xyz request.
+def plotXyz(params):
+	var = required(params, "var")[0]
+	datetimes = [parseDateTime(i) for i in required(params, "datetime")]
+	timeToUse = timeOption(params)
+	z_label = option(params, "zlabel", "")
+	(dateVar, timeVar) = python_xyz.getDateTimeVars(timeToUse)
+	fields = [dateVar, timeVar, "latitude", "longitude", var] # HARD-CODED
+	def render(url, prefix):
+		return python_xyz.renderTimes(timeColumns(url, fields, datetimes, timeToUse), var, datetimes, timeToUse, z_label, jobs, prefix)
+	return renderRequest(params, render)
+
+
+# listVars(params) function returns the fields of the dataset of a /vars request.
+def listVars(params):
+	return describeDataset(required(params, "url")[0])
+
+
+# listStations(params) function returns the stations of the dataset of a /stations request.
+def listStations(params):
+	index = warmIndex(required(params, "url")[0], "stations", ["network_name", "platform_name"], stationKeys) # HARD-CODED
+	return list(toStr(index["keys"]))
+
+
+# listDateTimes(params) function returns the datetimes of the dataset of a /datetimes
+# request that have at least 3 data points.
+def listDateTimes(params):
+	timeToUse = timeOption(params)
+	(dateVar, timeVar) = python_xyz.getDateTimeVars(timeToUse)
+	index = warmIndex(required(params, "url")[0], timeToUse, [dateVar, timeVar], lambda columns: dateTimeKeys(columns[dateVar], columns[timeVar]))
+	keys = index["keys"][np.diff(index["offsets"]) > 2]
+	return [i.item().strftime("%Y/%m/%d-%H:%M") for i in toDateTime64(keys, keys, timeOffset=10)]
+
+
+# status(params) function returns the datasets kept in memory and the number of waiting
+# requests.
+def status(params):
+	return {"datasets": [{"url": url, "rows": len(next(iter(dataset["columns"].values()), [])), "fields": list(dataset["columns"]), "bytes": datasetSize(dataset)} for (url, dataset) in datasets.items()], "waiting": requests.qsize()}
+
+
+# The function answering each kind of request
+handlers = {"/xy": plotXy, "/xyz": plotXyz, "/vars": listVars, "/stations": listStations, "/datetimes": listDateTimes, "/status": status}
+
+
+# serveRequests() function answers the requests in the queue one at a time, forever.
+def serveRequests():
+	while True:
+		(func, params, future) = requests.get()
+		try:
+			future.set_result(func(params))
+		except Exception as e:
+			future.set_exception(e)
+
+
+# app(environ, start_response) function is the WSGI application of the service. It puts
+# each request in the queue and waits for its answer.
+def app(environ, start_response):
+	clock = time.perf_counter()
+	path = environ.get("PATH_INFO", "").rstrip("/")
+	if path not in handlers:
+		start_response("404 Not Found", [("Content-Type", "text/plain")])
+		return [b"Not found, use /xy, /xyz, /vars, /stations, /datetimes or /status"]
+	future = Future()
+	try:
+		requests.put_nowait((handlers[path], parse_qs(environ.get("QUERY_STRING", "")), future))
+	except queue.Full:
+		start_response("503 Service Unavailable", [("Content-Type", "text/plain"), ("Retry-After", "1")])
+		return [b"Too many requests are waiting, try again later"]
+	try:
+		result = future.result()
+	except ValueError as e:
+		start_response("400 Bad Request", [("Content-Type", "text/plain")])
+		return [str(e).encode("utf-8")]
+	except Exception as e:
+# Print where the request failed, as only the error itself is sent back
+		print("%s %s: 500 Internal Server Error in %.3f s" % (path, environ.get("QUERY_STRING", ""), time.perf_counter() - clock))
+		traceback.print_exception(type(e), e, e.__traceback__)
+		start_response("500 Internal Server Error", [("Content-Type", "text/plain")])
+		return [(type(e).__name__ + ": " + str(e)).encode("utf-8")]
+
+# Send back lists as JSON, one plot as is and several plots as a tar file
+	if not isinstance(result, list) or not result or not isinstance(result[0], tuple):
+		(body, headers) = (json.dumps(result).encode("utf-8"), [("Content-Type", "application/json")])
+	elif len(result) == 1:
+		(fileName, body) = result[0]
+		headers = [("Content-Type", content_types[fileName.rsplit(".", 1)[-1]]), ("Content-Disposition", 'inline; filename="' + fileName + '"')]
+	else:
+		buffer = io.BytesIO()
+		with tarfile.open(fileobj=buffer, mode="w") as tar:
+			for (fileName, data) in result:
+				info = tarfile.TarInfo(fileName)
+				info.size = len(data)
+				info.mtime = time.time()
+				tar.addfile(info, io.BytesIO(data))
+		(body, headers) = (buffer.getvalue(), [("Content-Type", "application/x-tar"), ("Content-Disposition", 'attachment; filename="plots.tar"')])
+	if path in ("/xy", "/xyz") and not result:
+		(body, headers, answer) = (b"No data found, no plot created", [("Content-Type", "text/plain")], "404 Not Found")
+	else:
+		answer = "200 OK"
+	print("%s %s: %s in %.3f s" % (path, environ.get("QUERY_STRING", ""), answer, time.perf_counter() - clock))
+	start_response(answer, headers + [("Content-Length", str(len(body)))])
+	return [body]
+
+
+# Server that answers each request in its own thread, so requests can wait in the queue
+class ThreadingServer(ThreadingMixIn, WSGIServer):
+	daemon_threads = True
+
+
+# Request handler that does not print every request, as app() prints its own line
+class QuietHandler(WSGIRequestHandler):
+	def log_message(self, *args):
+		pass
+
+
+# makeServer(host, port) function returns the server of the service on the given address
+# (port 0 for any free port) and starts the thread answering its requests. Call its
+# serve_forever() method to start it.
+def makeServer(host, port):
+	threading.Thread(target=serveRequests, daemon=True).start()
+	return make_server(host, port, app, server_class=ThreadingServer, handler_class=QuietHandler)
+
+
+# main(argv) function runs the service until it is interrupted.
+def main(argv=None):
+	global memory_limit, jobs
+	parser = argparse.ArgumentParser(description="Serve the plots of python_xy.py and python_xyz.py over HTTP, keeping the datasets in memory.")
+	parser.add_argument("--port", type=int, default=8760, help="port to listen on")
+	parser.add_argument("--host", default="127.0.0.1", help="address to listen on")
+	parser.add_argument("--memory", type=float, help="size limit of the variables kept in memory in GB, 4 GB by default")
+	parser.add_argument("--jobs", type=int, default=1, help="number of processes creating the plots, started once before serving, 0 for one per processor core (by default the plots are created one at a time on a single thread)")
+	parser.add_argument("--cache-dir", help="directory of the on-disk cache of downloaded variables")
+	parser.add_argument("--cache-size", type=float, help="size limit of the on-disk cache in GB")
+	args = parser.parse_args(argv)
+	if args.memory:
+		memory_limit = int(args.memory * 1024**3)
+	jobs = args.jobs
+	if args.cache_dir:
+		qcf_cache.setCache(args.cache_dir, args.cache_size * 1024**3 if args.cache_size else None)
+
+	qcf_render.startPool(jobs)
+	try:
+		server = makeServer(args.host, args.port)
+		print("Serving plots at http://" + args.host + ":" + str(server.server_port) + "/")
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		qcf_render.closePool()
+
+
+if __name__ == "__main__":
+	main()
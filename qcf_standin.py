@@ -0,0 +1,397 @@
+# Authorship: NCAR Earth Observing Laboratory Data Management & Services Group
+# Contact: eol-archive@ucar.edu
+#
+# Licensing: The code associated with this document is provided freely and openly.
+# Users are hereby granted a license to access and use this code, unless otherwise
+# stated, subject to the terms and conditions of the GNU Affero General Public
+# License 3.0 (AGPL-3.0; https://www.gnu.org/licenses/agpl-3.0.en.html). This
+# documentation and associated code are provided "as is" and are not supported.
+# By using or downloading this code, the user agrees to the terms and conditions
+# set forth in this code and in the "Using Python to View OPeNDAP Files" document.
+#
+# Acknowledgment: This work was sponsored by the National Science Foundation.
+# This material is based upon work supported by the National Center for Atmospheric
+# Research, a major facility sponsored by the National Science Foundation and managed
+# by the University Corporation for Atmospheric Research. Any opinions, findings
+# and conclusions or recommendations expressed in this material do not necessarily
+# reflect the views of the National Science Foundation.
+#
+# To run this script, use the following command:
+#		python3 qcf_standin.py --rows 100000 --stations 50 --port 8700
+# and point the plotting scripts at http://127.0.0.1:8700/qcf (any path works).
+#
+# The following options may be added:
+#		--rows N		Number of rows of the dataset, 100000 by default
+#		--stations N		Number of stations, 50 by default
+#		--step SECONDS		Time between the reports of a station, 300 by default
+#		--start YYYY/mm/dd	Date of the first report, 2022/07/01 by default
+#		--latency SECONDS	Wait this long before answering each request
+#		--port N		Port to listen on, 8700 by default
+#		--fail-rate P		Fraction of the .dods requests that fail, 0 by default
+#
+# NOTE: This script requires the following packages to be installed:
+#		python3
+#		numpy
+#
+# The qcf_standin.py script is a small OPeNDAP (DAP2) server that serves a synthetic
+# NCAR/EOL QCF dataset, so the plotting scripts and the benchmarks of qcf_bench.py can
+# be run without the Field Data Archive. It is only meant for testing.
+#
+# The dataset has the field layout of the QCF sequence of the archive: the nominal and
+# actual dates and times, the network and platform names, the location of the station
+# and its measurement variables, stored as 32-bit floats with -999.99 for missing
+# values. Every station reports once every step seconds, and the rows are sorted by
+# time. The rows are made up from their row number whenever they are asked for, in
+# chunks of rows_per_chunk rows, so datasets of tens of millions of rows can be served
+# without holding them in memory.
+#
+# The server answers the .dds, .das and .dods requests of the plotting scripts,
+# including projections of the QCF fields and the selection clauses they send (=, !=,
+# <, <=, >, >= and lists of values in braces), and the row number constraint of the
+# sequence of downloads split into row ranges. Like the hyperslabs of other DAP2 servers
+# (e.g. pydap), rows are numbered from 0 and the range is one of [row], [first:last] or
+# [first:stride:last] with the last row included, given on its own among the projected
+# fields (QCF[0:1:99]) or on the sequence of a field (QCF[0:1:99].date).
+#
+# To test how the plotting scripts cope with an unreliable server, --fail-rate makes
+# that fraction of the .dods requests fail, at random: half of them are answered with a
+# 503 status, and the other half are cut off part way through the rows, by closing the
+# connection as if it had dropped.
+#
+# The script uses the following hard-coded entities that may need to be changed:
+#	rows_per_chunk: The number of rows made up and sent at a time
+#	missing_fraction: The fraction of the measurements that are missing
+#	last_modified: The Last-Modified date sent with every response
+#	fail_seed: The seed of the random failures of --fail-rate, so runs can be repeated
+# To change any of these values, simply search "HARD-CODED" in this script
+#
+
+# Import necessary packages:
+import argparse
+import operator
+import random
+import re
+import threading
+import time
+from datetime import datetime
+from socketserver import ThreadingMixIn
+from urllib.parse import unquote
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+import numpy as np
+
+
+#HARD-CODED
+rows_per_chunk = 1000000
+missing_fraction = 0.05
+last_modified = "Fri, 01 Jul 2022 00:00:00 GMT"
+fail_seed = 0
+
+sequence_name = "QCF"
+missing_value = -999.99
+
+# Fields of the sequence, in order: the String fields with their lengths, then the
+# Float32 fields. The measurement variables are given with the mean and the size of
+# their daily cycle.
+text_fields = [("date_nominal", 10), ("time_nominal", 8), ("date", 10), ("time", 8), ("network_name", 4), ("platform_name", 5)]
+station_fields = ["latitude", "longitude", "elevation"]
+measurements = [("stn_pres", 970, 5), ("sea_level_pres", 1013, 5), ("temp_air", 25, 8), ("dew_point", 15, 4), ("wind_speed", 5, 3), ("wind_dir", 180, 90)]
+fields = [i[0] for i in text_fields] + station_fields + [i[0] for i in measurements]
+
+# Units of the Float32 fields, sent in the DAS
+units = {"latitude": "degrees_north", "longitude": "degrees_east", "elevation": "m", "stn_pres": "hPa", "sea_level_pres": "hPa", "temp_air": "celsius", "dew_point": "celsius", "wind_speed": "m/s", "wind_dir": "degrees"}
+
+# Comparisons allowed in selection clauses
+selection_ops = {
+	"=": operator.eq,
+	"!=": operator.ne,
+	"<": operator.lt,
+	"<=": operator.le,
+	">": operator.gt,
+	">=": operator.ge,
+}
+
+
+# Functions:
+
+# makeChunk(first, count, stations, step, start) function makes up the rows first to
+# first+count-1 of the dataset and returns them as a dictionary of numpy arrays. The
+# same row always gets the same values.
+def makeChunk(first, count, stations, step, start):
+	row = np.arange(first, first + count, dtype=np.int64)
+	station = row % stations
+	seconds = row // stations * step
+
+# Dates and times are made once for every time in the chunk. The actual time is the
+# same as the nominal time.
+	(times, slot) = np.unique(seconds, return_inverse=True)
+	stamps = np.datetime64(start, "s") + times.astype("timedelta64[s]")
+	text = np.datetime_as_string(stamps, unit="s").astype("S19")
+	columns = {}
+	columns["date_nominal"] = np.char.replace(text.astype("S10"), b"-", b"/")[slot]
+	columns["time_nominal"] = text.view("S1").reshape(-1, 19)[:, 11:].copy().view("S8").reshape(-1)[slot]
+	columns["date"] = columns["date_nominal"]
+	columns["time"] = columns["time_nominal"]
+
+# Stations are spread over the networks and placed with a fixed seed
+	columns["network_name"] = np.char.add(b"NET", (station % 4).astype("S1"))
+	columns["platform_name"] = np.char.add(b"S", np.char.zfill(station.astype("S4"), 4))
+	place = np.random.default_rng(0)
+	columns["latitude"] = (34 + place.random(stations) * 4).astype(">f4")[station]
+	columns["longitude"] = (-100 + place.random(stations) * 5).astype(">f4")[station]
+	columns["elevation"] = (300 + np.arange(stations)).astype(">f4")[station]
+
+# Measurements follow a daily cycle with some noise and missing values
+	hours = seconds / 3600.0
+	for (n, (name, mean, size)) in enumerate(measurements):
+		noise = np.sqrt(-2 * np.log(1 - rowRandom(row, 3 * n))) * np.cos(2 * np.pi * rowRandom(row, 3 * n + 1))
+		values = mean + size * np.sin(hours * 2 * np.pi / 24 + station) + 0.5 * noise
+		values[rowRandom(row, 3 * n + 2) < missing_fraction] = missing_value
+		columns[name] = values.astype(">f4")
+	return columns
+
+
+# rowRandom(row, salt) function returns a random number between 0 and 1 for each row
+# number, which only depends on the row number and the salt, so a row has the same values
+# whichever rows are asked for with it.
+def rowRandom(row, salt):
+	x = row.astype(np.uint64) + np.uint64((salt * 0x632be59bd9b4e019 + 0x9e3779b97f4a7c15) % 2**64)
+	x = x * np.uint64(0xbf58476d1ce4e5b9)
+	x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94d049bb133111eb)
+	x ^= x >> np.uint64(31)
+	return (x >> np.uint64(11)).astype(np.float64) / 2.0**53
+
+
+# datasetDds(names, dataset) function returns the DDS of the dataset holding the given
+# fields of the sequence.
+def datasetDds(names, dataset):
+	lines = ["Dataset {", "    Sequence {"]
+	for name in names:
+		lines.append("        %s %s;" % ("String" if name in dict(text_fields) else "Float32", name))
+	lines += ["    } %s;" % sequence_name, "} %s;" % dataset]
+	return "\n".join(lines) + "\n"
+
+
+# datasetDas(names) function returns the DAS of the dataset holding the given fields.
+def datasetDas(names):
+	lines = ["Attributes {", "    %s {" % sequence_name]
+	for name in names:
+		lines += ["        %s {" % name]
+		if name not in dict(text_fields):
+			lines += ["            Float32 missing_value %s;" % missing_value, '            String units "%s";' % units[name]]
+		lines += ["        }"]
+	lines += ["    }", "}"]
+	return "\n".join(lines) + "\n"
+
+
+# parseValue(text) function converts the value of a selection clause to bytes for a
+# quoted string, a float for a number, or a list of those for values in braces.
+def parseValue(text):
+	text = text.strip()
+	if text.startswith("{"):
+		return [parseValue(i) for i in re.findall(r'"[^"]*"|[^,{}]+', text[1:-1])]
+	if text.startswith('"'):
+		return text[1:-1].encode("ascii")
+	return float(text)
+
+
+# parseHyperslab(text) function returns the (first, stride, last) row numbers of the
+# hyperslab of a sequence, given as row, first:last or first:stride:last.
+def parseHyperslab(text):
+	numbers = [int(i) for i in text.split(":")]
+	if len(numbers) == 1:
+		return numbers[0], 1, numbers[0]
+	if len(numbers) == 2:
+		return numbers[0], 1, numbers[1]
+	if len(numbers) == 3 and numbers[1] > 0:
+		return tuple(numbers)
+	raise ValueError("Invalid hyperslab: [" + text + "]")
+
+
+# parseConstraint(query) function splits a constraint expression into the list of
+# projected fields (all of them if none are given), the list of (field, op, value)
+# selection clauses, and the (first, stride, last) row numbers asked for (None for all
+# of the rows).
+def parseConstraint(query):
+	parts = [i for i in unquote(query).split("&") if i]
+	names = list(fields)
+	rowRange = None
+	if parts and not re.search(r"[<>=]", parts[0]):
+		names = []
+		for name in parts.pop(0).split(","):
+			match = re.match(r"\s*%s\[([\d:]+)\](?:\.(\w+))?\s*$" % sequence_name, name)
+			if match is None:
+				names.append(name.strip().split(".", 1)[-1])
+				continue
+			rowRange = parseHyperslab(match.group(1))
+			if match.group(2):
+				names.append(match.group(2))
+		names = names or list(fields)
+	clauses = []
+	for part in parts:
+		match = re.match(r"\s*(?:%s\.)?(\w+)\s*(<=|>=|!=|=|<|>)(.*)$" % sequence_name, part)
+		if match is None:
+			raise ValueError("Invalid selection clause: " + part)
+		clauses.append((match.group(1), match.group(2), parseValue(match.group(3))))
+	for name in names + [i[0] for i in clauses]:
+		if name not in fields:
+			raise ValueError("No such field: " + name)
+	return names, clauses, rowRange
+
+
+# selectRows(columns, clauses) function returns a boolean array that is True for the
+# rows of the chunk that pass all of the selection clauses.
+def selectRows(columns, clauses):
+	keep = np.ones(len(columns["date"]), dtype=bool)
+	for (name, op, value) in clauses:
+		column = columns[name]
+		if column.dtype.kind == "f":
+			column = column.astype(np.float64)
+		if isinstance(value, list):
+			match = np.zeros(len(column), dtype=bool)
+			for i in value:
+				match |= selection_ops[op](column, i)
+			keep &= match
+		else:
+			keep &= selection_ops[op](column, value)
+	return keep
+
+
+# encodeRows(columns, names, rows) function encodes the given rows of the chunk as the
+# instances of a DAP2 sequence, one start-of-instance marker and the projected fields
+# each.
+def encodeRows(columns, names, rows):
+	layout = [("marker", ">u4")]
+	for name in names:
+		column = columns[name]
+		if column.dtype.kind == "S":
+			n = column.dtype.itemsize
+			layout += [(name + "_length", ">u4"), (name, "S%d" % n)]
+			if n % 4:
+				layout.append((name + "_pad", "V%d" % (4 - n % 4)))
+		else:
+			layout.append((name, ">f4"))
+	out = np.zeros(len(rows), dtype=layout)
+	out["marker"] = 0x5a000000
+	for name in names:
+		out[name] = columns[name][rows]
+		if columns[name].dtype.kind == "S":
+			out[name + "_length"] = columns[name].dtype.itemsize
+	return out.tobytes()
+
+
+# streamRows(names, clauses, rows, stations, step, start, rowRange) function yields the
+# encoded instances of the rows that pass the selection clauses, one chunk at a time,
+# followed by the end-of-sequence marker. Only the rows of the (first, stride, last) row
+# numbers are sent if they are given.
+def streamRows(names, clauses, rows, stations, step, start, rowRange=None):
+	(low, stride, high) = rowRange or (0, 1, rows - 1)
+	high = min(high, rows - 1)
+	for first in range(low, high + 1, rows_per_chunk):
+		columns = makeChunk(first, min(rows_per_chunk, high + 1 - first), stations, step, start)
+		keep = np.nonzero(selectRows(columns, clauses) & ((np.arange(len(columns["date"])) + first - low) % stride == 0))[0]
+		if len(keep):
+			yield encodeRows(columns, names, keep)
+	yield b"\xa5\x00\x00\x00"
+
+
+# makeApp(rows, stations, step, start, latency, failRate) function returns the WSGI
+# application serving the synthetic dataset, failing the given fraction of the .dods
+# requests.
+def makeApp(rows, stations=50, step=300, start="2022/07/01", latency=0, failRate=0):
+	start = datetime.strptime(start, "%Y/%m/%d")
+	failures = random.Random(fail_seed)
+	lock = threading.Lock()
+	def app(environ, start_response):
+		if latency:
+			time.sleep(latency)
+		path = environ.get("PATH_INFO", "")
+		dataset = path.rstrip("/").rsplit("/", 1)[-1].split(".")[0] or "qcf"
+		try:
+			(names, clauses, rowRange) = parseConstraint(environ.get("QUERY_STRING", ""))
+		except ValueError as e:
+			start_response("400 Bad Request", [("Content-Type", "text/plain")])
+			return [str(e).encode("ascii")]
+		headers = [("Content-Type", "application/octet-stream"), ("Last-Modified", last_modified)]
+		if path.endswith(".dds"):
+			body = datasetDds(names, dataset).encode("ascii")
+		elif path.endswith(".das"):
+			body = datasetDas(names).encode("ascii")
+		elif path.endswith(".dods"):
+			with lock:
+				(fail, cut) = (failures.random() < failRate, failures.random())
+			if fail and cut < 0.5:
+				start_response("503 Service Unavailable", [("Content-Type", "text/plain")])
+				return [b"Injected failure"]
+			start_response("200 OK", headers)
+			header = (datasetDds(names, dataset) + "\nData:\n").encode("ascii")
+			body = chainBody(header, streamRows(names, clauses, rows, stations, step, start, rowRange))
+			return cutBody(body, cut) if fail else body
+		else:
+			start_response("404 Not Found", [("Content-Type", "text/plain")])
+			return [b"Not found"]
+		start_response("200 OK", headers + [("Content-Length", str(len(body)))])
+		return [body]
+	return app
+
+
+# chainBody(header, pieces) function yields the header of a response and then its pieces.
+def chainBody(header, pieces):
+	yield header
+	for piece in pieces:
+		yield piece
+
+
+# cutBody(pieces, fraction) function yields the pieces of a response up to the given
+# fraction (between 0.5 and 1) of its length, and then ends it, so the connection is
+# closed before the end of the sequence. The whole response is made first to know its
+# length.
+def cutBody(pieces, fraction):
+	pieces = list(pieces)
+	keep = int(sum(len(i) for i in pieces) * 2 * (fraction - 0.5))
+	for piece in pieces:
+		if keep < len(piece):
+			yield piece[:keep]
+			return
+		keep -= len(piece)
+		yield piece
+
+
+# Server that answers each request in its own thread, like an archive server would
+class ThreadingServer(ThreadingMixIn, WSGIServer):
+	daemon_threads = True
+
+
+# Request handler that does not print every request
+class QuietHandler(WSGIRequestHandler):
+	def log_message(self, *args):
+		pass
+
+
+# makeServer(port, rows, stations, step, start, latency, failRate) function returns a
+# server for the synthetic dataset on the given port of this machine (0 for any free
+# port). Call its serve_forever() method to start it.
+def makeServer(port, rows, stations=50, step=300, start="2022/07/01", latency=0, failRate=0):
+	return make_server("127.0.0.1", port, makeApp(rows, stations, step, start, latency, failRate), server_class=ThreadingServer, handler_class=QuietHandler)
+
+
+# main(argv) function runs the server until it is interrupted.
+def main(argv=None):
+	parser = argparse.ArgumentParser(description="Serve a synthetic NCAR/EOL QCF dataset over OPeNDAP for testing.")
+	parser.add_argument("--rows", type=int, default=100000, help="number of rows of the dataset")
+	parser.add_argument("--stations", type=int, default=50, help="number of stations")
+	parser.add_argument("--step", type=int, default=300, help="seconds between the reports of a station")
+	parser.add_argument("--start", default="2022/07/01", help="date of the first report, YYYY/mm/dd")
+	parser.add_argument("--latency", type=float, default=0, help="seconds to wait before answering each request")
+	parser.add_argument("--port", type=int, default=8700, help="port to listen on")
+	parser.add_argument("--fail-rate", type=float, default=0, help="fraction of the .dods requests that fail (503 or cut off)")
+	args = parser.parse_args(argv)
+	server = makeServer(args.port, args.rows, args.stations, args.step, args.start, args.latency, args.fail_rate)
+	print("Serving " + str(args.rows) + " rows at http://127.0.0.1:" + str(server.server_port) + "/qcf")
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+
+
+if __name__ == "__main__":
+	main()